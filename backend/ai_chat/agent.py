@@ -1,11 +1,13 @@
 import os
+from functools import lru_cache
 from typing import Annotated, Sequence, TypedDict
 from langchain_core.messages import BaseMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
+from .genai_clients import ClientRegistry, chat_model
+from .rate_limits import rate_limiter
 from .ai_tools import (
     search_patients,
     analyze_patient_records,
@@ -39,6 +41,53 @@ tools = [
 
 # 3. Define the Nodes
 
+# The instruction is the same on every step except for the hospital ID appended at the end
+SYSTEM_INSTRUCTION = (
+    "You are Swasthya AI, a helpful medical assistant for doctors.\n"
+    "You have legitimate access to patient data via tools.\n"
+    "Use 'analyze_patient_records' to find patients by symptoms, medical history, or descriptions (Semantic Search).\n"
+    "Pass gender, blood group, status, age range, admission (has_room) and registration dates to 'analyze_patient_records' as filter arguments rather than in the query text.\n"
+    "Set all_hospitals=True on 'analyze_patient_records' only when the user asks to search across all hospitals or the whole network.\n"
+    "Use 'search_patients' to find patients by exact name before updating.\n"
+    "ALWAYS confirm with the user before finalizing an update if unsure.\n"
+    "When a doctor is selected, when booking an appointment, or when a user inquires about doctor availability, you MUST call 'get_doctor_timeslots' to fetch that doctor's timeslots for the specified date and list them so the user can choose. If no date is specified, ask the user for a date first.\n"
+    "When presenting a patient profile, list of doctors, doctor timeslots, or appointment booking confirmations, ALWAYS output structural blocks so the frontend renders them as beautiful cards. Format them as follows:\n\n"
+    "For Patients:\n"
+    "Patient ID: [ID]\n"
+    "Name: [First Name] [Last Name]\n"
+    "Gender: [Male/Female]\n"
+    "DOB: [YYYY-MM-DD]\n"
+    "Phone: [Contact Number]\n"
+    "Medical History: [History summary]\n\n"
+    "For Doctor Timeslots:\n"
+    "Doctor Schedule for [Date]\n"
+    "Doctor: [Doctor Name]\n"
+    "Date: [YYYY-MM-DD]\n"
+    "Day: [Day of Week]\n"
+    "Slots:\n"
+    "  - [HH:MM] - [Available/Booked]\n"
+    "  - [HH:MM] - [Available/Booked]\n\n"
+    "For Appointment confirmations:\n"
+    "Successfully booked appointment\n"
+    "Appointment ID: [ID]\n"
+    "Patient: [Name]\n"
+    "Doctor: [Doctor Name]\n"
+    "Date: [YYYY-MM-DD]\n"
+    "Time: [HH:MM]\n\n"
+    "Use Markdown **bolding** for emphasizing labels.\n"
+)
+
+@lru_cache(maxsize=256)
+def system_message(hospital_id) -> SystemMessage:
+    return SystemMessage(content=f"{SYSTEM_INSTRUCTION}Current Hospital ID context: {hospital_id}\n")
+
+def _bind_model(api_key, model_name, temperature):
+    return chat_model(api_key, model_name, temperature=temperature, thinking_level="minimal").bind_tools(tools)
+
+# Binding serializes every tool schema, so the bound model is kept per (API key, model, temperature)
+# and reused by every step of every conversation instead of being rebuilt on each graph step
+bound_models = ClientRegistry('agent', _bind_model)
+
 def call_model(state: AgentState):
     """Invokes the model with state messages and system instructions containing hospital context."""
     from users.context import get_gemini_api_key
@@ -46,54 +95,15 @@ def call_model(state: AgentState):
     api_key = get_gemini_api_key()
     model_name = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
     
-    llm = ChatGoogleGenerativeAI(
-        model=model_name,
-        temperature=0.2,
-        google_api_key=api_key,
-        thinking_level="minimal"
-    )
-    llm_with_tools = llm.bind_tools(tools)
+    llm_with_tools = bound_models.get(api_key, model_name, 0.2)
+    # Waits briefly for the key's chat budget, else raises RateLimited for the view to report
+    rate_limiter.acquire(api_key, 'chat')
     
     hospital_id = state.get("hospital_id")
     messages = state["messages"]
     
-    system_instruction = (
-        "You are Swasthya AI, a helpful medical assistant for doctors.\n"
-        "You have legitimate access to patient data via tools.\n"
-        "Use 'analyze_patient_records' to find patients by symptoms, medical history, or descriptions (Semantic Search).\n"
-        "Use 'search_patients' to find patients by exact name before updating.\n"
-        "ALWAYS confirm with the user before finalizing an update if unsure.\n"
-        "When a doctor is selected, when booking an appointment, or when a user inquires about doctor availability, you MUST call 'get_doctor_timeslots' to fetch that doctor's timeslots for the specified date and list them so the user can choose. If no date is specified, ask the user for a date first.\n"
-        "When presenting a patient profile, list of doctors, doctor timeslots, or appointment booking confirmations, ALWAYS output structural blocks so the frontend renders them as beautiful cards. Format them as follows:\n\n"
-        "For Patients:\n"
-        "Patient ID: [ID]\n"
-        "Name: [First Name] [Last Name]\n"
-        "Gender: [Male/Female]\n"
-        "DOB: [YYYY-MM-DD]\n"
-        "Phone: [Contact Number]\n"
-        "Medical History: [History summary]\n\n"
-        "For Doctor Timeslots:\n"
-        "Doctor Schedule for [Date]\n"
-        "Doctor: [Doctor Name]\n"
-        "Date: [YYYY-MM-DD]\n"
-        "Day: [Day of Week]\n"
-        "Slots:\n"
-        "  - [HH:MM] - [Available/Booked]\n"
-        "  - [HH:MM] - [Available/Booked]\n\n"
-        "For Appointment confirmations:\n"
-        "Successfully booked appointment\n"
-        "Appointment ID: [ID]\n"
-        "Patient: [Name]\n"
-        "Doctor: [Doctor Name]\n"
-        "Date: [YYYY-MM-DD]\n"
-        "Time: [HH:MM]\n\n"
-        "Use Markdown **bolding** for emphasizing labels.\n"
-        f"Current Hospital ID context: {hospital_id}\n"
-    )
-    
     # Inject system instruction as the very first message
-    system_message = SystemMessage(content=system_instruction)
-    all_messages = [system_message] + list(messages)
+    all_messages = [system_message(hospital_id)] + list(messages)
     
     # Invoke model
     response = llm_with_tools.invoke(all_messages)
@@ -1,7 +1,7 @@
 from patients.models import Patient
 from appointments.models import Appointment, DoctorTimeslot
 from employees.models import Employee
-from .rag_utils import semantic_search_patients
+from .rag_utils import search_patients_network, semantic_search_patients
 from django.db.models import Q
 import datetime
 from langchain_core.tools import tool
@@ -45,13 +45,36 @@ def parse_date_flexible(date_str: str) -> datetime.date:
 # --- Tool Functions ---
 
 @tool
-def analyze_patient_records(query: str, hospital_id: int = None):
+def analyze_patient_records(
+    query: str,
+    hospital_id: int = None,
+    gender: str = None,
+    blood_group: str = None,
+    status: str = None,
+    min_age: int = None,
+    max_age: int = None,
+    has_room: bool = None,
+    created_after: str = None,
+    created_before: str = None,
+    all_hospitals: bool = None
+):
     """
     Use this tool to semantically search and analyze patient records based on a descriptive query.
-    Examples: "Find patients with back pain", "Who are the diabetic patients?", "What are John's symptoms?"
+    Examples: "Find patients with back pain", "Who are the diabetic patients?", "Who is on Metformin?", "HbA1c results"
+    Put structured criteria in the filter arguments instead of the query, e.g. "female diabetic patients over 60
+    currently admitted" -> query="diabetes", gender="F", min_age=60, has_room=True.
     Args:
         query: The detailed medical or descriptive query to search for.
         hospital_id: The ID of the hospital to search in. (Optional)
+        gender: Only patients of this gender ('M' for Male, 'F' for Female, 'O' for Other). (Optional)
+        blood_group: Only patients with this blood group, e.g. 'O+' or 'AB-'. (Optional)
+        status: Only patients with this status ('new' or 'active'). (Optional)
+        min_age: Only patients at least this many years old. (Optional)
+        max_age: Only patients at most this many years old. (Optional)
+        has_room: True for patients currently admitted to a room, False for patients not admitted. (Optional)
+        created_after: Only patients registered on or after this date (YYYY-MM-DD). (Optional)
+        created_before: Only patients registered on or before this date (YYYY-MM-DD). (Optional)
+        all_hospitals: True to search every hospital the user has access to at once (network administrators). (Optional)
     """
     if hospital_id is not None:
         try:
@@ -64,11 +87,40 @@ def analyze_patient_records(query: str, hospital_id: int = None):
         h = Hospital.objects.first()
         hospital_id = h.id if h else 1
 
-    print(f"RAG Search Query: {query} for hospital_id: {hospital_id}")
-    results = semantic_search_patients(query, hospital_id, limit=3)
+    filters = {
+        'blood_group': blood_group.strip().upper() if blood_group else None,
+        'status': status.strip().lower() if status else None,
+        'has_room': has_room,
+    }
+    if gender:
+        gender_val = gender.strip().upper()
+        filters['gender'] = 'M' if gender_val.startswith('M') else 'F' if gender_val.startswith('F') else 'O'
+    try:
+        filters['min_age'] = int(min_age) if min_age is not None else None
+        filters['max_age'] = int(max_age) if max_age is not None else None
+        filters['created_after'] = parse_date_flexible(created_after) if created_after else None
+        filters['created_before'] = parse_date_flexible(created_before) if created_before else None
+    except ValueError as e:
+        return f"Error: {e}"
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    hospital_names = {}
+    if all_hospitals:
+        from hospitals.models import Hospital
+        from users.access import accessible_hospital_ids
+        from users.context import get_current_user
+        hospital_ids = accessible_hospital_ids(get_current_user())
+        if not hospital_ids:
+            return "Error: You do not have access to any hospital's patient records."
+        print(f"RAG Network Search Query: {query} across {len(hospital_ids)} hospitals with filters: {filters}")
+        results = search_patients_network(query, hospital_ids, limit=3, filters=filters)
+        hospital_names = dict(Hospital.objects.filter(pk__in={res['hospital_id'] for res in results}).values_list('pk', 'name'))
+    else:
+        print(f"RAG Search Query: {query} for hospital_id: {hospital_id} with filters: {filters}")
+        results = semantic_search_patients(query, hospital_id, limit=3, filters=filters)
     
     if not results:
-        return f"No relevant patients found for the query: '{query}'."
+        return f"No relevant patients found for the query: '{query}'" + (f" with filters {filters}." if filters else ".")
         
     output = []
     output.append(f"Found {len(results)} relevant patients:")
@@ -76,6 +128,8 @@ def analyze_patient_records(query: str, hospital_id: int = None):
         score = res['score']
         text = res['text']
         output.append(f"\n--- Patient {i+1} (Relevance Score: {score:.2f}) ---")
+        if 'hospital_id' in res:
+            output.append(f"Hospital: {hospital_names.get(res['hospital_id'], 'Unknown')} (ID {res['hospital_id']})")
         output.append(text)
         
     return "\n".join(output)
@@ -345,11 +399,8 @@ def update_patient(
         return "No fields provided to update."
 
     try:
+        # Saving queues a background re-embed of the patient
         patient.save()
-        if any(f in updates for f in ["first_name", "last_name", "symptoms", "medical_history", "address"]):
-            patient.embedding_json = None
-            patient.save(update_fields=["embedding_json"])
-            
         return f"Successfully updated patient {patient.first_name} {patient.last_name} (ID: {patient.id}) fields: {', '.join(updates)}."
     except Exception as e:
         return f"Error updating patient: {str(e)}"
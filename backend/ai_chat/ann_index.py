@@ -0,0 +1,236 @@
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+POINTER_FILE = 'current.json'
+ARRAYS = ('centroids', 'offsets', 'ids', 'groups', 'vectors')
+
+
+def ann_root() -> Path:
+    return Path(getattr(settings, 'AI_ANN_DIR', Path(settings.BASE_DIR) / 'var' / 'ann'))
+
+
+def fingerprint_token(fingerprint) -> list:
+    """JSON-safe form of a (count, latest) fingerprint, so it can be stored with an index build."""
+    count, latest = fingerprint
+    return [count, latest.isoformat() if latest is not None else None]
+
+
+def default_list_count(rows: int) -> int:
+    return max(1, min(rows, int(round(math.sqrt(rows)))))
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Nearest centroid (by cosine) of every row, computed in blocks to bound memory."""
+    labels = np.empty(matrix.shape[0], dtype=np.int64)
+    for start in range(0, matrix.shape[0], block):
+        labels[start:start + block] = np.argmax(matrix[start:start + block] @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(matrix: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0,
+                    max_training_rows: int = 128) -> np.ndarray:
+    """
+    Spherical k-means on unit rows. Trains on at most max_training_rows points per list,
+    which is plenty for stable centroids and keeps builds fast on large hospitals.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(matrix.shape[0], n_lists * max_training_rows)
+    sample = matrix[rng.choice(matrix.shape[0], sample_size, replace=False)] if sample_size < matrix.shape[0] else matrix
+    centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        # Sum each list's members as contiguous runs of the label-sorted sample (np.add.at is far slower)
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists with random points so every list stays in use
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def build_ivf(ids, groups, matrix: np.ndarray, n_lists: int | None = None, iterations: int = 10, seed: int = 0) -> dict:
+    """
+    Builds an inverted-file index over unit rows: rows are clustered into n_lists lists
+    and stored sorted by list, so each list is one contiguous slice of the vector file.
+    """
+    n_lists = n_lists or default_list_count(matrix.shape[0])
+    centroids = train_centroids(matrix, n_lists, iterations=iterations, seed=seed)
+    labels = _assign(matrix, centroids)
+    order = np.argsort(labels, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+    return {
+        'centroids': centroids,
+        'offsets': offsets,
+        'ids': np.asarray(ids, dtype=np.int64)[order],
+        'groups': np.asarray(groups, dtype=np.int64)[order],
+        'vectors': np.ascontiguousarray(matrix[order], dtype=np.float32),
+    }
+
+
+def write_generation(kind: str, hospital_id: int, arrays: dict, meta: dict, keep: int = 2, root: Path | None = None) -> int:
+    """
+    Saves an index build as the next numbered version and atomically points current.json
+    at it. Workers notice the new pointer on their next staleness check. Returns the version.
+    """
+    directory = (root or ann_root()) / kind / str(hospital_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    versions = sorted(int(p.name[1:]) for p in directory.glob('v*') if p.name[1:].isdigit())
+    version = (versions[-1] if versions else 0) + 1
+
+    staging = directory / f".v{version}.{os.getpid()}.tmp"
+    staging.mkdir()
+    for name, array in arrays.items():
+        if array is not None:
+            np.save(staging / f"{name}.npy", array)
+    (staging / 'meta.json').write_text(json.dumps({**meta, 'version': version}))
+    os.replace(staging, directory / f"v{version}")
+
+    pointer = directory / f".{POINTER_FILE}.{os.getpid()}.tmp"
+    pointer.write_text(json.dumps({'version': version}))
+    os.replace(pointer, directory / POINTER_FILE)
+
+    # Older versions may still be mapped by running workers; only prune beyond `keep`
+    for old in versions[:max(0, len(versions) + 1 - keep)]:
+        shutil.rmtree(directory / f"v{old}", ignore_errors=True)
+    return version
+
+
+class AnnGeneration:
+    """One memory-mapped index build. Pages are shared by every process that maps the files."""
+
+    __slots__ = ('version', 'meta', 'centroids', 'offsets', 'ids', 'groups', 'vectors')
+
+    def __init__(self, path: Path):
+        self.meta = json.loads((path / 'meta.json').read_text())
+        self.version = self.meta['version']
+        for name in ARRAYS:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode='r'))
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+
+class AnnIndex:
+    """
+    Reader for the IVF indexes written by `manage.py build_ann_index`.
+
+    candidates() scores only the nprobe lists whose centroids are closest to the query.
+    It returns None whenever the build is missing, for another model, or stale (the
+    database fingerprint moved since it was built). Callers then fall back to exact search.
+    Freshness is re-checked at most every refresh_interval seconds.
+    """
+
+    def __init__(self, kind: str, fingerprint, refresh_interval: float = 30.0, nprobe: int = 8):
+        self.kind = kind
+        self.nprobe = nprobe
+        self._fingerprint = fingerprint
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # hospital_id -> (generation or None, usable, checked_at)
+        self._state: dict[int, tuple] = {}
+
+    def invalidate(self, hospital_id: int | None = None) -> None:
+        """Forces the next search to re-read the build pointer and re-check freshness."""
+        with self._lock:
+            if hospital_id is None:
+                self._state.clear()
+            else:
+                self._state.pop(hospital_id, None)
+
+    def _open(self, hospital_id: int, current: AnnGeneration | None) -> AnnGeneration | None:
+        directory = ann_root() / self.kind / str(hospital_id)
+        try:
+            version = json.loads((directory / POINTER_FILE).read_text())['version']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        if current is not None and current.version == version:
+            return current
+        try:
+            return AnnGeneration(directory / f"v{version}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not open ANN index {self.kind}/{hospital_id} v{version}: {e}")
+            return None
+
+    def generation(self, hospital_id: int) -> AnnGeneration | None:
+        """The current build for the hospital if it is usable, else None."""
+        from .embedding_providers import active_model_name
+
+        now = time.monotonic()
+        with self._lock:
+            generation, usable, checked_at = self._state.get(hospital_id, (None, False, None))
+            if checked_at is not None and now - checked_at < self._refresh_interval:
+                return generation if usable else None
+
+            generation = self._open(hospital_id, generation)
+            usable = (
+                generation is not None
+                and generation.meta.get('model') == active_model_name()
+                and generation.meta.get('fingerprint') == fingerprint_token(self._fingerprint(hospital_id))
+            )
+            if generation is not None and not usable:
+                logger.info(f"ANN index {self.kind}/{hospital_id} v{generation.version} is stale, using exact search")
+            self._state[hospital_id] = (generation, usable, now)
+            return generation if usable else None
+
+    def candidates(self, hospital_id: int, query_vector, nprobe: int | None = None, allowed: np.ndarray | None = None):
+        """
+        Returns (ids, groups, cosine scores) of the rows in the probed lists, or None.
+        Rows whose group is not in `allowed` are dropped; when the filter keeps fewer rows
+        than the probe would scan, those rows are scored exactly instead.
+        """
+        generation = self.generation(hospital_id)
+        if generation is None:
+            metrics.incr(f"ann.{self.kind}.fallbacks")
+            return None
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if query.shape[0] != generation.centroids.shape[1] or norm == 0:
+            return None
+        query = query / norm
+
+        nprobe = min(nprobe or self.nprobe, generation.centroids.shape[0])
+        if allowed is not None:
+            mask = np.isin(generation.groups, allowed)
+            if int(mask.sum()) * generation.centroids.shape[0] <= len(generation) * nprobe:
+                rows = np.flatnonzero(mask)
+                metrics.incr(f"ann.{self.kind}.filtered_exact")
+                return generation.ids[rows], generation.groups[rows], generation.vectors[rows] @ query
+        centroid_scores = generation.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        ranges = [(int(generation.offsets[p]), int(generation.offsets[p + 1])) for p in probe]
+        ranges = [(start, end) for start, end in ranges if end > start]
+        metrics.incr(f"ann.{self.kind}.searches")
+        if not ranges:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0, dtype=np.float32)
+
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        scores = np.concatenate([generation.vectors[start:end] @ query for start, end in ranges])
+        if allowed is not None:
+            keep = mask[rows]
+            rows, scores = rows[keep], scores[keep]
+        return generation.ids[rows], generation.groups[rows], scores
@@ -0,0 +1,75 @@
+from collections import namedtuple
+
+# Characters per chunk and how much consecutive chunks of the same source overlap,
+# so a sentence cut at a boundary still appears whole in one of the two chunks
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+ChunkSpec = namedtuple('ChunkSpec', ['source_type', 'source_id', 'position', 'text'])
+
+
+def split_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> list[str]:
+    """Splits text into overlapping windows of at most `size` characters, cut at word boundaries."""
+    text = ' '.join((text or '').split())
+    if not text:
+        return []
+    if len(text) <= size:
+        return [text]
+
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = text.rfind(' ', start + size // 2, end)
+            if cut != -1:
+                end = cut
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        space = text.find(' ', next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return chunks
+
+
+def patient_header(patient) -> str:
+    age_str = f" Born {patient.date_of_birth}." if patient.date_of_birth else ""
+    gender_str = "Male" if patient.gender == 'M' else "Female" if patient.gender == 'F' else "Other"
+    return f"Patient: {patient.first_name} {patient.last_name}, {gender_str}.{age_str}"
+
+
+def build_patient_chunks(patient, soap_notes, lab_reports) -> list[ChunkSpec]:
+    """
+    Splits every SOAP note, lab report and history field of a patient into chunks.
+    soap_notes and lab_reports are passed in so callers can prefetch them in bulk.
+    """
+    chunks = [ChunkSpec('profile', 0, 0, f"{patient_header(patient)} Address: {patient.address}.")]
+
+    position = 1
+    for label, value in (
+        ("Symptoms/Reason for visit", patient.symptoms),
+        ("Medical History", patient.medical_history),
+        ("Allergies", patient.allergies),
+    ):
+        for piece in split_text(value):
+            chunks.append(ChunkSpec('profile', 0, position, f"{label}: {piece}"))
+            position += 1
+
+    for note in soap_notes:
+        dr_name = f"Dr. {note.doctor.last_name}" if note.doctor else "Doctor"
+        body = (
+            f"Subjective: {note.subjective} Objective: {note.objective} "
+            f"Assessment: {note.assessment} Plan: {note.plan}"
+        )
+        prefix = f"Clinical note on {note.created_at.date()} by {dr_name}:"
+        for i, piece in enumerate(split_text(body)):
+            chunks.append(ChunkSpec('soap_note', note.pk, i, f"{prefix} {piece}"))
+
+    for report in lab_reports:
+        prefix = f"Lab report '{report.title}' (Uploaded {report.uploaded_at.date()}):"
+        pieces = split_text(report.extracted_text) or ["(No text extracted)"]
+        for i, piece in enumerate(pieces):
+            chunks.append(ChunkSpec('lab_report', report.pk, i, f"{prefix} {piece}"))
+
+    return chunks
@@ -0,0 +1,761 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .ann_index import AnnIndex, fingerprint_token
+from .embedding_providers import active_model_name
+from .shared_index import SharedIndexStore
+
+logger = logging.getLogger(__name__)
+
+
+# Stored vectors are little-endian float32 regardless of the host byte order
+VECTOR_DTYPE = np.dtype('<f4')
+
+
+def vector_to_bytes(vector) -> bytes:
+    """Serializes a vector into the compact binary form kept in PatientEmbedding.vector."""
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def vector_from_bytes(raw) -> np.ndarray:
+    """Zero-copy, read-only view over stored vector bytes (bytes or memoryview)."""
+    return np.frombuffer(raw, dtype=VECTOR_DTYPE)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Returns a float32 copy of the matrix with every row scaled to unit length."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Rows cast back to float32 at a time when scoring a quantized matrix, bounding the temporary copy
+SCORE_BLOCK_ROWS = 8192
+
+
+def quantize_rows(matrix: np.ndarray, mode: str = 'none'):
+    """
+    Compresses unit rows for storage. Returns (stored matrix, per-row scales or None):
+    'float16' halves memory, 'int8' quarters it with one float32 scale per row
+    (row ~= int8 row * scale), 'none' keeps float32.
+    """
+    if mode == 'float16':
+        return matrix.astype(np.float16), None
+    if mode == 'int8':
+        scales = np.abs(matrix).max(axis=1) / 127.0 if matrix.size else np.empty(0, dtype=np.float32)
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return matrix, None
+
+
+class HospitalSegment:
+    """
+    Immutable snapshot of one hospital's vectors: row-aligned id and group arrays plus a
+    unit-norm matrix. Groups name the patient a row belongs to; for patient-level vectors
+    the group is the row id itself. The matrix may be quantized (float16, or int8 with
+    per-row scales), in which case scores are approximate.
+    """
+
+    __slots__ = ('ids', 'groups', 'matrix', 'scales', 'shared')
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray, groups: np.ndarray | None = None,
+                 scales: np.ndarray | None = None, shared: bool = False):
+        self.ids = ids
+        self.groups = ids if groups is None else groups
+        self.matrix = matrix
+        self.scales = scales
+        # Arrays are memory-mapped from a published generation rather than owned by this process
+        self.shared = shared
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @property
+    def dimension(self) -> int:
+        return int(self.matrix.shape[1]) if self.matrix.ndim == 2 else 0
+
+    @property
+    def quantized(self) -> bool:
+        return self.matrix.dtype != np.float32
+
+    def scores(self, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """Dot products of a unit query with the given rows (all rows by default)."""
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if not self.quantized:
+            return matrix @ query
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+            scores[start:start + SCORE_BLOCK_ROWS] = matrix[start:start + SCORE_BLOCK_ROWS].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales if rows is None else self.scales[rows]
+        return scores
+
+    @property
+    def private_nbytes(self) -> int:
+        """Memory owned by this process (shared, memory-mapped arrays count as zero)."""
+        if self.shared:
+            return 0
+        groups = self.groups.nbytes if self.groups is not self.ids else 0
+        scales = self.scales.nbytes if self.scales is not None else 0
+        return self.ids.nbytes + groups + self.matrix.nbytes + scales
+
+
+class LayeredSegment:
+    """
+    A shared, read-only base segment seen through this process's unpublished changes:
+    base rows listed in `hidden` (removed or replaced) are skipped and `delta` rows are
+    appended. Only the small delta and the id arrays are private to the process.
+    """
+
+    __slots__ = ('base', 'delta', 'base_rows', 'ids', 'groups')
+
+    def __init__(self, base: HospitalSegment, delta: HospitalSegment, hidden: np.ndarray):
+        self.base = base
+        self.delta = delta
+        self.base_rows = np.flatnonzero(~np.isin(base.ids, hidden)) if hidden.size else None
+        base_ids = base.ids if self.base_rows is None else base.ids[self.base_rows]
+        base_groups = base.groups if self.base_rows is None else base.groups[self.base_rows]
+        self.ids = np.concatenate([base_ids, delta.ids])
+        self.groups = np.concatenate([base_groups, delta.groups])
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    @property
+    def dimension(self) -> int:
+        return self.base.dimension or self.delta.dimension
+
+    @property
+    def quantized(self) -> bool:
+        return self.base.quantized
+
+    @property
+    def private_nbytes(self) -> int:
+        base_rows = self.base_rows.nbytes if self.base_rows is not None else 0
+        return self.ids.nbytes + self.groups.nbytes + base_rows + self.delta.private_nbytes
+
+    def scores(self, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        visible = len(self.base) if self.base_rows is None else int(self.base_rows.shape[0])
+        if rows is None:
+            # Scoring every base row and dropping hidden ones avoids copying the shared matrix
+            base_scores = self.base.scores(query) if len(self.base) else np.empty(0, dtype=np.float32)
+            if self.base_rows is not None:
+                base_scores = base_scores[self.base_rows]
+            delta_rows = None
+        else:
+            base_rows = rows[rows < visible]
+            if self.base_rows is not None:
+                base_rows = self.base_rows[base_rows]
+            base_scores = self.base.scores(query, base_rows) if len(self.base) else np.empty(0, dtype=np.float32)
+            delta_rows = rows[rows >= visible] - visible
+        if not len(self.delta):
+            return base_scores
+        return np.concatenate([base_scores, self.delta.scores(query, delta_rows)])
+
+
+def load_patient_embeddings(hospital_id: int):
+    """Default loader: reads every stored patient vector for a hospital from the database."""
+    from patients.models import PatientEmbedding
+
+    ids = []
+    vectors = []
+    rows = PatientEmbedding.objects.filter(
+        patient__hospital_id=hospital_id, model_name=active_model_name()
+    ).values_list('patient_id', 'vector')
+    for patient_id, raw in rows.iterator(chunk_size=2000):
+        vector = vector_from_bytes(raw)
+        if vector.size:
+            ids.append(patient_id)
+            vectors.append(vector)
+    return ids, vectors, None
+
+
+def load_patient_chunks(hospital_id: int):
+    """Loader for the chunk index: one row per PatientChunk, grouped by patient."""
+    from patients.models import PatientChunk
+
+    ids, vectors, groups = [], [], []
+    rows = PatientChunk.objects.filter(
+        patient__hospital_id=hospital_id, model_name=active_model_name()
+    ).values_list('id', 'patient_id', 'vector')
+    for chunk_id, patient_id, raw in rows.iterator(chunk_size=5000):
+        vector = vector_from_bytes(raw)
+        if vector.size:
+            ids.append(chunk_id)
+            groups.append(patient_id)
+            vectors.append(vector)
+    return ids, vectors, groups
+
+
+def load_patient_vectors(row_ids) -> dict:
+    """Full-precision stored vectors of the given patients, for rescoring quantized matches."""
+    from patients.models import PatientEmbedding
+
+    rows = PatientEmbedding.objects.filter(
+        patient_id__in=list(row_ids), model_name=active_model_name()
+    ).values_list('patient_id', 'vector')
+    return {patient_id: vector_from_bytes(raw) for patient_id, raw in rows}
+
+
+def load_chunk_vectors(row_ids) -> dict:
+    from patients.models import PatientChunk
+
+    return {chunk_id: vector_from_bytes(raw) for chunk_id, raw in PatientChunk.objects.filter(
+        pk__in=list(row_ids), model_name=active_model_name()
+    ).values_list('id', 'vector')}
+
+
+def _fingerprint(model, hospital_id: int):
+    from django.db.models import Count, Max
+
+    summary = model.objects.filter(
+        patient__hospital_id=hospital_id, model_name=active_model_name()
+    ).aggregate(count=Count('id'), latest=Max('updated_at'))
+    return summary['count'], summary['latest']
+
+
+def patient_embeddings_fingerprint(hospital_id: int):
+    """Cheap (count, latest update) summary used to notice vectors written by other processes."""
+    from patients.models import PatientEmbedding
+    return _fingerprint(PatientEmbedding, hospital_id)
+
+
+def patient_chunks_fingerprint(hospital_id: int):
+    from patients.models import PatientChunk
+    return _fingerprint(PatientChunk, hospital_id)
+
+
+class EmbeddingIndex:
+    """
+    In-process vector index holding one pre-normalized (optionally quantized) matrix per hospital.
+
+    Segments are built lazily on the first search for a hospital. Changes made through
+    upsert/remove are buffered and folded into a fresh segment on the next search, so
+    concurrent readers always score against a consistent, never-mutated snapshot.
+
+    When a fingerprint function is given, a segment is re-checked against the database
+    at most every refresh_interval seconds and rebuilt if vectors were written by another
+    process (e.g. the embed_patients command).
+
+    With an AnnIndex attached, hospitals that have a fresh on-disk IVF build are searched
+    through it instead; the in-memory segment is only built for exact-search fallback.
+
+    With quantization set to 'float16' or 'int8', segments hold compressed rows. Every row
+    is scored approximately, then the best rescore_candidates rows are scored again against
+    the full-precision vectors returned by rescore(row_ids) (read from the database).
+
+    With a SharedIndexStore attached, hospitals that have a published generation are served
+    from its memory-mapped files, so server workers share one copy of each matrix instead
+    of building their own. Local upserts and removals are layered on top until the next
+    publish includes them; the name of the store's last published generation is compared
+    on every search and a newer generation is attached without restarting the process.
+
+    With a model function (returning the active embedding model name), each segment
+    remembers the model its loader read; it is rebuilt once another model becomes active,
+    and searches for a query vector of a different model are refused rather than scored.
+    """
+
+    def __init__(self, loader=load_patient_embeddings, fingerprint=None, refresh_interval: float = 30.0, ann=None,
+                 quantization: str = 'none', rescore=None, rescore_candidates: int = 200,
+                 shared: SharedIndexStore | None = None, model=None):
+        self.ann = ann
+        self.shared = shared
+        self._model = model
+        self.quantization = quantization
+        self._rescore = rescore
+        self._rescore_candidates = rescore_candidates
+        self._loader = loader
+        self._fingerprint = fingerprint
+        self._refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._segments: dict[int, HospitalSegment] = {}
+        # hospital_id -> {row_id: (unit vector, group) or None for a removal}
+        self._pending: dict[int, dict[int, tuple | None]] = {}
+        self._locations: dict[int, int] = {}
+        self._checks: dict[int, tuple] = {}
+        # hospital_id -> embedding model the segment was loaded for
+        self._models: dict[int, str] = {}
+        self._shared_version: str | None = None
+        # hospital_id -> (attached SharedGeneration, its base segment)
+        self._generations: dict[int, tuple] = {}
+        # hospital_id -> {row_id: (entry as in _pending, time folded in)} not yet in the generation
+        self._overlays: dict[int, dict[int, tuple]] = {}
+        self._attach_checked: set[int] = set()
+        # Per-hospital locks serialising cold builds; _building holds hospitals whose load is running
+        self._build_locks: dict[int, threading.Lock] = {}
+        self._building: set[int] = set()
+
+    # --- Maintenance ---
+
+    def load_segment(self, hospital_id: int) -> HospitalSegment:
+        """Reads the hospital's vectors through the loader into a new segment without installing it."""
+        loaded = self._loader(hospital_id)
+        ids, vectors = loaded[0], loaded[1]
+        groups = loaded[2] if len(loaded) > 2 and loaded[2] is not None else ids
+
+        dimension = None
+        kept_ids, kept_groups, kept_vectors = [], [], []
+        for row_id, group, vector in zip(ids, groups, vectors):
+            vector = np.asarray(vector, dtype=np.float32)
+            if dimension is None:
+                dimension = vector.shape[0]
+            if vector.shape[0] != dimension:
+                logger.warning(f"Skipping row {row_id}: embedding dimension {vector.shape[0]} != {dimension}")
+                continue
+            kept_ids.append(row_id)
+            kept_groups.append(group)
+            kept_vectors.append(vector)
+
+        if kept_vectors:
+            matrix, scales = quantize_rows(normalize_rows(np.vstack(kept_vectors)), self.quantization)
+        else:
+            matrix, scales = np.empty((0, 0), dtype=np.float32), None
+        return HospitalSegment(
+            np.asarray(kept_ids, dtype=np.int64), matrix, np.asarray(kept_groups, dtype=np.int64), scales
+        )
+
+    def _build_segment(self, hospital_id: int) -> tuple:
+        """Loads a fresh segment, returning it with the (model, check) to install alongside it."""
+        model = self._model() if self._model is not None else None
+        check = None
+        if self._fingerprint is not None:
+            # Taken before loading so writes racing with the load trigger another rebuild
+            check = (self._fingerprint(hospital_id), time.monotonic())
+        return self.load_segment(hospital_id), model, check
+
+    def _apply_pending(self, segment: HospitalSegment, pending: dict) -> HospitalSegment:
+        keep = ~np.isin(segment.ids, np.fromiter(pending.keys(), dtype=np.int64, count=len(pending)))
+        ids = segment.ids[keep]
+        groups = segment.groups[keep]
+        matrix = segment.matrix[keep] if len(segment) else segment.matrix
+        scales = segment.scales[keep] if segment.scales is not None and len(segment) else None
+
+        added = [(row_id, entry) for row_id, entry in pending.items() if entry is not None]
+        if added:
+            dimension = segment.dimension if len(ids) else added[0][1][0].shape[0]
+            added = [(row_id, entry) for row_id, entry in added if entry[0].shape[0] == dimension]
+            new_ids = np.fromiter((row_id for row_id, _ in added), dtype=np.int64, count=len(added))
+            new_groups = np.fromiter((entry[1] for _, entry in added), dtype=np.int64, count=len(added))
+            new_rows = np.vstack([entry[0] for _, entry in added]) if added else np.empty((0, dimension), dtype=np.float32)
+            new_rows, new_scales = quantize_rows(new_rows, self.quantization)
+            if len(ids):
+                matrix = np.vstack([matrix, new_rows])
+                scales = None if scales is None else np.concatenate([scales, new_scales])
+            else:
+                matrix, scales = new_rows, new_scales
+            ids = np.concatenate([ids, new_ids])
+            groups = np.concatenate([groups, new_groups])
+        return HospitalSegment(ids, matrix, groups, scales)
+
+    def _is_stale(self, hospital_id: int) -> bool:
+        if self._fingerprint is None or hospital_id not in self._checks:
+            return False
+        fingerprint, checked_at = self._checks[hospital_id]
+        now = time.monotonic()
+        if now - checked_at < self._refresh_interval:
+            return False
+        current = self._fingerprint(hospital_id)
+        self._checks[hospital_id] = (current, now)
+        return current != fingerprint
+
+    def _usable(self, generation) -> bool:
+        return generation.meta.get('model') == active_model_name() and generation.meta.get('quantization') == self.quantization
+
+    def _attach(self, hospital_id: int, generation) -> None:
+        """Swaps the hospital over to a published generation, or back to a local build when None."""
+        self._locations = {rid: hid for rid, hid in self._locations.items() if hid != hospital_id}
+        if generation is None:
+            self._generations.pop(hospital_id, None)
+            self._overlays.pop(hospital_id, None)
+            self._segments.pop(hospital_id, None)
+            return
+
+        arrays = generation.arrays
+        base = HospitalSegment(arrays['ids'], arrays['matrix'], arrays['groups'], arrays.get('scales'), shared=True)
+        self._generations[hospital_id] = (generation, base)
+        self._models[hospital_id] = generation.meta.get('model')
+        # Local changes folded in before the publisher's snapshot are part of the new generation
+        snapshot = generation.meta.get('snapshot_at', 0)
+        overlay = {rid: entry for rid, entry in self._overlays.get(hospital_id, {}).items() if entry[1] >= snapshot}
+        self._overlays[hospital_id] = overlay
+        self._checks.pop(hospital_id, None)
+        for row_id in base.ids.tolist():
+            self._locations[row_id] = hospital_id
+        for row_id, (entry, _) in overlay.items():
+            if entry is None:
+                self._locations.pop(row_id, None)
+            else:
+                self._locations[row_id] = hospital_id
+        self._segments[hospital_id] = self._layer(hospital_id)
+        logger.info(f"Attached shared embedding index {self.shared.kind}/{hospital_id} v{generation.version}")
+
+    def _layer(self, hospital_id: int):
+        _, base = self._generations[hospital_id]
+        overlay = self._overlays.get(hospital_id)
+        if not overlay:
+            return base
+        hidden = np.fromiter(overlay.keys(), dtype=np.int64, count=len(overlay))
+        added = {
+            row_id: entry for row_id, (entry, _) in overlay.items()
+            if entry is not None and (not base.dimension or entry[0].shape[0] == base.dimension)
+        }
+        delta = HospitalSegment(np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32))
+        if added:
+            delta = self._apply_pending(delta, added)
+        return LayeredSegment(base, delta, hidden)
+
+    def _shared_segment(self, hospital_id: int):
+        """The hospital's published segment with local changes layered on, or None if none is usable."""
+        version = self.shared.version()
+        if version != self._shared_version:
+            # Something was published since the last search; re-read the pointers lazily
+            self._shared_version = version
+            self._attach_checked.clear()
+
+        current = self._generations.get(hospital_id, (None, None))[0]
+        if current is not None and not self._usable(current):
+            # The active embedding model changed since this generation was attached
+            self._attach_checked.discard(hospital_id)
+        if hospital_id not in self._attach_checked:
+            self._attach_checked.add(hospital_id)
+            latest = self.shared.open(hospital_id, current)
+            if latest is not None and not self._usable(latest):
+                logger.info(f"Shared embedding index {self.shared.kind}/{hospital_id} v{latest.version} "
+                            f"is for another model or precision, using a local index")
+                latest = None
+            if latest is not current:
+                self._attach(hospital_id, latest)
+                current = latest
+        if current is None:
+            return None
+
+        pending = self._pending.pop(hospital_id, None)
+        if pending:
+            folded_at = time.time()
+            overlay = self._overlays.setdefault(hospital_id, {})
+            for row_id, entry in pending.items():
+                overlay[row_id] = (entry, folded_at)
+            self._segments[hospital_id] = self._layer(hospital_id)
+        return self._segments[hospital_id]
+
+    def _ready_segment(self, hospital_id: int):
+        """The hospital's current segment with pending changes folded in, or None if it needs a build."""
+        if self.shared is not None:
+            segment = self._shared_segment(hospital_id)
+            if segment is not None:
+                return segment
+        segment = self._segments.get(hospital_id)
+        if segment is None:
+            return None
+        if self._model is not None and self._models.get(hospital_id) != self._model():
+            logger.info(f"Embedding model changed, rebuilding the index for hospital {hospital_id}")
+        elif self._is_stale(hospital_id):
+            logger.info(f"Embedding index for hospital {hospital_id} changed in the database, rebuilding")
+        else:
+            pending = self._pending.pop(hospital_id, None)
+            if pending:
+                segment = self._apply_pending(segment, pending)
+                self._segments[hospital_id] = segment
+            return segment
+        self._segments.pop(hospital_id, None)
+        self._pending.pop(hospital_id, None)
+        return None
+
+    def _segment_for(self, hospital_id: int):
+        with self._lock:
+            segment = self._ready_segment(hospital_id)
+            if segment is not None:
+                return segment
+            build_lock = self._build_locks.setdefault(hospital_id, threading.Lock())
+
+        # Built under the hospital's own lock, so searches of other hospitals are not held up
+        with build_lock:
+            with self._lock:
+                segment = self._ready_segment(hospital_id)
+                if segment is not None:
+                    return segment
+                self._building.add(hospital_id)
+            try:
+                segment, model, check = self._build_segment(hospital_id)
+            except Exception:
+                with self._lock:
+                    self._building.discard(hospital_id)
+                    self._pending.pop(hospital_id, None)
+                raise
+            with self._lock:
+                self._building.discard(hospital_id)
+                pending = self._pending.pop(hospital_id, None) or {}
+                if model is not None:
+                    self._models[hospital_id] = model
+                if check is not None:
+                    self._checks[hospital_id] = check
+                for row_id in segment.ids.tolist():
+                    # Rows changed during the load are placed by their pending entry instead
+                    if row_id not in pending:
+                        self._locations[row_id] = hospital_id
+                if pending:
+                    segment = self._apply_pending(segment, pending)
+                self._segments[hospital_id] = segment
+                return segment
+
+    def upsert(self, hospital_id: int, row_id: int, vector, group: int | None = None) -> None:
+        """Adds or replaces a row's vector, moving it between hospitals if needed."""
+        if hospital_id is None:
+            self.remove(row_id)
+            return
+        row = normalize_rows(np.asarray(vector, dtype=np.float32))[0]
+        with self._lock:
+            previous = self._locations.get(row_id)
+            if previous is not None and previous != hospital_id:
+                self._pending.setdefault(previous, {})[row_id] = None
+            self._locations[row_id] = hospital_id
+            if hospital_id in self._segments or hospital_id in self._building:
+                self._pending.setdefault(hospital_id, {})[row_id] = (row, row_id if group is None else group)
+
+    def remove(self, row_id: int, hospital_id: int | None = None) -> None:
+        """Drops a row from whichever hospital segment currently holds it."""
+        with self._lock:
+            location = self._locations.pop(row_id, hospital_id)
+            if location is not None and (location in self._segments or location in self._building):
+                self._pending.setdefault(location, {})[row_id] = None
+
+    def invalidate(self, hospital_id: int | None = None) -> None:
+        """Forgets a hospital's segment (or all of them) so it is rebuilt from the loader."""
+        with self._lock:
+            if hospital_id is None:
+                self._segments.clear()
+                self._pending.clear()
+                self._locations.clear()
+                self._checks.clear()
+                self._models.clear()
+                self._generations.clear()
+                self._overlays.clear()
+                self._attach_checked.clear()
+                return
+            self._segments.pop(hospital_id, None)
+            self._pending.pop(hospital_id, None)
+            self._checks.pop(hospital_id, None)
+            self._models.pop(hospital_id, None)
+            self._generations.pop(hospital_id, None)
+            self._overlays.pop(hospital_id, None)
+            self._attach_checked.discard(hospital_id)
+            self._locations = {rid: hid for rid, hid in self._locations.items() if hid != hospital_id}
+
+    def set_segment(self, hospital_id: int, ids, matrix, groups=None) -> None:
+        """Installs a prebuilt segment directly (used by benchmarks and bulk rebuilds)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        groups = None if groups is None else np.asarray(groups, dtype=np.int64)
+        matrix, scales = quantize_rows(normalize_rows(matrix), self.quantization)
+        segment = HospitalSegment(ids, matrix, groups, scales)
+        with self._lock:
+            self.invalidate(hospital_id)
+            self._segments[hospital_id] = segment
+            self._attach_checked.add(hospital_id)
+            if self._model is not None:
+                self._models[hospital_id] = self._model()
+            for row_id in segment.ids.tolist():
+                self._locations[row_id] = hospital_id
+
+    def owner_of(self, row_id: int) -> int | None:
+        """Hospital whose segment currently holds the row, if any."""
+        return self._locations.get(row_id)
+
+    def size(self, hospital_id: int) -> int:
+        return len(self._segment_for(hospital_id))
+
+    def nbytes(self, hospital_id: int) -> int:
+        """
+        Memory held by this process for the hospital's segment (ids, groups and matrix).
+        Pages of an attached shared generation are not counted; they belong to the page cache.
+        """
+        return self._segment_for(hospital_id).private_nbytes
+
+    def publish(self, hospital_id: int, keep: int = 2, force: bool = False) -> int | None:
+        """
+        Loads the hospital's vectors and publishes them to the shared store as a new
+        generation for every worker to attach. Returns the version, or None when the
+        current generation already matches the database fingerprint (unless forced).
+        """
+        token = fingerprint_token(self._fingerprint(hospital_id)) if self._fingerprint is not None else None
+        if not force and token is not None:
+            current = self.shared.open(hospital_id)
+            if current is not None and self._usable(current) and current.meta.get('fingerprint') == token:
+                return None
+        # Taken before loading, so workers keep local changes that may have raced with the load
+        snapshot_at = time.time()
+        segment = self.load_segment(hospital_id)
+        return self.shared.publish(hospital_id, segment, {
+            'model': active_model_name(),
+            'quantization': self.quantization,
+            'fingerprint': token,
+            'snapshot_at': snapshot_at,
+        }, keep=keep)
+
+    # --- Querying ---
+
+    def _score(self, hospital_id: int, query_vector, allowed: np.ndarray | None = None, model: str | None = None):
+        """
+        Returns (ids, groups, cosine scores) of the candidate rows: the probed lists of a
+        fresh ANN build, otherwise every row of the hospital. Rows whose group is not in
+        `allowed` are masked out before scoring. Returns None if nothing can be scored,
+        including when `model` (the query vector's model) is not the indexed model.
+        """
+        if self._model_mismatch(model, self._model() if self._model is not None else None):
+            return None
+        if self.ann is not None:
+            candidates = self.ann.candidates(hospital_id, query_vector, allowed=allowed)
+            if candidates is not None:
+                return candidates
+
+        segment = self._segment_for(hospital_id)
+        if self._model_mismatch(model, self._models.get(hospital_id)):
+            return None
+        if not len(segment):
+            return None
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        if query.shape[0] != segment.dimension:
+            logger.error(f"Query dimension {query.shape[0]} does not match index dimension {segment.dimension}")
+            return None
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return None
+        query = query / norm
+        rows = np.flatnonzero(np.isin(segment.groups, allowed)) if allowed is not None else None
+        scores = segment.scores(query, rows)
+        ids = segment.ids if rows is None else segment.ids[rows]
+        groups = segment.groups if rows is None else segment.groups[rows]
+        if segment.quantized and self._rescore is not None:
+            return self._rescore_top(ids, groups, scores, query)
+        return ids, groups, scores
+
+    @staticmethod
+    def _model_mismatch(query_model: str | None, indexed_model: str | None) -> bool:
+        if query_model is None or indexed_model is None or query_model == indexed_model:
+            return False
+        logger.error(f"Refusing to score a {query_model} query against {indexed_model} vectors")
+        metrics.incr('search.model_mismatch')
+        return True
+
+    def _rescore_top(self, ids: np.ndarray, groups: np.ndarray, scores: np.ndarray, query: np.ndarray):
+        """Keeps the best approximate candidates and replaces their scores with full-precision ones."""
+        top = self._top_k(scores, self._rescore_candidates)
+        ids, groups, scores = ids[top], groups[top], scores[top].copy()
+        exact = self._rescore(ids.tolist())
+        for i, row_id in enumerate(ids.tolist()):
+            vector = exact.get(row_id)
+            if vector is not None and vector.shape[0] == query.shape[0]:
+                vector_norm = np.linalg.norm(vector)
+                if vector_norm:
+                    scores[i] = float(vector @ query) / vector_norm
+        return ids, groups, scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the k highest scores, best first, via argpartition."""
+        k = min(k, scores.shape[0])
+        if k < scores.shape[0]:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.shape[0])
+        return top[np.argsort(-scores[top], kind='stable')]
+
+    def search(self, hospital_id: int, query_vector, limit: int = 3, min_score: float | None = None,
+               allowed: np.ndarray | None = None, model: str | None = None):
+        """
+        Scores every row of the hospital (optionally only rows whose group is in `allowed`)
+        with one matrix-vector product. Pass the query's embedding model as `model` to
+        guarantee it is only scored against vectors of that model.
+        Returns a list of (row_id, score) sorted by descending cosine similarity.
+        """
+        if limit <= 0:
+            return []
+        scored = self._score(hospital_id, query_vector, allowed, model)
+        if scored is None or not scored[2].shape[0]:
+            return []
+        ids, _, scores = scored
+
+        results = []
+        for row in self._top_k(scores, limit):
+            score = float(scores[row])
+            if min_score is not None and score <= min_score:
+                break
+            results.append((int(ids[row]), score))
+        return results
+
+    def search_groups(self, hospital_id: int, query_vector, limit: int = 3, min_score: float | None = None,
+                      pooling: str = 'max', per_group: int = 3, allowed: np.ndarray | None = None,
+                      model: str | None = None):
+        """
+        Scores every row, then pools row scores per group (patient) with max or sum pooling.
+        Returns [(group_id, pooled_score, [(row_id, score), ...best rows first])] best group first.
+        Only rows above min_score take part in pooling.
+        """
+        if limit <= 0:
+            return []
+        scored = self._score(hospital_id, query_vector, allowed, model)
+        if scored is None:
+            return []
+        ids, groups, scores = scored
+
+        candidates = np.flatnonzero(scores > min_score) if min_score is not None else np.arange(scores.shape[0])
+        if not candidates.size:
+            return []
+        # Best rows first, so the first occurrence of each group is its best row
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        unique_groups, first_index, inverse = np.unique(groups[candidates], return_index=True, return_inverse=True)
+
+        if pooling == 'sum':
+            pooled = np.bincount(inverse, weights=scores[candidates]).astype(np.float32)
+        else:
+            pooled = scores[candidates[first_index]]
+
+        results = []
+        for g in self._top_k(pooled, limit):
+            member_rows = candidates[inverse == g][:per_group]
+            results.append((
+                int(unique_groups[g]),
+                float(pooled[g]),
+                [(int(ids[row]), float(scores[row])) for row in member_rows],
+            ))
+        return results
+
+
+# Process-wide indexes shared by semantic search and the model signal handlers
+patient_index = EmbeddingIndex(
+    fingerprint=patient_embeddings_fingerprint,
+    refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30),
+    quantization=getattr(settings, 'AI_INDEX_QUANTIZATION', 'none'),
+    rescore=load_patient_vectors,
+    rescore_candidates=getattr(settings, 'AI_INDEX_RESCORE_CANDIDATES', 200),
+    model=active_model_name,
+    shared=SharedIndexStore('patients') if getattr(settings, 'AI_SHARED_INDEX', False) else None,
+    ann=AnnIndex(
+        'patients', patient_embeddings_fingerprint,
+        refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30),
+        nprobe=getattr(settings, 'AI_ANN_NPROBE', 8),
+    ),
+)
+chunk_index = EmbeddingIndex(
+    loader=load_patient_chunks,
+    fingerprint=patient_chunks_fingerprint,
+    refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30),
+    quantization=getattr(settings, 'AI_INDEX_QUANTIZATION', 'none'),
+    rescore=load_chunk_vectors,
+    rescore_candidates=getattr(settings, 'AI_INDEX_RESCORE_CANDIDATES', 200),
+    model=active_model_name,
+    shared=SharedIndexStore('chunks') if getattr(settings, 'AI_SHARED_INDEX', False) else None,
+    ann=AnnIndex(
+        'chunks', patient_chunks_fingerprint,
+        refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30),
+        nprobe=getattr(settings, 'AI_ANN_NPROBE', 8),
+    ),
+)
@@ -0,0 +1,203 @@
+import json
+import math
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .lexical_index import tokenize
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into fixed-dimension vectors. model_name is stored with every vector, so
+    vectors from different providers or models are never scored against each other.
+    """
+
+    model_name: str = ''
+    requires_api_key: bool = False
+    # Cosine similarity below which a match is treated as noise; depends on the model
+    min_score: float = 0.4
+
+    def embed_documents(self, texts: list[str], api_key: str | None = None) -> list[list[float]]:
+        """Embeds texts for storage. Raises on failure so batch callers can retry or skip."""
+        raise NotImplementedError
+
+    def embed_query(self, text: str, api_key: str | None = None) -> list[float]:
+        """Embeds a search query. Raises on failure."""
+        return self.embed_documents([text], api_key=api_key)[0]
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Google Gemini embeddings, with separate document and query task types."""
+
+    requires_api_key = True
+
+    def __init__(self, model: str = 'text-embedding-004'):
+        self.model_name = model
+
+    def _embed(self, contents, task_type: str, api_key: str | None):
+        if not api_key:
+            raise RuntimeError("No Gemini API Key found. Cannot generate embeddings.")
+
+        from google.genai import types
+
+        from .genai_clients import genai_client
+
+        result = genai_client(api_key).models.embed_content(
+            model=self.model_name,
+            contents=contents,
+            config=types.EmbedContentConfig(task_type=task_type),
+        )
+        return [embedding.values for embedding in result.embeddings]
+
+    def embed_documents(self, texts, api_key=None):
+        return self._embed(list(texts), "RETRIEVAL_DOCUMENT", api_key)
+
+    def embed_query(self, text, api_key=None):
+        return self._embed(text, "RETRIEVAL_QUERY", api_key)[0]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Offline, deterministic embeddings: word unigrams and bigrams are hashed (CRC32, stable
+    across processes) into signed buckets of a fixed-dimension vector, weighted by
+    sublinear term frequency and L2-normalized. Needs no network or API key, so the whole
+    RAG pipeline, benchmarks and CI run on air-gapped machines. It only captures word
+    overlap, not meaning, so use it for testing and load generation rather than production.
+    """
+
+    # Short queries share few features with long records, so scores run much lower than Gemini's
+    min_score = 0.05
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+        self.model_name = f"local-hashing-{dimension}"
+
+    def _features(self, text: str) -> list[str]:
+        # Same tokens as the BM25 index, stop words removed so "patients with" matches nothing
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed_vector(self, text: str) -> np.ndarray:
+        counts: dict[str, int] = {}
+        for feature in self._features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature, count in counts.items():
+            digest = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimension] += sign * (1.0 + math.log(count))
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts, api_key=None):
+        return [self.embed_vector(text).tolist() for text in texts]
+
+
+PROVIDERS = {
+    'gemini': GeminiEmbeddingProvider,
+    'local': HashingEmbeddingProvider,
+}
+
+
+def build_provider(name: str, options: dict | None = None) -> EmbeddingProvider:
+    """Builds a provider from a registered name ('gemini', 'local') or the dotted path of a subclass."""
+    provider_class = PROVIDERS[name] if name in PROVIDERS else import_string(name)
+    return provider_class(**(options or {}))
+
+
+def configured_provider_spec() -> tuple[str, dict]:
+    """
+    (provider, options) from AI_EMBEDDING_PROVIDER ('gemini', 'local', or the dotted path of
+    an EmbeddingProvider subclass) and AI_EMBEDDING_OPTIONS (constructor arguments).
+    """
+    return getattr(settings, 'AI_EMBEDDING_PROVIDER', 'gemini'), getattr(settings, 'AI_EMBEDDING_OPTIONS', {})
+
+
+class ActiveModel:
+    """
+    Resolves the embedding model searches and refreshes use right now: the active
+    EmbeddingModelVersion row, else the provider from settings. The row is re-read at most
+    every refresh_interval seconds, so `manage.py reindex_embeddings --activate` switches
+    every process over within one interval, without a restart.
+    """
+
+    def __init__(self, refresh_interval: float = 30.0):
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._providers: dict[tuple, EmbeddingProvider] = {}
+        self._current: EmbeddingProvider | None = None
+        self._checked_at: float | None = None
+
+    def get(self, name: str, options: dict) -> EmbeddingProvider:
+        """Provider instance for a spec, reused across calls."""
+        key = (name, json.dumps(options, sort_keys=True))
+        if key not in self._providers:
+            self._providers[key] = build_provider(name, options)
+        return self._providers[key]
+
+    def _resolve(self) -> EmbeddingProvider:
+        from django.db import DatabaseError, connection, transaction
+        from .models import EmbeddingModelVersion
+
+        try:
+            # In a savepoint, so a failed read does not break a transaction the caller has open
+            with transaction.atomic():
+                row = EmbeddingModelVersion.objects.filter(is_active=True).values('provider', 'options').first()
+        except DatabaseError:
+            if EmbeddingModelVersion._meta.db_table in connection.introspection.table_names():
+                raise
+            # Table not migrated yet (e.g. during the first migrate)
+            row = None
+        if row is None:
+            return self.get(*configured_provider_spec())
+        return self.get(row['provider'], row['options'])
+
+    def provider(self) -> EmbeddingProvider:
+        now = time.monotonic()
+        with self._lock:
+            if self._current is None or now - self._checked_at >= self._refresh_interval:
+                self._current = self._resolve()
+                self._checked_at = now
+            return self._current
+
+    def invalidate(self) -> None:
+        """Re-reads the active model on the next call (used right after activating one)."""
+        with self._lock:
+            self._checked_at = None
+            self._current = None
+
+    def activate(self, model_name: str) -> None:
+        """
+        Makes a registered EmbeddingModelVersion the active one in a single transaction,
+        so every process sees either the old or the new model, never both or none.
+        """
+        from django.db import transaction
+        from django.utils import timezone
+        from .models import EmbeddingModelVersion
+
+        with transaction.atomic():
+            target = EmbeddingModelVersion.objects.select_for_update().get(model_name=model_name)
+            EmbeddingModelVersion.objects.filter(is_active=True).exclude(pk=target.pk).update(is_active=False)
+            target.is_active = True
+            target.activated_at = timezone.now()
+            target.save(update_fields=['is_active', 'activated_at'])
+        self.invalidate()
+
+
+active_model = ActiveModel(refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30))
+
+
+def active_provider() -> EmbeddingProvider:
+    return active_model.provider()
+
+
+def active_model_name() -> str:
+    """model_name of the active provider: the only vectors searches may score."""
+    return active_model.provider().model_name
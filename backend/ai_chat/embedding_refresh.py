@@ -0,0 +1,73 @@
+import logging
+
+from django.conf import settings
+
+from jobs.queue import enqueue, enqueue_many, register
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE = 'refresh_embeddings'
+
+
+class EmbeddingRefresher:
+    """
+    Debounced background re-embedding of patients whose records changed.
+
+    schedule() queues one durable job per patient, which every further change pushes back
+    (capped at max_delay after the first one), so a burst of SOAP notes or lab uploads
+    for the same patient collapses into a single embedding. Job workers claim due
+    patients in batches and embed each batch together, one API call per batch_size texts;
+    a failed batch is retried after retry_delay, doubling on every further failure.
+    """
+
+    def __init__(self, delay: float = 30.0, max_delay: float = 120.0, batch_size: int = 100, retry_delay: float = 300.0):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+
+    def schedule(self, patient_id: int, delay: float | None = None) -> None:
+        delay = self.delay if delay is None else delay
+        enqueue(JOB_TYPE, {'patient_id': patient_id}, key=f"patient:{patient_id}", delay=delay, max_delay=self.max_delay)
+
+    def schedule_many(self, patient_ids, delay: float | None = None) -> None:
+        delay = self.delay if delay is None else delay
+        items = {f"patient:{patient_id}": {'patient_id': patient_id} for patient_id in patient_ids}
+        if items:
+            enqueue_many(JOB_TYPE, items, delay=delay, max_delay=self.max_delay)
+
+    def process(self, jobs) -> int:
+        """Job handler: embeds a batch of patients queued with the same API key. Returns patients embedded."""
+        from users.context import get_gemini_api_key
+        from .embedding_providers import active_provider
+        from .rag_utils import refresh_patient_embeddings
+
+        patient_ids = [job.payload['patient_id'] for job in jobs]
+        provider = active_provider()
+        # The job worker binds the key of whoever queued these patients
+        api_key = get_gemini_api_key()
+        if not api_key and provider.requires_api_key:
+            logger.warning(f"No Gemini API key available; skipping refresh of {len(patient_ids)} patient embeddings.")
+            return 0
+        try:
+            count = refresh_patient_embeddings(patient_ids, api_key=api_key, batch_size=self.batch_size, provider=provider)
+        except Exception as e:
+            logger.error(f"Failed to refresh embeddings for {len(patient_ids)} patients: {e}")
+            metrics.incr('embedding_refresh.failed', len(patient_ids))
+            raise
+        metrics.incr('embedding_refresh.batches')
+        metrics.incr('embedding_refresh.embedded', count)
+        return count
+
+
+embedding_refresher = EmbeddingRefresher(
+    delay=getattr(settings, 'AI_EMBEDDING_REFRESH_DELAY', 30),
+    max_delay=getattr(settings, 'AI_EMBEDDING_REFRESH_MAX_DELAY', 120),
+)
+
+register(
+    JOB_TYPE, embedding_refresher.process, batch_size=embedding_refresher.batch_size,
+    retry_delay=embedding_refresher.retry_delay, max_attempts=5, timeout=900.0,
+)
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+
+class ClientRegistry:
+    """
+    Process-wide LRU of API clients, shared by every thread. Building a client is
+    expensive (google-genai creates its HTTP client and TLS context per instance, about
+    0.1 s) and each instance owns its own connection pool, so reusing one per key keeps
+    connections to the API warm between calls. When more than `max_size` keys are in
+    use the least recently used client is dropped. Evicted clients are not closed: a
+    thread may still be in a call on one, and it is freed with its connections once that
+    call returns and the last reference goes.
+    """
+
+    def __init__(self, name: str, factory, max_size: int | None = None):
+        self.name = name
+        self._factory = factory
+        self._max_size = max_size
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size or getattr(settings, 'AI_CLIENT_CACHE_SIZE', 32)
+
+    def get(self, api_key: str | None, *options):
+        """The cached client for (api_key, *options), built on first use."""
+        key = (api_key, *options)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                metrics.incr(f"clients.{self.name}.hit")
+                return client
+
+        # Built outside the lock so a slow construction does not stall other keys; if two
+        # threads race on the same key the first one stored wins
+        built = self._factory(api_key, *options)
+        with self._lock:
+            client = self._clients.setdefault(key, built)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                metrics.incr(f"clients.{self.name}.evicted")
+        metrics.incr(f"clients.{self.name}.miss")
+        return client
+
+    def clear(self) -> None:
+        """Forgets every client, e.g. after API keys were rotated."""
+        with self._lock:
+            self._clients.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._clients)
+        hits = metrics.get(f"clients.{self.name}.hit")
+        misses = metrics.get(f"clients.{self.name}.miss")
+        return {
+            'clients': size,
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'evicted': metrics.get(f"clients.{self.name}.evicted"),
+            'hit_ratio': metrics.ratio(hits, misses),
+        }
+
+
+def _build_genai_client(api_key):
+    from google import genai
+
+    return genai.Client(api_key=api_key)
+
+
+def _build_chat_model(api_key, model, temperature, thinking_level):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        google_api_key=api_key,
+        thinking_level=thinking_level,
+    )
+
+
+# google.genai clients are not tied to a model (it is passed per call), so they are keyed by API key only
+genai_clients = ClientRegistry('genai', _build_genai_client)
+chat_models = ClientRegistry('chat', _build_chat_model)
+
+
+def genai_client(api_key: str):
+    """Shared google.genai client for the API key."""
+    return genai_clients.get(api_key)
+
+
+def chat_model(api_key: str, model: str, temperature: float = 0.2, thinking_level: str = 'minimal'):
+    """Shared ChatGoogleGenerativeAI for the API key and generation settings."""
+    return chat_models.get(api_key, model, temperature, thinking_level)
+
+
+def client_stats() -> dict:
+    return {registry.name: registry.stats() for registry in (genai_clients, chat_models)}
@@ -0,0 +1,332 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Keeps codes and lab names intact: "HbA1c", "E11.9", "COVID-19", "500mg"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this to was were with "
+    "patient patients who which what find show me any".split()
+)
+
+# Standard Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOP_WORDS]
+
+
+def patient_document(patient, soap_notes, lab_reports) -> str:
+    """
+    Full searchable text of a patient: profile fields, every SOAP note and the complete
+    extracted text of every lab report (the embedding text only carries snippets).
+    """
+    parts = [
+        patient.first_name, patient.last_name, patient.address,
+        patient.symptoms, patient.medical_history, patient.allergies,
+    ]
+    for note in soap_notes:
+        parts.extend([note.subjective, note.objective, note.assessment, note.plan])
+    for report in lab_reports:
+        parts.extend([report.title, report.extracted_text])
+    return "\n".join(part for part in parts if part)
+
+
+def load_patient_documents(hospital_id: int | None = None, patient_ids=None):
+    """Yields (patient_id, hospital_id, document) with notes and reports fetched in bulk."""
+    from django.db.models import Prefetch
+    from patients.models import LabReport, Patient, SOAPNote
+
+    queryset = Patient.objects.all()
+    if hospital_id is not None:
+        queryset = queryset.filter(hospital_id=hospital_id)
+    if patient_ids is not None:
+        queryset = queryset.filter(pk__in=list(patient_ids))
+    queryset = queryset.prefetch_related(
+        Prefetch('soap_notes', queryset=SOAPNote.objects.only(
+            'patient_id', 'subjective', 'objective', 'assessment', 'plan')),
+        Prefetch('lab_reports', queryset=LabReport.objects.only('patient_id', 'title', 'extracted_text')),
+    )
+    for patient in queryset.iterator(chunk_size=1000):
+        yield patient.pk, patient.hospital_id, patient_document(
+            patient, patient.soap_notes.all(), patient.lab_reports.all()
+        )
+
+
+def patient_documents_fingerprint(hospital_id: int):
+    """(count, latest change) of a hospital's patients, notes and reports."""
+    from django.db.models import Count, Max
+    from patients.models import LabReport, Patient, SOAPNote
+
+    patients = Patient.objects.filter(hospital_id=hospital_id).aggregate(count=Count('id'), latest=Max('updated_at'))
+    notes = SOAPNote.objects.filter(patient__hospital_id=hospital_id).aggregate(count=Count('id'), latest=Max('created_at'))
+    reports = LabReport.objects.filter(patient__hospital_id=hospital_id).aggregate(count=Count('id'), latest=Max('uploaded_at'))
+    return tuple((summary['count'], summary['latest']) for summary in (patients, notes, reports))
+
+
+class LexicalSegment:
+    """
+    Inverted index of one hospital: term -> {patient_id: term frequency}.
+
+    Once installed in a LexicalIndex a segment is never modified; changes go to a copy()
+    that shares the unchanged posting lists, so searches can score it without a lock.
+    """
+
+    __slots__ = ('postings', 'lengths', 'terms', 'total_length', '_owned')
+
+    def __init__(self):
+        self.postings: dict[str, dict[int, int]] = {}
+        self.lengths: dict[int, int] = {}
+        self.terms: dict[int, tuple] = {}
+        self.total_length = 0
+        # Terms whose posting dict belongs to this segment alone; None means all of them
+        self._owned: set[str] | None = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def copy(self) -> 'LexicalSegment':
+        """A segment sharing this one's posting lists until it changes them."""
+        segment = LexicalSegment()
+        segment.postings = dict(self.postings)
+        segment.lengths = dict(self.lengths)
+        segment.terms = dict(self.terms)
+        segment.total_length = self.total_length
+        segment._owned = set()
+        return segment
+
+    def _docs(self, term: str) -> dict[int, int]:
+        docs = self.postings.get(term)
+        if docs is None:
+            docs = self.postings[term] = {}
+        elif self._owned is not None and term not in self._owned:
+            docs = self.postings[term] = dict(docs)
+        else:
+            return docs
+        if self._owned is not None:
+            self._owned.add(term)
+        return docs
+
+    def add(self, doc_id: int, tokens: list[str]) -> None:
+        self.discard(doc_id)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self._docs(term)[doc_id] = tf
+        self.terms[doc_id] = tuple(counts)
+        self.lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def discard(self, doc_id: int) -> None:
+        terms = self.terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self._docs(term)
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id)
+
+    def score(self, query_terms: list[str], allowed: set | None = None) -> dict[int, float]:
+        n_docs = len(self.lengths)
+        if not n_docs:
+            return {}
+        avg_length = self.total_length / n_docs or 1.0
+        scores: dict[int, float] = {}
+        for term in set(query_terms):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+
+class LexicalIndex:
+    """
+    In-process BM25 index over patient records, one segment per hospital.
+
+    Answers keyword queries (drug names, ICD codes, lab test names) without any network
+    call. Segments are built lazily on first search; saves mark patients dirty and their
+    documents are re-read in one query before the next search, so the index never waits
+    on the save path. Like EmbeddingIndex, a fingerprint re-check every refresh_interval
+    seconds picks up writes made by other processes.
+
+    The index lock only guards swapping segments in and out: changes are applied to a
+    copy that replaces the hospital's segment, searches score the segment they got
+    outside the lock, and a cold build holds only its own hospital's lock.
+    """
+
+    def __init__(self, loader=load_patient_documents, fingerprint=patient_documents_fingerprint,
+                 refresh_interval: float = 30.0):
+        self._loader = loader
+        self._fingerprint = fingerprint
+        self._refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._segments: dict[int, LexicalSegment] = {}
+        self._locations: dict[int, int] = {}
+        self._dirty: set[int] = set()
+        self._checks: dict[int, tuple] = {}
+        self._build_locks: dict[int, threading.Lock] = {}
+
+    # --- Maintenance ---
+
+    def _build_segment(self, hospital_id: int) -> tuple:
+        """Loads a fresh segment, returning it with the fingerprint check to install alongside it."""
+        check = None
+        if self._fingerprint is not None:
+            check = (self._fingerprint(hospital_id), time.monotonic())
+        segment = LexicalSegment()
+        for patient_id, _, document in self._loader(hospital_id=hospital_id):
+            segment.add(patient_id, tokenize(document))
+        return segment, check
+
+    def _is_stale(self, hospital_id: int) -> bool:
+        if self._fingerprint is None or hospital_id not in self._checks:
+            return False
+        fingerprint, checked_at = self._checks[hospital_id]
+        now = time.monotonic()
+        if now - checked_at < self._refresh_interval:
+            return False
+        current = self._fingerprint(hospital_id)
+        self._checks[hospital_id] = (current, now)
+        return current != fingerprint
+
+    def _apply_dirty(self) -> None:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        found = {}
+        for patient_id, hospital_id, document in self._loader(patient_ids=dirty):
+            found[patient_id] = (hospital_id, tokenize(document))
+        with self._lock:
+            self._apply([(patient_id, *found.get(patient_id, (None, None))) for patient_id in dirty])
+
+    def _apply(self, changes) -> None:
+        """
+        Applies [(patient_id, hospital_id, tokens)] (tokens None for a removal) to copies of
+        the affected segments and swaps them in. Must be called with the lock held.
+        """
+        copies: dict[int, LexicalSegment] = {}
+
+        def writable(hospital_id):
+            if hospital_id not in copies:
+                copies[hospital_id] = self._segments[hospital_id].copy()
+            return copies[hospital_id]
+
+        for patient_id, hospital_id, tokens in changes:
+            previous = self._locations.pop(patient_id, None)
+            if previous in self._segments and (tokens is None or previous != hospital_id):
+                writable(previous).discard(patient_id)
+            if tokens is not None and hospital_id in self._segments:
+                writable(hospital_id).add(patient_id, tokens)
+                self._locations[patient_id] = hospital_id
+        self._segments.update(copies)
+
+    def _segment_for(self, hospital_id: int) -> LexicalSegment:
+        if self._dirty:
+            self._apply_dirty()
+        with self._lock:
+            segment = self._segments.get(hospital_id)
+            if segment is not None and self._is_stale(hospital_id):
+                logger.info(f"Lexical index for hospital {hospital_id} changed in the database, rebuilding")
+                self._segments.pop(hospital_id)
+                segment = None
+            if segment is not None:
+                return segment
+            build_lock = self._build_locks.setdefault(hospital_id, threading.Lock())
+
+        # Built under the hospital's own lock, so searches of other hospitals are not held up
+        with build_lock:
+            with self._lock:
+                segment = self._segments.get(hospital_id)
+                if segment is not None:
+                    return segment
+            segment, check = self._build_segment(hospital_id)
+            with self._lock:
+                if check is not None:
+                    self._checks[hospital_id] = check
+                for patient_id in segment.lengths:
+                    self._locations[patient_id] = hospital_id
+                self._segments[hospital_id] = segment
+                return segment
+
+    def mark_dirty(self, patient_id: int) -> None:
+        """Re-reads the patient's record before the next search."""
+        with self._lock:
+            self._dirty.add(patient_id)
+
+    def upsert(self, hospital_id: int, patient_id: int, document: str) -> None:
+        tokens = tokenize(document)
+        with self._lock:
+            self._dirty.discard(patient_id)
+            self._apply([(patient_id, hospital_id, tokens)])
+
+    def remove(self, patient_id: int) -> None:
+        with self._lock:
+            self._dirty.discard(patient_id)
+            self._apply([(patient_id, None, None)])
+
+    def invalidate(self, hospital_id: int | None = None) -> None:
+        with self._lock:
+            if hospital_id is None:
+                self._segments.clear()
+                self._locations.clear()
+                self._dirty.clear()
+                self._checks.clear()
+                return
+            self._segments.pop(hospital_id, None)
+            self._checks.pop(hospital_id, None)
+            self._locations = {pid: hid for pid, hid in self._locations.items() if hid != hospital_id}
+
+    def size(self, hospital_id: int) -> int:
+        return len(self._segment_for(hospital_id))
+
+    def document_frequencies(self, hospital_id: int, terms) -> tuple[int, dict[str, int]]:
+        """(patients in the hospital, {term: patients containing it}), for IDF weights elsewhere."""
+        segment = self._segment_for(hospital_id)
+        return len(segment), {term: len(segment.postings.get(term, ())) for term in terms}
+
+    # --- Querying ---
+
+    def search(self, hospital_id: int, query: str, limit: int = 3, allowed=None):
+        """
+        Returns [(patient_id, bm25_score)] best first; patients matching no query term are left out.
+        When `allowed` is given, only those patient ids are scored.
+        """
+        terms = tokenize(query)
+        if limit <= 0 or not terms:
+            return []
+        allowed = None if allowed is None else {int(patient_id) for patient_id in allowed}
+        scores = self._segment_for(hospital_id).score(terms, allowed)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60) -> dict[int, float]:
+    """
+    Fuses ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in.
+    Only ranks matter, so BM25 and cosine scores need no calibration against each other.
+    """
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+lexical_index = LexicalIndex(refresh_interval=getattr(settings, 'AI_INDEX_REFRESH_SECONDS', 30))
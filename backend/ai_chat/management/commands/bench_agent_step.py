@@ -0,0 +1,76 @@
+import itertools
+import json
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from ai_chat import agent
+from ai_chat.genai_clients import _build_chat_model
+from users.context import gemini_api_key_var
+
+
+class FakeToolChatModel(GenericFakeChatModel):
+    """Offline chat model that answers instantly but binds tools the way real chat models do."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+
+def fake_chat_model(api_key, model, temperature=0.2, thinking_level='minimal'):
+    return FakeToolChatModel(messages=itertools.cycle([AIMessage(content="ok")]))
+
+
+def per_step_us(steps: int, before_step=None) -> float:
+    state = {"messages": [HumanMessage(content="Find diabetic patients")], "hospital_id": 1}
+    started = time.perf_counter()
+    for _ in range(steps):
+        if before_step:
+            before_step()
+        agent.call_model(state)
+    return round((time.perf_counter() - started) / steps * 1e6, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the CPU cost of one agent step (call_model) with an offline fake chat model: "
+        "rebuilding and re-binding the model and system prompt on every step, as before they were "
+        "cached, against reusing them. Also times binding the agent's tools to the real Gemini chat "
+        "model, which needs no network."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', type=int, default=200, help="Agent steps per measurement")
+
+    def handle(self, *args, **options):
+        steps = options['steps']
+        token = gemini_api_key_var.set('bench-key')
+        try:
+            # The fake model costs no quota, so the chat budget would only measure sleeping
+            with mock.patch.object(agent, 'chat_model', fake_chat_model), override_settings(AI_RATE_LIMIT_ENABLED=False):
+                agent.bound_models.clear()
+
+                def uncached():
+                    agent.bound_models.clear()
+                    agent.system_message.cache_clear()
+
+                report = {
+                    'tools': len(agent.tools),
+                    'uncached_step_us': per_step_us(steps, uncached),
+                    'cached_step_us': per_step_us(steps),
+                }
+                agent.bound_models.clear()
+            report['speedup'] = round(report['uncached_step_us'] / report['cached_step_us'], 1)
+
+            llm = _build_chat_model('bench-key', 'gemini-2.5-flash', 0.2, 'minimal')
+            started = time.perf_counter()
+            for _ in range(steps):
+                llm.bind_tools(agent.tools)
+            report['gemini_bind_tools_us'] = round((time.perf_counter() - started) / steps * 1e6, 1)
+        finally:
+            gemini_api_key_var.reset(token)
+        self.stdout.write(json.dumps(report, indent=2))
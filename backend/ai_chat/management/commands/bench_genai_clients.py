@@ -0,0 +1,60 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from ai_chat.genai_clients import ClientRegistry, _build_chat_model, _build_genai_client
+
+
+def per_call_us(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return round((time.perf_counter() - started) / calls * 1e6, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark of the per-call client overhead of Gemini calls: building a "
+        "google.genai client or ChatGoogleGenerativeAI for every call, as before the shared "
+        "registry, against fetching it from the registry. No request is sent, so it runs offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=50, help="Calls per measurement")
+        parser.add_argument('--keys', type=int, default=4, help="Distinct API keys rotated through")
+        parser.add_argument('--threads', type=int, default=8, help="Threads for the concurrent registry measurement")
+
+    def handle(self, *args, **options):
+        calls, keys = options['calls'], [f"bench-key-{n}" for n in range(options['keys'])]
+        report = {}
+        for name, factory, extra in (
+            ('genai', _build_genai_client, ()),
+            ('chat', _build_chat_model, ('gemini-2.5-flash', 0.2, 'minimal')),
+        ):
+            registry = ClientRegistry(f"bench-{name}", factory, max_size=len(keys))
+            counter = iter(range(10 ** 9))
+
+            def fresh():
+                factory(keys[next(counter) % len(keys)], *extra)
+
+            def cached():
+                registry.get(keys[next(counter) % len(keys)], *extra)
+
+            for key in keys:
+                registry.get(key, *extra)
+
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                started = time.perf_counter()
+                list(pool.map(lambda _: cached(), range(calls * 100)))
+                threaded = (time.perf_counter() - started) / (calls * 100) * 1e6
+
+            report[name] = {
+                'fresh_per_call_us': per_call_us(fresh, calls),
+                'registry_per_call_us': per_call_us(cached, calls * 100),
+                'registry_threaded_per_call_us': round(threaded, 1),
+                'clients': registry.stats()['clients'],
+            }
+            report[name]['speedup'] = round(report[name]['fresh_per_call_us'] / report[name]['registry_per_call_us'], 1)
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,99 @@
+import json
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hospitals.models import Hospital
+from patients.models import Patient
+from ai_chat.embedding_index import chunk_index, patient_index
+from ai_chat.embedding_providers import active_provider
+from ai_chat.lexical_index import lexical_index
+from ai_chat.management.commands.bench_rag import generate_hospital, git_revision, latency_summary, make_queries
+from ai_chat.rag_utils import refresh_patient_embeddings, search_patients_network
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how network-wide patient search scales with the number of pool workers: "
+        "creates many synthetic hospitals, warms their indexes, then times the same queries "
+        "against all of them with each worker count. The synthetic hospitals are committed, "
+        "because pool threads read them on their own connections, and deleted afterwards. "
+        "Run with AI_EMBEDDING_PROVIDER=local against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospitals', type=int, default=32, help="Synthetic hospitals to search")
+        parser.add_argument('--patients', type=int, default=500, help="Patients per synthetic hospital")
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="Pool sizes to compare")
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--mode', choices=['hybrid', 'semantic', 'lexical'], default='hybrid')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--allow-api', action='store_true', help="Allow benchmarking a provider that calls a paid API")
+
+    def handle(self, *args, **options):
+        provider = active_provider()
+        if provider.requires_api_key and not options['allow_api']:
+            raise CommandError(
+                f"The configured embedding provider ({provider.model_name}) calls a paid API. "
+                "Run with AI_EMBEDDING_PROVIDER=local, or pass --allow-api."
+            )
+        if options['hospitals'] < 1 or options['patients'] < 1 or min(options['workers']) < 1:
+            raise CommandError("--hospitals, --patients and --workers must be positive.")
+
+        rng = random.Random(options['seed'])
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'revision': git_revision(),
+            'embedding_model': provider.model_name,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'cpus': len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count(),
+            'options': {key: options[key] for key in ('hospitals', 'patients', 'workers', 'queries', 'mode', 'seed')},
+        }
+
+        hospital_ids = []
+        try:
+            started = time.perf_counter()
+            for number in range(options['hospitals']):
+                hospital = generate_hospital(options['patients'], 1, 1, rng)
+                hospital_ids.append(hospital.pk)
+                patient_ids = list(Patient.objects.filter(hospital=hospital).values_list('pk', flat=True))
+                refresh_patient_embeddings(patient_ids, batch_size=100)
+                self.stderr.write(f"Generated hospital {number + 1}/{options['hospitals']}")
+            report['generate_s'] = round(time.perf_counter() - started, 2)
+
+            # Warm every index so the runs compare search, not cold loads
+            for hospital_id in hospital_ids:
+                for index in (patient_index, chunk_index, lexical_index):
+                    index.size(hospital_id)
+
+            queries = [query for query, _ in make_queries(options['queries'], rng)]
+            runs = {}
+            for workers in options['workers']:
+                timings = []
+                for query in queries:
+                    started = time.perf_counter()
+                    search_patients_network(query, hospital_ids, limit=3, mode=options['mode'], workers=workers)
+                    timings.append(time.perf_counter() - started)
+                runs[str(workers)] = latency_summary(timings)
+                self.stderr.write(f"{workers} worker(s): p50 {runs[str(workers)]['p50_ms']} ms")
+            baseline = runs[str(options['workers'][0])]['mean_ms']
+            for summary in runs.values():
+                summary['speedup'] = round(baseline / summary['mean_ms'], 2) if summary['mean_ms'] else None
+            report['runs'] = runs
+        finally:
+            Hospital.objects.filter(pk__in=hospital_ids).delete()
+            for index in (patient_index, chunk_index, lexical_index):
+                index.invalidate()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,421 @@
+import datetime
+import io
+import json
+import random
+import resource
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from hospitals.models import Hospital
+from patients.models import LabReport, Patient, PatientChunk, PatientEmbedding, SOAPNote
+from ai_chat.embedding_index import EmbeddingIndex, chunk_index, load_patient_embeddings, patient_index, vector_from_bytes
+from ai_chat.embedding_providers import active_provider
+from ai_chat.lexical_index import lexical_index
+from ai_chat.query_cache import CACHE_ALIAS
+from ai_chat.rag_utils import cosine_similarity, embed_query, refresh_patient_embeddings, semantic_search_patients
+from ai_chat.rerankers import RERANKERS, build_reranker
+
+# (condition, symptoms, drug, lab test, lab finding)
+CONDITIONS = [
+    ("type 2 diabetes mellitus", "increased thirst and frequent urination", "Metformin 500mg", "HbA1c", "HbA1c 8.2%"),
+    ("essential hypertension", "morning headaches and dizziness", "Amlodipine 5mg", "Lipid profile", "LDL 162 mg/dL"),
+    ("bronchial asthma", "wheezing and night-time cough", "Salbutamol inhaler", "Spirometry", "FEV1 68% predicted"),
+    ("hypothyroidism", "fatigue, weight gain and cold intolerance", "Levothyroxine 50mcg", "Thyroid panel", "TSH 9.4 mIU/L"),
+    ("chronic kidney disease", "ankle swelling and reduced urine output", "Furosemide 40mg", "Renal function test", "Creatinine 2.1 mg/dL"),
+    ("migraine", "throbbing unilateral headache with photophobia", "Sumatriptan 50mg", "MRI brain", "No structural abnormality"),
+    ("iron deficiency anaemia", "pallor and breathlessness on exertion", "Ferrous sulfate 200mg", "Complete blood count", "Hb 8.9 g/dL"),
+    ("pulmonary tuberculosis", "chronic cough, night sweats and weight loss", "Rifampicin 600mg", "Sputum AFB smear", "AFB positive 2+"),
+    ("osteoarthritis of the knee", "knee pain worse on climbing stairs", "Diclofenac gel", "X-ray knee", "Joint space narrowing"),
+    ("gastro-oesophageal reflux disease", "heartburn after meals", "Pantoprazole 40mg", "Upper GI endoscopy", "Grade A oesophagitis"),
+    ("dengue fever", "high fever, body ache and rash", "Paracetamol 650mg", "Dengue NS1 antigen", "NS1 positive, platelets 85,000"),
+    ("chronic obstructive pulmonary disease", "progressive breathlessness", "Tiotropium inhaler", "Chest X-ray", "Hyperinflated lung fields"),
+    ("rheumatoid arthritis", "morning stiffness in small joints", "Methotrexate 7.5mg", "Rheumatoid factor", "RF 86 IU/mL"),
+    ("urinary tract infection", "burning micturition", "Nitrofurantoin 100mg", "Urine culture", "E. coli > 10^5 CFU/mL"),
+    ("atrial fibrillation", "palpitations and irregular pulse", "Apixaban 5mg", "ECG", "Irregularly irregular rhythm"),
+    ("vitamin D deficiency", "generalised bone pain", "Cholecalciferol 60000 IU", "Vitamin D level", "25-OH vitamin D 11 ng/mL"),
+]
+FIRST_NAMES = ["Aarav", "Diya", "Ishaan", "Ananya", "Kabir", "Meera", "Rohan", "Saanvi", "Vikram", "Priya", "Arjun", "Nisha"]
+LAST_NAMES = ["Sharma", "Patel", "Reddy", "Iyer", "Khan", "Gupta", "Nair", "Das", "Singh", "Mehta", "Rao", "Joshi"]
+QUERY_TEMPLATES = [
+    "patients with {condition}",
+    "who is taking {drug}",
+    "{lab} results",
+    "{symptoms}",
+    "{condition} on {drug}",
+]
+
+
+def generate_hospital(size: int, notes_per_patient: int, reports_per_patient: int, rng: random.Random) -> Hospital:
+    """Creates a hospital of `size` synthetic patients with SOAP notes and lab reports, in bulk."""
+    hospital = Hospital.objects.create(name=f"Benchmark Hospital ({size} patients)", address="Synthetic", contact_number="0")
+    today = datetime.date.today()
+
+    patients = []
+    for _ in range(size):
+        condition, symptoms, drug, _, _ = rng.choice(CONDITIONS)
+        patients.append(Patient(
+            hospital=hospital,
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            date_of_birth=today - datetime.timedelta(days=rng.randint(18 * 365, 90 * 365)),
+            gender=rng.choice('MF'),
+            blood_group=rng.choice([choice for choice, _ in Patient.BLOOD_GROUP_CHOICES]),
+            contact_number="0000000000",
+            address=f"{rng.randint(1, 999)} Synthetic Street",
+            symptoms=symptoms,
+            medical_history=f"Known case of {condition}, on {drug}.",
+        ))
+    patients = Patient.objects.bulk_create(patients, batch_size=2000)
+
+    notes, reports = [], []
+    for patient in patients:
+        for _ in range(notes_per_patient):
+            condition, symptoms, drug, lab, _ = rng.choice(CONDITIONS)
+            notes.append(SOAPNote(
+                patient=patient,
+                subjective=f"Patient reports {symptoms} for {rng.randint(2, 30)} days.",
+                objective=f"BP {rng.randint(100, 170)}/{rng.randint(60, 100)}, pulse {rng.randint(60, 110)}. Examination otherwise unremarkable.",
+                assessment=f"Likely {condition}.",
+                plan=f"Start {drug}. Order {lab}. Review in two weeks.",
+            ))
+        for _ in range(reports_per_patient):
+            _, _, _, lab, finding = rng.choice(CONDITIONS)
+            reports.append(LabReport(
+                patient=patient,
+                title=lab,
+                extracted_text=(
+                    f"{lab} report. Sample collected and processed per standard protocol. Result: {finding}. "
+                    "Reference ranges as per laboratory guidelines. Clinical correlation is advised. " * 3
+                ),
+            ))
+    SOAPNote.objects.bulk_create(notes, batch_size=2000)
+    LabReport.objects.bulk_create(reports, batch_size=2000)
+    return hospital
+
+
+def make_queries(count: int, rng: random.Random) -> list[tuple[str, str]]:
+    """(query, condition) pairs; a patient is relevant to the query if that condition is in their history."""
+    queries = []
+    for _ in range(count):
+        condition, symptoms, drug, lab, _ = rng.choice(CONDITIONS)
+        queries.append((
+            rng.choice(QUERY_TEMPLATES).format(condition=condition, symptoms=symptoms, drug=drug, lab=lab),
+            condition,
+        ))
+    return queries
+
+
+def loop_search(rows: list[tuple[int, str]], query: list[float], limit: int = 3,
+                min_score: float = 0.4) -> list[tuple[float, int]]:
+    """The original per-patient scoring loop of semantic_search_patients over embedding_json strings."""
+    scored = []
+    for patient_id, raw in rows:
+        score = cosine_similarity(query, json.loads(raw))
+        if score > min_score:
+            scored.append((score, patient_id))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return scored[:limit]
+
+
+def latency_summary(timings: list[float]) -> dict:
+    timings_ms = np.asarray(timings) * 1000
+    return {
+        'queries': len(timings),
+        'p50_ms': round(float(np.percentile(timings_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(timings_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(timings_ms, 99)), 3),
+        'mean_ms': round(float(timings_ms.mean()), 3),
+        'qps': round(len(timings) / float(np.sum(timings)), 1) if np.sum(timings) else None,
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks retrieval end to end on synthetic hospitals: embedding build, index load, "
+        "query latency (p50/p95/p99), throughput, memory and ANN recall against exact search. "
+        "All synthetic data is written inside a transaction that is rolled back afterwards. "
+        "Run with AI_EMBEDDING_PROVIDER=local to benchmark offline without API quota."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help="Patients per synthetic hospital (1k-200k)")
+        parser.add_argument('--notes-per-patient', type=int, default=2)
+        parser.add_argument('--reports-per-patient', type=int, default=1)
+        parser.add_argument('--queries', type=int, default=200, help="Queries per search mode")
+        parser.add_argument('--modes', nargs='+', default=['hybrid', 'semantic', 'lexical'], choices=['hybrid', 'semantic', 'lexical'])
+        parser.add_argument('--k', type=int, default=10, help="Cut-off for recall@k of ANN against exact search")
+        parser.add_argument('--ann-min-rows', type=int, default=10000, help="Build and measure an IVF index for hospitals at least this large")
+        parser.add_argument('--rerankers', nargs='+', default=['none', 'local'],
+                            help=f"Rerankers to compare for precision and latency ({', '.join(RERANKERS)} or dotted paths)")
+        parser.add_argument('--baseline-loop', action='store_true',
+                            help="Also time the original json.loads + per-patient cosine loop against the index")
+        parser.add_argument('--baseline-queries', type=int, default=10,
+                            help="Queries timed with the baseline loop, which takes seconds per query at 100k patients")
+        parser.add_argument('--quantization', action='store_true',
+                            help="Compare float32, float16 and int8 indexes over the same vectors: memory, latency and recall@k")
+        parser.add_argument('--rescore-candidates', type=int, default=200,
+                            help="Candidates rescored at full precision in the quantized comparison")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--allow-api', action='store_true', help="Allow benchmarking a provider that calls a paid API")
+
+    def handle(self, *args, **options):
+        provider = active_provider()
+        if provider.requires_api_key and not options['allow_api']:
+            raise CommandError(
+                f"The configured embedding provider ({provider.model_name}) calls a paid API. "
+                "Run with AI_EMBEDDING_PROVIDER=local, or pass --allow-api."
+            )
+        if min(options['sizes']) < 1:
+            raise CommandError("--sizes must be positive.")
+
+        report = {
+            'started_at': timezone.now().isoformat(),
+            'revision': git_revision(),
+            'embedding_model': provider.model_name,
+            'index_quantization': patient_index.quantization,
+            'database': settings.DATABASES['default']['ENGINE'],
+            'options': {key: options[key] for key in (
+                'sizes', 'notes_per_patient', 'reports_per_patient', 'queries', 'modes', 'k', 'ann_min_rows',
+                'rerankers', 'baseline_loop', 'baseline_queries', 'quantization', 'rescore_candidates', 'seed',
+            )},
+            'runs': [],
+        }
+        for size in options['sizes']:
+            self.stderr.write(f"Benchmarking {size} patients...")
+            with transaction.atomic():
+                report['runs'].append(self.run_size(size, options))
+                transaction.set_rollback(True)
+            for index in (patient_index, chunk_index, lexical_index):
+                index.invalidate()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run_size(self, size: int, options: dict) -> dict:
+        rng = random.Random(options['seed'])
+        result = {'patients': size}
+
+        started = time.perf_counter()
+        hospital = generate_hospital(size, options['notes_per_patient'], options['reports_per_patient'], rng)
+        result['generate_s'] = round(time.perf_counter() - started, 2)
+
+        # Embedding build: patient summaries and chunks, in API-sized batches
+        patient_ids = list(Patient.objects.filter(hospital=hospital).values_list('pk', flat=True))
+        started = time.perf_counter()
+        for start in range(0, len(patient_ids), 500):
+            refresh_patient_embeddings(patient_ids[start:start + 500], batch_size=100)
+        elapsed = time.perf_counter() - started
+        result['embed'] = {
+            'seconds': round(elapsed, 2),
+            'patients_per_s': round(size / elapsed, 1),
+            'chunks': PatientChunk.objects.filter(patient__hospital=hospital).count(),
+        }
+
+        # Cold index load, as a freshly started worker would do it
+        load = {}
+        for name, index in (('patients', patient_index), ('chunks', chunk_index), ('lexical', lexical_index)):
+            index.invalidate()
+            started = time.perf_counter()
+            index.size(hospital.pk)
+            load[f"{name}_s"] = round(time.perf_counter() - started, 3)
+        result['index_load'] = load
+        result['memory'] = {
+            'patient_index_mb': round(patient_index.nbytes(hospital.pk) / 2**20, 2),
+            'chunk_index_mb': round(chunk_index.nbytes(hospital.pk) / 2**20, 2),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+        labelled = make_queries(options['queries'], rng)
+        queries = [query for query, _ in labelled]
+        result['search'] = {}
+        for mode in options['modes']:
+            caches[CACHE_ALIAS].clear()
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                semantic_search_patients(query, hospital.pk, limit=3, mode=mode)
+                timings.append(time.perf_counter() - started)
+            result['search'][mode] = latency_summary(timings)
+
+        result['rerank'] = self.measure_rerank(hospital, labelled, options['rerankers'])
+
+        if options['baseline_loop']:
+            result['baseline_loop'] = self.measure_baseline_loop(hospital, queries[:options['baseline_queries']])
+        if options['quantization']:
+            result['quantization'] = self.measure_quantization(hospital, queries, options['k'], options['rescore_candidates'])
+
+        if size >= options['ann_min_rows']:
+            result['ann'] = self.measure_ann(hospital, queries, options['k'])
+        return result
+
+    def measure_rerank(self, hospital: Hospital, labelled: list[tuple[str, str]], names: list[str], limit: int = 3) -> dict:
+        """Hybrid search latency, precision@limit and MRR with each reranker, judged by the patients' known conditions."""
+        relevant = {
+            condition: set(Patient.objects.filter(hospital=hospital, medical_history__contains=f"of {condition},")
+                           .values_list('pk', flat=True))
+            for condition in {condition for _, condition in labelled}
+        }
+        results = {}
+        for name in names:
+            try:
+                reranker = build_reranker(name)
+            except ImproperlyConfigured as e:
+                results[name] = {'error': str(e)}
+                continue
+            caches[CACHE_ALIAS].clear()
+            timings, precisions, reciprocal_ranks = [], [], []
+            for query, condition in labelled:
+                started = time.perf_counter()
+                found = semantic_search_patients(query, hospital.pk, limit=limit, mode='hybrid', reranker=reranker)
+                timings.append(time.perf_counter() - started)
+                hits = [result['patient'].pk in relevant[condition] for result in found]
+                precisions.append(sum(hits) / limit)
+                reciprocal_ranks.append(next((1 / rank for rank, hit in enumerate(hits, start=1) if hit), 0.0))
+            results[name] = {
+                **latency_summary(timings),
+                f"precision_at_{limit}": round(float(np.mean(precisions)), 4),
+                f"mrr_at_{limit}": round(float(np.mean(reciprocal_ranks)), 4),
+            }
+        return results
+
+    def measure_baseline_loop(self, hospital: Hospital, queries: list[str], limit: int = 3) -> dict:
+        """
+        Latency of the original scoring loop (every vector decoded from its JSON string and
+        scored one at a time in Python) against the in-memory index, on the same query vectors.
+        """
+        provider = active_provider()
+        rows = [
+            (patient_id, json.dumps(vector_from_bytes(raw).tolist()))
+            for patient_id, raw in PatientEmbedding.objects.filter(
+                patient__hospital=hospital, model_name=provider.model_name,
+            ).values_list('patient_id', 'vector').iterator(chunk_size=2000)
+        ]
+        vectors = [embed_query(query) for query in queries]
+        ann = patient_index.ann
+        patient_index.ann = None
+        try:
+            loop_timings, index_timings, agreed = [], [], 0
+            for vector in vectors:
+                started = time.perf_counter()
+                expected = loop_search(rows, vector, limit, provider.min_score)
+                loop_timings.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                found = patient_index.search(
+                    hospital.pk, np.asarray(vector, dtype=np.float32), limit=limit, min_score=provider.min_score
+                )
+                index_timings.append(time.perf_counter() - started)
+                agreed += [patient_id for _, patient_id in expected] == [row_id for row_id, _ in found]
+        finally:
+            patient_index.ann = ann
+
+        loop, index = latency_summary(loop_timings), latency_summary(index_timings)
+        return {
+            'loop': loop,
+            'index': index,
+            'speedup_p50': round(loop['p50_ms'] / index['p50_ms'], 1) if index['p50_ms'] else None,
+            # Queries for which both return the same patients in the same order, as a sanity check
+            'agreement': round(agreed / len(vectors), 4) if vectors else None,
+        }
+
+    def measure_quantization(self, hospital: Hospital, queries: list[str], k: int, rescore_candidates: int) -> dict:
+        """
+        Index memory, latency and recall@k of float16 and int8 indexes, with and without
+        full-precision rescoring, against exact float32 search over the same patient vectors.
+        """
+        ids, vectors, _ = load_patient_embeddings(hospital.pk)
+        # Stands in for the database read of full-precision vectors during rescoring
+        stored = {row_id: np.asarray(vector, dtype=np.float32) for row_id, vector in zip(ids, vectors)}
+        query_vectors = [np.asarray(embed_query(query), dtype=np.float32) for query in queries]
+
+        configurations = [('float32', 'none', None)]
+        for mode in ('float16', 'int8'):
+            configurations.append((mode, mode, None))
+            configurations.append((f"{mode}+rescore", mode, lambda row_ids: {i: stored[i] for i in row_ids}))
+
+        results, truth = {}, None
+        for label, mode, rescore in configurations:
+            index = EmbeddingIndex(
+                loader=lambda _: (ids, vectors), quantization=mode, rescore=rescore, rescore_candidates=rescore_candidates,
+            )
+            index.size(hospital.pk)
+            timings, found = [], []
+            for vector in query_vectors:
+                started = time.perf_counter()
+                found.append({row_id for row_id, _ in index.search(hospital.pk, vector, limit=k)})
+                timings.append(time.perf_counter() - started)
+            if truth is None:
+                truth = found
+            recalls = [len(expected & hits) / max(len(expected), 1) for expected, hits in zip(truth, found)]
+            results[label] = {
+                'index_mb': round(index.nbytes(hospital.pk) / 2**20, 2),
+                f"recall_at_{k}": round(float(np.mean(recalls)), 4),
+                **latency_summary(timings),
+            }
+        return results
+
+    def measure_ann(self, hospital: Hospital, queries: list[str], k: int) -> dict:
+        """Recall@k and latency of the IVF index against exact search over patient vectors."""
+        vectors = [np.asarray(embed_query(query), dtype=np.float32) for query in queries]
+        ann = patient_index.ann
+        patient_index.ann = None
+        try:
+            exact_timings, exact = [], []
+            for vector in vectors:
+                started = time.perf_counter()
+                exact.append({row_id for row_id, _ in patient_index.search(hospital.pk, vector, limit=k)})
+                exact_timings.append(time.perf_counter() - started)
+        finally:
+            patient_index.ann = ann
+
+        with tempfile.TemporaryDirectory(prefix='bench-ann-') as directory, override_settings(AI_ANN_DIR=directory):
+            started = time.perf_counter()
+            call_command('build_ann_index', hospital=[hospital.pk], kind='patients', min_rows=1, stdout=io.StringIO())
+            build_s = time.perf_counter() - started
+            ann.invalidate(hospital.pk)
+
+            ann_timings, recalls = [], []
+            for vector, expected in zip(vectors, exact):
+                started = time.perf_counter()
+                found = {row_id for row_id, _ in patient_index.search(hospital.pk, vector, limit=k)}
+                ann_timings.append(time.perf_counter() - started)
+                recalls.append(len(found & expected) / max(len(expected), 1))
+            ann.invalidate(hospital.pk)
+
+        return {
+            'build_s': round(build_s, 2),
+            'nprobe': ann.nprobe,
+            f"recall_at_{k}": round(float(np.mean(recalls)), 4),
+            'exact': latency_summary(exact_timings),
+            'ivf': latency_summary(ann_timings),
+        }
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hospitals.models import Hospital
+from ai_chat.ann_index import build_ivf, default_list_count, fingerprint_token, write_generation
+from ai_chat.embedding_index import (
+    load_patient_chunks,
+    load_patient_embeddings,
+    normalize_rows,
+    patient_chunks_fingerprint,
+    patient_embeddings_fingerprint,
+)
+from ai_chat.embedding_providers import active_model_name
+
+KINDS = {
+    'patients': (load_patient_embeddings, patient_embeddings_fingerprint),
+    'chunks': (load_patient_chunks, patient_chunks_fingerprint),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds per-hospital IVF approximate nearest neighbour indexes from the stored embeddings "
+        "and saves them as versioned, memory-mappable files under AI_ANN_DIR. "
+        "Searches fall back to exact scoring once embeddings change after a build, so re-run it periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospital', type=int, action='append', help="Only build for this hospital ID (repeatable)")
+        parser.add_argument('--kind', choices=[*KINDS, 'all'], default='all', help="Index patient summaries, chunks or both")
+        parser.add_argument('--lists', type=int, help="Number of IVF lists (default: sqrt of the row count)")
+        parser.add_argument('--iterations', type=int, default=10, help="k-means iterations")
+        parser.add_argument('--min-rows', type=int, default=10000, help="Skip hospitals with fewer rows; exact search is fast enough there")
+        parser.add_argument('--keep', type=int, default=2, help="Index versions to keep on disk per hospital")
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError("--keep must be at least 1.")
+        hospital_ids = options['hospital'] or list(Hospital.objects.values_list('pk', flat=True))
+        kinds = list(KINDS) if options['kind'] == 'all' else [options['kind']]
+
+        for kind in kinds:
+            loader, fingerprint = KINDS[kind]
+            for hospital_id in hospital_ids:
+                # Taken before loading so writes racing with the build mark it stale
+                token = fingerprint_token(fingerprint(hospital_id))
+                started = time.monotonic()
+                ids, vectors, groups = loader(hospital_id)
+                if len(ids) < max(options['min_rows'], 1):
+                    self.stdout.write(f"{kind}/{hospital_id}: {len(ids)} row(s), below --min-rows, skipped.")
+                    continue
+
+                dimensions = {len(vector) for vector in vectors}
+                if len(dimensions) != 1:
+                    raise CommandError(f"{kind}/{hospital_id}: mixed embedding dimensions {sorted(dimensions)}.")
+                matrix = normalize_rows(np.vstack(vectors))
+                n_lists = min(options['lists'] or default_list_count(len(ids)), len(ids))
+                arrays = build_ivf(ids, groups if groups is not None else ids, matrix,
+                                   n_lists=n_lists, iterations=options['iterations'])
+                version = write_generation(kind, hospital_id, arrays, {
+                    'model': active_model_name(),
+                    'dimension': int(matrix.shape[1]),
+                    'rows': len(ids),
+                    'lists': n_lists,
+                    'fingerprint': token,
+                    'built_at': timezone.now().isoformat(),
+                }, keep=options['keep'])
+
+                self.stdout.write(self.style.SUCCESS(
+                    f"{kind}/{hospital_id}: v{version} with {len(ids)} rows in {n_lists} lists "
+                    f"built in {time.monotonic() - started:.1f}s."
+                ))
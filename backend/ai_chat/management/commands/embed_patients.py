@@ -0,0 +1,141 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from patients.models import LabReport, Patient, PatientChunk, PatientEmbedding, SOAPNote
+from users.context import get_gemini_api_key
+from ai_chat.embedding_providers import active_provider
+from ai_chat.rag_utils import refresh_patient_embeddings
+
+
+def stale_patients(hospital_id=None, force=False, model=None):
+    """
+    Patients with no vector or chunks for the model (the active one by default), or whose
+    record changed after it was embedded.
+    """
+    model = model or active_provider().model_name
+    queryset = Patient.objects.all()
+    if hospital_id is not None:
+        queryset = queryset.filter(hospital_id=hospital_id)
+    if force:
+        return queryset
+
+    # A vector is current as of the last time its text was embedded or re-checked
+    embedded_at = PatientEmbedding.objects.filter(
+        patient=OuterRef('pk'), model_name=model
+    ).values(checked=Coalesce('checked_at', 'updated_at'))[:1]
+    queryset = queryset.annotate(embedded_at=Subquery(embedded_at))
+    newer_note = SOAPNote.objects.filter(patient=OuterRef('pk'), created_at__gt=OuterRef('embedded_at'))
+    newer_report = LabReport.objects.filter(patient=OuterRef('pk'), uploaded_at__gt=OuterRef('embedded_at'))
+    has_chunks = PatientChunk.objects.filter(patient=OuterRef('pk'), model_name=model)
+    return queryset.filter(
+        Q(embedded_at__isnull=True)
+        | ~Exists(has_chunks)
+        | Q(updated_at__gt=F('embedded_at'))
+        | Exists(newer_note)
+        | Exists(newer_report)
+    )
+
+
+def embed_in_batches(command, patient_ids, provider, api_key, batch_size=100, concurrency=4, force=False):
+    """
+    Embeds the patients with `provider` in batches, `concurrency` API calls at a time, and
+    writes a progress line with throughput after every batch. Each batch is committed on
+    its own. Returns (embedded, unchanged, failed) patient counts.
+    """
+    total = len(patient_ids)
+    batches = [patient_ids[i:i + batch_size] for i in range(0, total, batch_size)]
+    done = failed = skipped = 0
+    started = time.monotonic()
+
+    def embed_batch(ids):
+        try:
+            return refresh_patient_embeddings(
+                ids, api_key=api_key, batch_size=batch_size, force=force, provider=provider
+            ), len(ids)
+        finally:
+            # Worker threads hold their own connection; release it between batches
+            connection.close()
+
+    # Bounded submission: never more than `concurrency` batches in flight.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = {}
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < concurrency:
+                ids = batches[next_batch]
+                pending[executor.submit(embed_batch, ids)] = ids
+                next_batch += 1
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                ids = pending.pop(future)
+                try:
+                    embedded, checked = future.result()
+                    done += embedded
+                    skipped += checked - embedded
+                except Exception as e:
+                    failed += len(ids)
+                    command.stderr.write(f"Batch {ids[0]}-{ids[-1]} failed: {e}")
+
+            elapsed = time.monotonic() - started
+            command.stdout.write(
+                f"[{done + skipped + failed}/{total}] embedded={done} unchanged={skipped} failed={failed} "
+                f"{done / elapsed if elapsed else 0:.1f} patients/s"
+            )
+
+    elapsed = time.monotonic() - started
+    command.stdout.write(command.style.SUCCESS(
+        f"Embedded {done} patient(s) with {provider.model_name} in {elapsed:.1f}s "
+        f"({done / elapsed if elapsed else 0:.1f} patients/s), {skipped} unchanged, {failed} failed."
+    ))
+    return done, skipped, failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Embeds patients with missing or stale vectors in batches. "
+        "Each batch is committed as soon as it is embedded, so an interrupted run can simply be restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospital', type=int, help="Only embed patients of this hospital ID")
+        parser.add_argument('--batch-size', type=int, default=100, help="Texts sent per embedding API call (max 100)")
+        parser.add_argument('--concurrency', type=int, default=4, help="Embedding API calls in flight at once")
+        parser.add_argument('--start-id', type=int, default=0, help="Skip patients with a lower ID (e.g. to split a backfill across machines)")
+        parser.add_argument('--limit', type=int, help="Stop after this many patients")
+        parser.add_argument('--force', action='store_true', help="Re-embed every selected patient, even if up to date")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many patients would be embedded")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        concurrency = options['concurrency']
+        if not 1 <= batch_size <= 100:
+            raise CommandError("--batch-size must be between 1 and 100.")
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        queryset = stale_patients(options['hospital'], options['force']).filter(pk__gte=options['start_id']).order_by('pk')
+        patient_ids = list(queryset.values_list('pk', flat=True))
+        if options['limit']:
+            patient_ids = patient_ids[:options['limit']]
+        total = len(patient_ids)
+
+        provider = active_provider()
+        self.stdout.write(f"{total} patient(s) need embeddings for model {provider.model_name}.")
+        if options['dry_run'] or not total:
+            return
+
+        api_key = get_gemini_api_key()
+        if not api_key and provider.requires_api_key:
+            raise CommandError("No GEMINI_API_KEY configured.")
+
+        _, _, failed = embed_in_batches(
+            self, patient_ids, provider, api_key, batch_size=batch_size, concurrency=concurrency, force=options['force']
+        )
+        if failed:
+            self.stdout.write("Re-run the command to retry failed patients; completed batches are already saved.")
@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from hospitals.models import Hospital
+from ai_chat.embedding_index import (
+    EmbeddingIndex,
+    load_patient_chunks,
+    load_patient_embeddings,
+    patient_chunks_fingerprint,
+    patient_embeddings_fingerprint,
+)
+from ai_chat.shared_index import SharedIndexStore
+
+KINDS = {
+    'patients': (load_patient_embeddings, patient_embeddings_fingerprint),
+    'chunks': (load_patient_chunks, patient_chunks_fingerprint),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Publishes per-hospital embedding matrices as versioned, memory-mapped files under "
+        "AI_SHARED_INDEX_DIR. Workers running with AI_SHARED_INDEX=True attach to them read-only and "
+        "switch to each new generation on their next search. Use --watch to keep them current."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hospital', type=int, action='append', help="Only publish this hospital ID (repeatable)")
+        parser.add_argument('--kind', choices=[*KINDS, 'all'], default='all', help="Publish patient summaries, chunks or both")
+        parser.add_argument('--force', action='store_true', help="Publish even if the current generation is up to date")
+        parser.add_argument('--keep', type=int, default=2, help="Generations to keep on disk per hospital")
+        parser.add_argument('--watch', action='store_true', help="Keep running and republish hospitals whose embeddings changed")
+        parser.add_argument('--interval', type=float, default=30.0, help="Seconds between checks with --watch")
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1:
+            raise CommandError("--keep must be at least 1.")
+        kinds = list(KINDS) if options['kind'] == 'all' else [options['kind']]
+        quantization = getattr(settings, 'AI_INDEX_QUANTIZATION', 'none')
+        indexes = {
+            kind: EmbeddingIndex(loader=loader, fingerprint=fingerprint, quantization=quantization,
+                                 shared=SharedIndexStore(kind))
+            for kind, (loader, fingerprint) in KINDS.items() if kind in kinds
+        }
+
+        force = options['force']
+        while True:
+            close_old_connections()
+            hospital_ids = options['hospital'] or list(Hospital.objects.values_list('pk', flat=True))
+            for kind, index in indexes.items():
+                for hospital_id in hospital_ids:
+                    started = time.monotonic()
+                    version = index.publish(hospital_id, keep=options['keep'], force=force)
+                    if version is None:
+                        if not options['watch']:
+                            self.stdout.write(f"{kind}/{hospital_id}: up to date.")
+                        continue
+                    generation = index.shared.open(hospital_id)
+                    rows = generation.meta['rows'] if generation is not None else '?'
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{kind}/{hospital_id}: published v{version} with {rows} rows "
+                        f"in {time.monotonic() - started:.1f}s."
+                    ))
+            if not options['watch']:
+                return
+            force = False
+            time.sleep(options['interval'])
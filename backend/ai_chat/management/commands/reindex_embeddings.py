@@ -0,0 +1,105 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from patients.models import Patient, PatientChunk, PatientEmbedding
+from users.context import get_gemini_api_key
+from ai_chat.embedding_providers import active_model, active_model_name, configured_provider_spec
+from ai_chat.models import EmbeddingModelVersion
+from ai_chat.management.commands.embed_patients import embed_in_batches, stale_patients
+
+# Edits made while a pass runs are caught by the next one; after this many, activation proceeds anyway
+MAX_PASSES = 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds vectors for another embedding model next to the active model's, while searches keep "
+        "using the active one, then optionally switches every process over to it in one transaction. "
+        "Vectors of the previous model are kept, so switching back needs no re-embedding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', help="Provider of the new model: 'gemini', 'local' or a dotted path (default: AI_EMBEDDING_PROVIDER)")
+        parser.add_argument('--options', help="JSON constructor options, e.g. '{\"model\": \"gemini-embedding-001\"}' (default: AI_EMBEDDING_OPTIONS)")
+        parser.add_argument('--batch-size', type=int, default=100, help="Texts sent per embedding API call (max 100)")
+        parser.add_argument('--concurrency', type=int, default=4, help="Embedding API calls in flight at once")
+        parser.add_argument('--activate', action='store_true', help="Switch searches to the new model once every patient has a vector")
+        parser.add_argument('--activate-only', action='store_true', help="Switch to an already built model without embedding (e.g. to roll back)")
+        parser.add_argument('--allow-partial', action='store_true', help="Activate even if some patients still lack a vector")
+        parser.add_argument('--prune', action='store_true', help="After activating, delete the vectors of every other model")
+        parser.add_argument('--list', action='store_true', help="List registered models and their coverage, then exit")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            return self.list_models()
+
+        batch_size = options['batch_size']
+        if not 1 <= batch_size <= 100:
+            raise CommandError("--batch-size must be between 1 and 100.")
+        if options['concurrency'] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+
+        configured_name, configured_options = configured_provider_spec()
+        name = options['provider'] or configured_name
+        try:
+            provider_options = json.loads(options['options']) if options['options'] else configured_options
+        except ValueError as e:
+            raise CommandError(f"--options is not valid JSON: {e}")
+        provider = active_model.get(name, provider_options)
+        target = provider.model_name
+
+        # Register both models so either can be re-activated later
+        current = active_model_name()
+        if not EmbeddingModelVersion.objects.filter(model_name=current).exists():
+            EmbeddingModelVersion.objects.create(model_name=current, provider=configured_name, options=configured_options)
+        EmbeddingModelVersion.objects.update_or_create(
+            model_name=target, defaults={'provider': name, 'options': provider_options}
+        )
+        self.stdout.write(f"Active model: {current}. Target model: {target}.")
+
+        if not options['activate_only']:
+            api_key = get_gemini_api_key()
+            if not api_key and provider.requires_api_key:
+                raise CommandError("No GEMINI_API_KEY configured.")
+            for attempt in range(1, MAX_PASSES + 1):
+                patient_ids = list(stale_patients(model=target).order_by('pk').values_list('pk', flat=True))
+                if not patient_ids:
+                    break
+                self.stdout.write(f"Pass {attempt}: {len(patient_ids)} patient(s) need {target} vectors.")
+                embed_in_batches(self, patient_ids, provider, api_key,
+                                 batch_size=batch_size, concurrency=options['concurrency'])
+
+        missing = Patient.objects.exclude(embeddings__model_name=target).count()
+        total = Patient.objects.count()
+        self.stdout.write(f"{total - missing}/{total} patient(s) have a {target} vector.")
+
+        if not (options['activate'] or options['activate_only']):
+            self.stdout.write(f"Searches still use {current}. Re-run with --activate-only to switch to {target}.")
+            return
+        if missing and not options['allow_partial']:
+            raise CommandError(f"{missing} patient(s) have no {target} vector; re-run, or pass --allow-partial.")
+        if target == current:
+            self.stdout.write(f"{target} is already the active model.")
+        else:
+            active_model.activate(target)
+            self.stdout.write(self.style.SUCCESS(
+                f"Activated {target}. Server processes switch within AI_INDEX_REFRESH_SECONDS; "
+                "re-run build_ann_index and publish_embedding_index for the new model."
+            ))
+
+        if options['prune']:
+            vectors, _ = PatientEmbedding.objects.exclude(model_name=target).delete()
+            chunks, _ = PatientChunk.objects.exclude(model_name=target).delete()
+            EmbeddingModelVersion.objects.exclude(model_name=target).delete()
+            self.stdout.write(f"Pruned {vectors} patient vector(s) and {chunks} chunk(s) of other models.")
+
+    def list_models(self):
+        total = Patient.objects.count()
+        current = active_model_name()
+        names = set(EmbeddingModelVersion.objects.values_list('model_name', flat=True))
+        names.update(PatientEmbedding.objects.values_list('model_name', flat=True).distinct())
+        for model_name in sorted(names):
+            covered = PatientEmbedding.objects.filter(model_name=model_name).count()
+            marker = '*' if model_name == current else ' '
+            self.stdout.write(f"{marker} {model_name}: {covered}/{total} patients")
@@ -0,0 +1,33 @@
+import threading
+from collections import defaultdict
+
+# Process-wide counters for the AI pipeline (cache hits, API calls, ...).
+# Each worker process keeps its own totals; they reset on restart.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+
+def incr(name: str, amount: int = 1) -> None:
+    with _lock:
+        _counters[name] += amount
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """Returns a copy of every counter recorded so far in this process."""
+    with _lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+
+
+def ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
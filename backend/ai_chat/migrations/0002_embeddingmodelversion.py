@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ai_chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingModelVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(help_text='Value stored in PatientEmbedding/PatientChunk.model_name', max_length=100, unique=True)),
+                ('provider', models.CharField(help_text="Provider name ('gemini', 'local') or dotted path of an EmbeddingProvider", max_length=200)),
+                ('options', models.JSONField(blank=True, default=dict, help_text='Constructor options for the provider')),
+                ('is_active', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('activated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='single_active_embedding_model')],
+            },
+        ),
+    ]
@@ -0,0 +1,247 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .rate_limits import key_digest
+
+# Failure classes, from an API exception
+NOT_FOUND = 'not_found'        # model retired or not enabled for this key
+RATE_LIMITED = 'rate_limited'  # 429 / quota exhausted
+AUTH = 'auth'                  # 401 / 403, e.g. an invalid or restricted API key
+UNAVAILABLE = 'unavailable'    # 503 / overloaded
+ERROR = 'error'                # anything else, e.g. a rejected request
+
+
+def classify_error(error: Exception) -> str:
+    """Failure class of an API error, from its HTTP status when the SDK exposes one, else its message."""
+    code = getattr(error, 'code', None)
+    if code == 404:
+        return NOT_FOUND
+    if code == 429:
+        return RATE_LIMITED
+    if code in (401, 403):
+        return AUTH
+    if code in (500, 502, 503, 504):
+        return UNAVAILABLE
+    message = str(error).lower()
+    if "404" in message or "not found" in message or "not supported" in message:
+        return NOT_FOUND
+    if "429" in message or "resource_exhausted" in message or "quota" in message:
+        return RATE_LIMITED
+    if "api key not valid" in message or "permission_denied" in message or "unauthenticated" in message:
+        return AUTH
+    if "503" in message or "unavailable" in message or "overloaded" in message:
+        return UNAVAILABLE
+    return ERROR
+
+
+class ModelHealth:
+    """Recent outcomes and circuit state of one model."""
+
+    __slots__ = ('outcomes', 'consecutive_failures', 'open_until', 'cooldown', 'probing', 'last_failure')
+
+    def __init__(self, window: int):
+        # (succeeded, latency seconds, failure class)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown = 0.0
+        # When a caller claimed the half-open probe, 0 if nobody holds it
+        self.probing = 0.0
+        self.last_failure = None
+
+    def success_rate(self) -> float:
+        # Smoothed so a model with no history counts as healthy but not perfect
+        successes = sum(1 for succeeded, _, _ in self.outcomes if succeeded)
+        return (successes + 1) / (len(self.outcomes) + 1)
+
+    def latencies(self) -> list[float]:
+        return [latency for succeeded, latency, _ in self.outcomes if succeeded]
+
+    def latency_percentile(self, percentile: float, min_samples: int = 1) -> float | None:
+        latencies = self.latencies()
+        return float(np.percentile(latencies, percentile)) if len(latencies) >= max(min_samples, 1) else None
+
+
+class ModelHealthTracker:
+    """
+    Process-wide health of the models in a fallback chain, shared by every thread calling them.
+
+    Each call's outcome is recorded per model. A model's circuit opens after
+    `failure_threshold` consecutive failures, or at once when the API says the model does
+    not exist, its quota is exhausted or the key was rejected, and callers skip it until
+    the cooldown ends. The first caller after that probes it (half-open): success closes
+    the circuit, failure reopens it with twice the cooldown, up to `max_cooldown`.
+
+    Outages (5xx, timeouts, other errors) open the model's circuit for every caller. Quota,
+    missing-model and key failures depend on the API key, so they only open a circuit for
+    that key and model; uploads using other keys keep the model.
+    """
+
+    # Failures that open the circuit at once, with their first cooldown in seconds
+    IMMEDIATE = {NOT_FOUND: 3600.0, RATE_LIMITED: 60.0, AUTH: 600.0}
+    # Failures tracked per (API key, model) rather than per model
+    KEY_SCOPED = {NOT_FOUND, RATE_LIMITED, AUTH}
+    # A probe whose caller never reported back (e.g. it crashed) is handed to another caller after this
+    PROBE_TIMEOUT = 120.0
+
+    def __init__(self, name: str, window: int = 20, failure_threshold: int | None = None,
+                 cooldown: float | None = None, max_cooldown: float = 600.0):
+        self.name = name
+        self.window = window
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._models: dict[str, ModelHealth] = {}
+        # (key digest, model) -> circuit opened by a key-scoped failure
+        self._keyed: dict[tuple[str, str], ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def failure_threshold(self) -> int:
+        return self._failure_threshold or getattr(settings, 'AI_CIRCUIT_FAILURE_THRESHOLD', 3)
+
+    @property
+    def base_cooldown(self) -> float:
+        return self._cooldown or getattr(settings, 'AI_CIRCUIT_COOLDOWN_SECONDS', 30.0)
+
+    def _health(self, model: str) -> ModelHealth:
+        health = self._models.get(model)
+        if health is None:
+            health = self._models[model] = ModelHealth(self.window)
+        return health
+
+    def _circuits(self, model: str, digest: str) -> list[ModelHealth]:
+        keyed = self._keyed.get((digest, model))
+        return [self._health(model)] if keyed is None else [self._health(model), keyed]
+
+    def order(self, models: list[str], api_key: str | None = None) -> list[str]:
+        """
+        The models worth trying now with `api_key`, healthiest first: closed circuits by recent
+        success rate (ties keep the configured order), then a model due for its half-open probe.
+        If every circuit is open, only the one that reopens soonest, so the caller makes a
+        single attempt.
+        """
+        now = time.monotonic()
+        digest = key_digest(api_key)
+        with self._lock:
+            available, probes, reopens = [], [], {}
+            for position, model in enumerate(models):
+                circuits = self._circuits(model, digest)
+                reopens[model] = max(circuit.open_until for circuit in circuits)
+                if reopens[model] <= 0:
+                    available.append((-round(circuits[0].success_rate(), 1), position, model))
+                elif all(
+                    circuit.open_until <= now
+                    and (not circuit.probing or now - circuit.probing > self.PROBE_TIMEOUT)
+                    for circuit in circuits
+                ):
+                    probes.append(model)
+            ordered = [model for _, _, model in sorted(available)]
+            if probes:
+                # One caller gets the probe; the others keep skipping the model until it reports back
+                for circuit in self._circuits(probes[0], digest):
+                    if circuit.open_until:
+                        circuit.probing = now
+                ordered.append(probes[0])
+            if not ordered and models:
+                ordered = [min(models, key=reopens.get)]
+        return ordered
+
+    def record_success(self, model: str, latency: float, api_key: str | None = None) -> None:
+        with self._lock:
+            health = self._health(model)
+            health.outcomes.append((True, latency, None))
+            keyed = self._keyed.pop((key_digest(api_key), model), None)
+            if health.open_until or (keyed is not None and keyed.open_until):
+                metrics.incr(f"circuit.{self.name}.closed")
+            health.consecutive_failures = 0
+            health.open_until = 0.0
+            health.cooldown = 0.0
+            health.probing = 0.0
+        metrics.incr(f"circuit.{self.name}.{model}.success")
+
+    def record_failure(self, model: str, failure: str, latency: float = 0.0, api_key: str | None = None) -> None:
+        now = time.monotonic()
+        digest = key_digest(api_key)
+        with self._lock:
+            health = self._health(model)
+            health.last_failure = failure
+            for circuit in self._circuits(model, digest):
+                circuit.probing = 0.0
+            if failure in self.KEY_SCOPED:
+                # Says nothing about the model itself, so its success rate is left alone
+                circuit = self._keyed.get((digest, model))
+                if circuit is None:
+                    circuit = self._keyed[(digest, model)] = ModelHealth(1)
+            else:
+                health.outcomes.append((False, latency, failure))
+                circuit = health
+            circuit.consecutive_failures += 1
+            if circuit.open_until > now:
+                # A call started before the circuit opened; it is open already
+                cooldown = None
+            elif circuit.open_until:
+                # The half-open probe failed
+                cooldown = min(max(circuit.cooldown, self.base_cooldown) * 2, self.max_cooldown)
+            elif failure in self.IMMEDIATE:
+                cooldown = self.IMMEDIATE[failure]
+            elif circuit.consecutive_failures >= self.failure_threshold:
+                cooldown = self.base_cooldown
+            else:
+                cooldown = None
+            if cooldown is not None:
+                circuit.cooldown = cooldown
+                circuit.open_until = now + cooldown
+        metrics.incr(f"circuit.{self.name}.{model}.{failure}")
+        if cooldown is not None:
+            metrics.incr(f"circuit.{self.name}.opened")
+
+    def latency_percentile(self, model: str, percentile: float, min_samples: int = 1) -> float | None:
+        """The model's recent successful-call latency at `percentile`, or None with fewer than min_samples calls."""
+        with self._lock:
+            return self._health(model).latency_percentile(percentile, min_samples)
+
+    def mean_latency_above(self, model: str, threshold: float) -> float | None:
+        """Mean of the model's recent successful-call latencies longer than `threshold`, if any."""
+        with self._lock:
+            slower = [latency for latency in self._health(model).latencies() if latency > threshold]
+        return sum(slower) / len(slower) if slower else None
+
+    @staticmethod
+    def _rounded(value: float | None) -> float | None:
+        return None if value is None else round(value, 3)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._keyed.clear()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    'state': 'closed' if not health.open_until else 'open' if health.open_until > now else 'half-open',
+                    'reopens_in_s': round(max(health.open_until - now, 0.0), 1) if health.open_until else None,
+                    'success_rate': round(health.success_rate(), 3),
+                    'calls': len(health.outcomes),
+                    'p50_latency_s': self._rounded(health.latency_percentile(50)),
+                    'consecutive_failures': health.consecutive_failures,
+                    'last_failure': health.last_failure,
+                    # Circuits opened for single API keys (by key digest), e.g. an exhausted quota
+                    'open_for_keys': {
+                        digest: round(max(keyed.open_until - now, 0.0), 1)
+                        for (digest, keyed_model), keyed in self._keyed.items()
+                        if keyed_model == model and keyed.open_until
+                    },
+                }
+                for model, health in self._models.items()
+            }
+
+
+ocr_model_health = ModelHealthTracker('ocr')
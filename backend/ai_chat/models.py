@@ -26,3 +26,25 @@ class ChatMessage(models.Model):
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}"
+
+class EmbeddingModelVersion(models.Model):
+    """
+    An embedding model whose vectors may be stored alongside other models' vectors.
+    Exactly one row is active at a time; searches embed queries with it and only score
+    vectors stored under its model_name. With no active row the provider configured by
+    AI_EMBEDDING_PROVIDER / AI_EMBEDDING_OPTIONS is used.
+    """
+    model_name = models.CharField(max_length=100, unique=True, help_text="Value stored in PatientEmbedding/PatientChunk.model_name")
+    provider = models.CharField(max_length=200, help_text="Provider name ('gemini', 'local') or dotted path of an EmbeddingProvider")
+    options = models.JSONField(default=dict, blank=True, help_text="Constructor options for the provider")
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['is_active'], condition=models.Q(is_active=True), name='single_active_embedding_model'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name}{' (active)' if self.is_active else ''}"
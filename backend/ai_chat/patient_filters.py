@@ -0,0 +1,59 @@
+import datetime
+
+import numpy as np
+
+# Structured filters accepted by semantic_search_patients alongside the free-text query
+PATIENT_FILTERS = (
+    'gender', 'blood_group', 'status', 'min_age', 'max_age', 'has_room', 'created_after', 'created_before',
+)
+
+
+def years_before(day: datetime.date, years: int) -> datetime.date:
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        # 29 February in a non-leap target year
+        return day.replace(year=day.year - years, day=28)
+
+
+def filter_patients(queryset, gender=None, blood_group=None, status=None, min_age=None, max_age=None,
+                    has_room=None, created_after=None, created_before=None):
+    """Applies the structured patient filters to a Patient queryset. Ages are whole years as of today."""
+    if gender:
+        queryset = queryset.filter(gender=gender)
+    if blood_group:
+        queryset = queryset.filter(blood_group=blood_group)
+    if status:
+        queryset = queryset.filter(status=status)
+
+    today = datetime.date.today()
+    if min_age is not None:
+        queryset = queryset.filter(date_of_birth__lte=years_before(today, int(min_age)))
+    if max_age is not None:
+        queryset = queryset.filter(date_of_birth__gt=years_before(today, int(max_age) + 1))
+
+    if has_room is not None:
+        queryset = queryset.filter(occupied_room__isnull=not has_room)
+    if created_after is not None:
+        queryset = queryset.filter(created_at__date__gte=created_after)
+    if created_before is not None:
+        queryset = queryset.filter(created_at__date__lte=created_before)
+    return queryset
+
+
+def allowed_patient_ids(hospital_id: int, filters: dict | None) -> np.ndarray | None:
+    """
+    Sorted ids of the hospital's patients passing the filters, used as a boolean mask over
+    the search indexes before scoring. None means no filtering.
+    """
+    filters = {key: value for key, value in (filters or {}).items() if value is not None and value != ''}
+    if not filters:
+        return None
+    unknown = set(filters) - set(PATIENT_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown patient filter(s): {', '.join(sorted(unknown))}")
+
+    from patients.models import Patient
+
+    queryset = filter_patients(Patient.objects.filter(hospital_id=hospital_id), **filters)
+    return np.fromiter(queryset.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
@@ -0,0 +1,60 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+from django.core.cache import caches
+
+from . import metrics
+from .embedding_index import vector_from_bytes, vector_to_bytes
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'embeddings'
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation differences should not miss the cache."""
+    text = re.sub(r'\s+', ' ', query).strip().lower()
+    return text.rstrip('?.!,; ')
+
+
+def query_cache_key(query: str, model: str) -> str:
+    digest = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+    return f"query-embedding:{model}:{digest}"
+
+
+def get_query_embedding(query: str, model: str, embed) -> np.ndarray | None:
+    """
+    Returns the query vector from the 'embeddings' cache, calling embed(query) on a miss.
+    Vectors are cached as float32 bytes; failed or empty embeddings are never cached.
+    """
+    cache = caches[CACHE_ALIAS]
+    key = query_cache_key(query, model)
+
+    try:
+        raw = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Query embedding cache unavailable: {e}")
+        raw = None
+
+    if raw is not None:
+        metrics.incr('query_embedding_cache.hits')
+        return vector_from_bytes(raw)
+
+    metrics.incr('query_embedding_cache.misses')
+    vector = embed(query)
+    if not vector:
+        return None
+
+    try:
+        cache.set(key, vector_to_bytes(vector))
+    except Exception as e:
+        logger.warning(f"Could not store query embedding in cache: {e}")
+    return np.asarray(vector, dtype=np.float32)
+
+
+def cache_stats() -> dict:
+    hits = metrics.get('query_embedding_cache.hits')
+    misses = metrics.get('query_embedding_cache.misses')
+    return {'hits': hits, 'misses': misses, 'hit_ratio': metrics.ratio(hits, misses)}
@@ -1,19 +1,60 @@
-import json
+import contextvars
+import hashlib
+import heapq
 import numpy as np
 import os
-from patients.models import Patient
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections
+from django.db.models import Prefetch, QuerySet
+from django.utils import timezone
+from patients.models import Patient, PatientEmbedding, PatientChunk, SOAPNote, LabReport
 import logging
 from users.context import get_gemini_api_key
+from .chunking import build_patient_chunks, patient_header
+from .embedding_providers import active_model_name, active_provider
+from .embedding_index import chunk_index, patient_index, vector_from_bytes, vector_to_bytes
+from . import metrics
+from .query_cache import get_query_embedding
+from .lexical_index import lexical_index, reciprocal_rank_fusion
+from .patient_filters import allowed_patient_ids
+from .rate_limits import rate_limiter
+from .rerankers import NoReranker, configured_reranker
 
 logger = logging.getLogger(__name__)
 
+# How many of a patient's most recent notes and reports go into their summary text
+SUMMARY_SOAP_NOTES = 3
+SUMMARY_LAB_REPORTS = 5
+# Seconds a search waits for embedding budget before answering with lexical search only
+QUERY_RATE_LIMIT_WAIT = 2.0
+
+def summary_prefetches() -> tuple[Prefetch, Prefetch]:
+    """
+    Prefetches everything get_patient_text reads, so rendering any number of patients costs
+    one query per relation. Slicing a Prefetch queryset limits rows per patient, not in total.
+    """
+    return (
+        Prefetch(
+            'soap_notes',
+            queryset=SOAPNote.objects.select_related('doctor').order_by('-created_at')[:SUMMARY_SOAP_NOTES],
+            to_attr='recent_soap_notes',
+        ),
+        Prefetch(
+            'lab_reports',
+            queryset=LabReport.objects.order_by('-uploaded_at')[:SUMMARY_LAB_REPORTS],
+            to_attr='recent_lab_reports',
+        ),
+    )
+
 def get_patient_text(patient: Patient) -> str:
-    """Combines patient details into a cohesive chunk of text for embedding."""
-    age_str = f" Born {patient.date_of_birth}." if patient.date_of_birth else ""
-    gender_str = "Male" if patient.gender == 'M' else "Female" if patient.gender == 'F' else "Other"
-    
+    """
+    Combines patient details into a cohesive chunk of text for embedding.
+    Uses the notes and reports loaded by summary_prefetches() when present, else queries them.
+    """
     parts = [
-        f"Patient: {patient.first_name} {patient.last_name}, {gender_str}.{age_str}",
+        patient_header(patient),
         f"Address: {patient.address}.",
     ]
     
@@ -24,7 +65,9 @@ def get_patient_text(patient: Patient) -> str:
         parts.append(f"Medical History: {patient.medical_history}.")
         
     # Summarize SOAP notes
-    soap_notes = patient.soap_notes.all().order_by('-created_at')[:3]
+    soap_notes = getattr(patient, 'recent_soap_notes', None)
+    if soap_notes is None:
+        soap_notes = patient.soap_notes.select_related('doctor').order_by('-created_at')[:SUMMARY_SOAP_NOTES]
     if soap_notes:
         parts.append("Recent Clinical Notes:")
         for note in soap_notes:
@@ -32,7 +75,9 @@ def get_patient_text(patient: Patient) -> str:
             parts.append(f"- On {note.created_at.date()} by {dr_name}: Assessment: {note.assessment}. Plan: {note.plan}")
             
     # Include Lab Reports text
-    lab_reports = patient.lab_reports.all().order_by('-uploaded_at')[:5]
+    lab_reports = getattr(patient, 'recent_lab_reports', None)
+    if lab_reports is None:
+        lab_reports = patient.lab_reports.all().order_by('-uploaded_at')[:SUMMARY_LAB_REPORTS]
     if lab_reports:
         parts.append("Recent Lab Reports/Documents:")
         for report in lab_reports:
@@ -46,50 +91,239 @@ def get_patient_text(patient: Patient) -> str:
             
     return "\n".join(parts)
 
+def build_patient_texts(patients) -> dict[int, str]:
+    """
+    Renders get_patient_text for many patients in a constant number of queries.
+    Accepts a Patient queryset, or an iterable of patient ids or Patient instances.
+    Returns {patient_id: text}.
+    """
+    if isinstance(patients, QuerySet):
+        queryset = patients
+    else:
+        patient_ids = [patient.pk if isinstance(patient, Patient) else patient for patient in patients]
+        if not patient_ids:
+            return {}
+        queryset = Patient.objects.filter(pk__in=patient_ids)
+    return {patient.pk: get_patient_text(patient) for patient in queryset.prefetch_related(*summary_prefetches())}
+
+def embed_texts(texts: list[str], api_key: str | None = None, provider=None) -> list[list[float]]:
+    """
+    Embeds many documents with a single call to the given provider (the active one by default).
+    Raises on API errors so batch callers can decide whether to retry or skip.
+    """
+    provider = provider or active_provider()
+    if provider.requires_api_key:
+        api_key = api_key or get_gemini_api_key()
+        rate_limiter.acquire(api_key, 'embed')
+    return provider.embed_documents(list(texts), api_key=api_key)
+
 def embed_text(text: str) -> list[float]:
-    """Calls Gemini API to get the embedding vector for the text."""
-    api_key = get_gemini_api_key()
-    if not api_key:
-        logger.warning("No Gemini API Key found. Cannot generate embeddings.")
-        return []
-        
+    """Gets the embedding vector for the text from the configured provider. Returns [] on failure."""
     try:
-        from google import genai
-        from google.genai import types
-        
-        client = genai.Client(api_key=api_key)
-        # Using text-embedding-004 which is the latest embedding model
-        result = client.models.embed_content(
-            model="text-embedding-004",
-            contents=text,
-            config=types.EmbedContentConfig(
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-        )
-        return result.embeddings[0].values
+        return embed_texts([text])[0]
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         return []
 
-def get_or_create_patient_embedding(patient: Patient) -> list[float] | None:
+def embed_query(query: str, api_key: str | None = None, provider=None) -> list[float]:
+    """Embeds a search query (RETRIEVAL_QUERY task type for Gemini). Returns [] on failure."""
+    provider = provider or active_provider()
+    try:
+        if provider.requires_api_key:
+            api_key = api_key or get_gemini_api_key()
+            # A search would rather fall back to keywords than queue behind a batch job
+            rate_limiter.acquire(api_key, 'embed', timeout=QUERY_RATE_LIMIT_WAIT)
+        return provider.embed_query(query, api_key=api_key)
+    except Exception as e:
+        logger.error(f"Error embedding query: {e}")
+        return []
+
+def get_or_create_patient_embedding(patient: Patient) -> np.ndarray | None:
     """Gets the cached embedding, or computes and caches it if missing."""
-    if patient.embedding_json:
-        try:
-            return json.loads(patient.embedding_json)
-        except json.JSONDecodeError:
-            pass # Fallback to re-embed if corrupted
+    model = active_model_name()
+    record = patient.embeddings.filter(model_name=model).first()
+    if record is not None:
+        vector = vector_from_bytes(record.vector)
+        if vector.size == record.dimension:
+            return vector
+        # Fallback to re-embed if corrupted
             
     # Need to generate embedding
     text = get_patient_text(patient)
     embedding = embed_text(text)
     
     if embedding:
-        patient.embedding_json = json.dumps(embedding)
-        patient.save(update_fields=['embedding_json'])
-        return embedding
+        PatientEmbedding.objects.update_or_create(
+            patient=patient,
+            model_name=model,
+            defaults={
+                'dimension': len(embedding),
+                'vector': vector_to_bytes(embedding),
+                'text_hash': embedding_text_hash(text, model),
+                'checked_at': timezone.now(),
+            },
+        )
+        metrics.incr('embedding.performed')
+        return np.asarray(embedding, dtype=np.float32)
         
     return None
 
+def embedding_text_hash(text: str, model: str | None = None) -> str:
+    """Fingerprint of the exact text sent to the embedding model, used to skip redundant re-embeds."""
+    return hashlib.sha256(f"{model or active_model_name()}\n{text}".encode('utf-8')).hexdigest()
+
+def store_patient_embeddings(patients: list[Patient], vectors, text_hashes: list[str], model: str | None = None) -> None:
+    """
+    Writes a batch of vectors for the given model (the active one by default) with one
+    bulk_update and one bulk_create. Bulk writes bypass model signals, so the in-process
+    index is updated here directly when the vectors belong to the active model.
+    """
+    model = model or active_model_name()
+    now = timezone.now()
+    by_patient = {patient.pk: (vector, text_hash) for patient, vector, text_hash in zip(patients, vectors, text_hashes)}
+    pending = dict(by_patient)
+    existing = list(PatientEmbedding.objects.filter(patient_id__in=list(by_patient), model_name=model))
+    for record in existing:
+        vector, text_hash = pending.pop(record.patient_id)
+        record.dimension = len(vector)
+        record.vector = vector_to_bytes(vector)
+        record.text_hash = text_hash
+        record.checked_at = now
+        record.updated_at = now
+    PatientEmbedding.objects.bulk_update(existing, ['dimension', 'vector', 'text_hash', 'checked_at', 'updated_at'])
+    PatientEmbedding.objects.bulk_create([
+        PatientEmbedding(
+            patient_id=patient_id,
+            model_name=model,
+            dimension=len(vector),
+            vector=vector_to_bytes(vector),
+            text_hash=text_hash,
+            checked_at=now,
+        )
+        for patient_id, (vector, text_hash) in pending.items()
+    ])
+
+    if model == active_model_name():
+        for patient in patients:
+            patient_index.upsert(patient.hospital_id, patient.pk, by_patient[patient.pk][0])
+
+def refresh_patient_embeddings(patient_ids, api_key: str | None = None, batch_size: int = 100, force: bool = False,
+                               provider=None) -> int:
+    """
+    Re-embeds the given patients, up to batch_size texts per API call.
+    Patients whose text hash matches their stored vector are skipped unless force is set.
+    provider selects the model to embed with; it defaults to the active one, and vectors of
+    any other model are stored without touching the live search indexes.
+    Returns how many patients were actually sent to the embedding API.
+    """
+    provider = provider or active_provider()
+    model = provider.model_name
+    patients = list(
+        Patient.objects.filter(pk__in=list(patient_ids)).prefetch_related(*summary_prefetches()).order_by('pk')
+    )
+    stored_hashes = dict(
+        PatientEmbedding.objects.filter(patient__in=patients, model_name=model).values_list('patient_id', 'text_hash')
+    )
+
+    changed, unchanged = [], []
+    for patient in patients:
+        text = get_patient_text(patient)
+        text_hash = embedding_text_hash(text, model)
+        if not force and stored_hashes.get(patient.pk) == text_hash:
+            unchanged.append(patient.pk)
+        else:
+            changed.append((patient, text, text_hash))
+
+    if unchanged:
+        # Record the check so the backfill command stops treating these as stale
+        PatientEmbedding.objects.filter(patient_id__in=unchanged, model_name=model).update(checked_at=timezone.now())
+        metrics.incr('embedding.skipped', len(unchanged))
+
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        vectors = embed_texts([text for _, text, _ in batch], api_key=api_key, provider=provider)
+        store_patient_embeddings(
+            [patient for patient, _, _ in batch], vectors, [text_hash for _, _, text_hash in batch], model=model
+        )
+        metrics.incr('embedding.performed', len(batch))
+
+    refresh_patient_chunks(patients, api_key=api_key, batch_size=batch_size, force=force, provider=provider)
+    return len(changed)
+
+def refresh_patient_chunks(patients: list[Patient], api_key: str | None = None, batch_size: int = 100, force: bool = False,
+                           provider=None) -> int:
+    """
+    Re-chunks the given patients' notes, lab reports and history fields and embeds only
+    chunks whose text changed. Chunks whose source disappeared are deleted.
+    Returns how many chunks were sent to the embedding API.
+    """
+    if not patients:
+        return 0
+    provider = provider or active_provider()
+    model = provider.model_name
+    # Chunks of a model being built in the background stay out of the live index
+    live = model == active_model_name()
+    hospital_of = {patient.pk: patient.hospital_id for patient in patients}
+    with_documents = Patient.objects.filter(pk__in=list(hospital_of)).prefetch_related(
+        Prefetch('soap_notes', queryset=SOAPNote.objects.select_related('doctor').order_by('-created_at')),
+        Prefetch('lab_reports', queryset=LabReport.objects.order_by('-uploaded_at')),
+    )
+
+    existing = {
+        (row['patient_id'], row['source_type'], row['source_id'], row['position']): row
+        for row in PatientChunk.objects.filter(patient_id__in=list(hospital_of), model_name=model)
+        .values('id', 'patient_id', 'source_type', 'source_id', 'position', 'text_hash')
+    }
+
+    to_embed, seen = [], set()
+    for patient in with_documents:
+        for spec in build_patient_chunks(patient, patient.soap_notes.all(), patient.lab_reports.all()):
+            key = (patient.pk, spec.source_type, spec.source_id, spec.position)
+            seen.add(key)
+            text_hash = embedding_text_hash(spec.text, model)
+            current = existing.get(key)
+            if force or current is None or current['text_hash'] != text_hash:
+                to_embed.append((patient.pk, spec, text_hash, current['id'] if current else None))
+
+    obsolete = [row['id'] for key, row in existing.items() if key not in seen]
+    if obsolete:
+        PatientChunk.objects.filter(pk__in=obsolete).delete()
+        if live:
+            for chunk_id in obsolete:
+                chunk_index.remove(chunk_id)
+    metrics.incr('chunk_embedding.skipped', len(seen) - len(to_embed))
+
+    for start in range(0, len(to_embed), batch_size):
+        batch = to_embed[start:start + batch_size]
+        vectors = embed_texts([spec.text for _, spec, _, _ in batch], api_key=api_key, provider=provider)
+        updated, created = [], []
+        for (patient_id, spec, text_hash, chunk_id), vector in zip(batch, vectors):
+            chunk = PatientChunk(
+                id=chunk_id,
+                patient_id=patient_id,
+                source_type=spec.source_type,
+                source_id=spec.source_id,
+                position=spec.position,
+                text=spec.text,
+                model_name=model,
+                dimension=len(vector),
+                vector=vector_to_bytes(vector),
+                text_hash=text_hash,
+                updated_at=timezone.now(),
+            )
+            (updated if chunk_id else created).append((chunk, vector))
+        PatientChunk.objects.bulk_update([c for c, _ in updated], ['text', 'dimension', 'vector', 'text_hash', 'updated_at'])
+        PatientChunk.objects.bulk_create([c for c, _ in created])
+        for chunk, vector in (updated + created) if live else ():
+            chunk_index.upsert(hospital_of[chunk.patient_id], chunk.pk, vector, group=chunk.patient_id)
+        metrics.incr('chunk_embedding.performed', len(batch))
+    return len(to_embed)
+
+def embedding_savings() -> dict:
+    performed = metrics.get('embedding.performed')
+    skipped = metrics.get('embedding.skipped')
+    return {'performed': performed, 'skipped': skipped, 'skip_ratio': metrics.ratio(skipped, performed)}
+
 def cosine_similarity(a: list[float], b: list[float]) -> float:
     """Calculates cosine similarity between two vectors using numpy."""
     vec_a = np.array(a)
@@ -101,57 +335,224 @@ def cosine_similarity(a: list[float], b: list[float]) -> float:
         return 0.0
     return float(dot_product / (norm_a * norm_b))
 
-def semantic_search_patients(query: str, hospital_id: int, limit: int = 3):
+def _query_vector(query: str):
+    """(provider, api_key, query vector) of the active model, or None if the query cannot be embedded."""
+    provider = active_provider()
+    api_key = get_gemini_api_key()
+    if provider.requires_api_key and not api_key:
+        logger.warning("No Gemini API key found. Cannot run vector search.")
+        return None
+    query_embedding = get_query_embedding(
+        query, provider.model_name, lambda text: embed_query(text, api_key=api_key, provider=provider)
+    )
+    if query_embedding is None:
+        return None
+    return provider, api_key, query_embedding
+
+def _vector_search(query: str, hospital_id: int, candidates: int, allowed=None):
     """
-    Finds the most semantically similar patients to the query in the given hospital.
+    Dense retrieval over patient summaries and note/report chunks.
+    Returns ({patient_id: score}, {patient_id: [chunk_id, ...]}), or None when the
+    embedding API is unavailable (no key, error or rate limit).
     """
-    api_key = get_gemini_api_key()
-    if not api_key:
-        logger.warning("No Gemini API key found. Cannot run semantic search.")
-        return []
+    # 1. Embed the query (repeated questions are served from the query embedding cache).
+    # The model name travels with the vector so the indexes refuse to score another model's rows.
+    embedded = _query_vector(query)
+    if embedded is None:
+        return None
+    provider, api_key, query_embedding = embedded
+    model = provider.model_name
 
-    # 1. Embed the query
-    try:
-        from google import genai
-        from google.genai import types
-        
-        client = genai.Client(api_key=api_key)
-        result = client.models.embed_content(
-            model="text-embedding-004",
-            contents=query,
-            config=types.EmbedContentConfig(
-                task_type="RETRIEVAL_QUERY"
-            )
-        )
-        query_embedding = result.embeddings[0].values
-    except Exception as e:
-        logger.error(f"Error embedding query: {e}")
-        return []
+    # 2. Search only reads: patients are embedded by the background refresher when their
+    # records change, and anything still lacking a vector is backfilled by embed_patients.
 
-    if not query_embedding:
+    # 3. Score the whole hospital with a single matrix-vector product, both against the
+    # per-patient summaries and against individual note/report chunks. A patient's score is
+    # the better of its summary score and its pooled chunk score.
+    # Patients excluded by the structured filters are masked out before scoring.
+    min_score = provider.min_score
+    scores = dict(patient_index.search(
+        hospital_id, query_embedding, limit=candidates, min_score=min_score, allowed=allowed, model=model
+    ))
+    snippets = {}
+    for patient_id, pooled, hits in chunk_index.search_groups(
+        hospital_id, query_embedding, limit=candidates, min_score=min_score,
+        pooling=getattr(settings, 'AI_CHUNK_POOLING', 'max'), allowed=allowed, model=model,
+    ):
+        scores[patient_id] = max(scores.get(patient_id, 0.0), pooled)
+        snippets[patient_id] = [chunk_id for chunk_id, _ in hits]
+    return scores, snippets
+
+def semantic_search_patients(query: str, hospital_id: int, limit: int = 3, mode: str | None = None,
+                             filters: dict | None = None, reranker=None):
+    """
+    Finds the patients most relevant to the query in the given hospital.
+
+    mode is 'hybrid' (BM25 and vector rankings fused with reciprocal rank fusion),
+    'semantic' (vectors only) or 'lexical' (BM25 only, no network call); it defaults to
+    AI_SEARCH_MODE. If the query cannot be embedded, search falls back to lexical.
+
+    filters restricts the search to patients matching structured criteria, see
+    patient_filters.PATIENT_FILTERS (e.g. {'gender': 'F', 'min_age': 60, 'has_room': True}).
+
+    The best AI_RERANK_CANDIDATES fused matches are reordered by the reranker (AI_RERANKER
+    unless one is passed) before the top `limit` are returned.
+    """
+    mode = mode or getattr(settings, 'AI_SEARCH_MODE', 'hybrid')
+    reranker = reranker or configured_reranker()
+    reranking = not isinstance(reranker, NoReranker)
+    rerank_candidates = max(getattr(settings, 'AI_RERANK_CANDIDATES', 50), limit)
+    candidates = max(limit * 3, rerank_candidates) if reranking else limit * 3
+
+    allowed = allowed_patient_ids(hospital_id, filters)
+    if allowed is not None and not allowed.size:
         return []
 
-    # 2. Fetch patients and score them
-    patients = Patient.objects.filter(hospital_id=hospital_id)
-    scored_patients = []
-    
-    for patient in patients:
-        doc_embedding = get_or_create_patient_embedding(patient)
-        if doc_embedding:
-            score = cosine_similarity(query_embedding, doc_embedding)
-            # Only consider meaningful matches (score > 0.5 roughly depending on model)
-            if score > 0.4: 
-                scored_patients.append((score, patient))
-                
-    # 3. Sort by score descending and return top matches
-    scored_patients.sort(key=lambda x: x[0], reverse=True)
-    
+    dense = None
+    if mode != 'lexical':
+        dense = _vector_search(query, hospital_id, candidates, allowed)
+        if dense is None:
+            logger.warning("Embedding API unavailable, answering with lexical search only.")
+            metrics.incr('search.lexical_fallback')
+    vector_scores, snippets = dense or ({}, {})
+
+    lexical_scores = {}
+    if mode != 'semantic' or dense is None:
+        lexical_scores = dict(lexical_index.search(hospital_id, query, limit=candidates, allowed=allowed))
+    metrics.incr(f"search.{mode if dense is not None else 'lexical'}")
+
+    # 4. Fuse by rank. Scores are scaled so a patient ranked first by every list scores 1.0.
+    rankings = [
+        sorted(ranked, key=ranked.get, reverse=True)
+        for ranked in (vector_scores, lexical_scores) if ranked
+    ]
+    rrf_k = getattr(settings, 'AI_RRF_K', 60)
+    fused = reciprocal_rank_fusion(rankings, k=rrf_k)
+    scale = (rrf_k + 1) / max(len(rankings), 1)
+    fused = {patient_id: score * scale for patient_id, score in fused.items()}
+    matches = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+    # 5. Rerank the head of the fused list with a finer, slower model
+    if reranking and len(matches) > 1:
+        matches = reranker.rerank(query, hospital_id, dict(matches[:rerank_candidates]))
+        metrics.incr('search.reranked')
+    matches = matches[:limit]
+
+    patients_by_id = Patient.objects.in_bulk([patient_id for patient_id, _ in matches])
+    chunk_texts = PatientChunk.objects.in_bulk(
+        [chunk_id for patient_id, _ in matches for chunk_id in snippets.get(patient_id, [])]
+    )
+    # Patients matched without any chunk (e.g. lexical or summary-only hits) get their full summary
+    summaries = build_patient_texts([patient_id for patient_id, _ in matches if not snippets.get(patient_id)])
+
     results = []
-    for score, patient in scored_patients[:limit]:
+    for patient_id, score in matches:
+        patient = patients_by_id.get(patient_id)
+        if patient is None:
+            continue
+        matched = [chunk_texts[chunk_id].text for chunk_id in snippets.get(patient_id, []) if chunk_id in chunk_texts]
         results.append({
             "patient": patient,
             "score": score,
-            "text": get_patient_text(patient)
+            "retrieval_score": fused.get(patient_id),
+            "vector_score": vector_scores.get(patient_id),
+            "lexical_score": lexical_scores.get(patient_id),
+            "snippets": matched,
+            # Only the passages that matched, rather than the patient's entire record
+            "text": "\n".join([patient_header(patient)] + matched) if matched else summaries.get(patient_id) or get_patient_text(patient),
         })
         
     return results
+
+
+def _network_rank(result: dict) -> tuple[int, float, float]:
+    """
+    Merge key for results of different hospitals: their rank within their own hospital,
+    so each hospital's fusion and rerank order is kept and the lists are interleaved
+    round-robin (reciprocal rank fusion over lists that share no patients). Fused and
+    reranked scores are relative to their hospital; patients at the same rank are ordered
+    by cosine similarity, which every hospital computes with the active model, then BM25.
+    """
+    vector_score = result['vector_score']
+    return (-result['hospital_rank'], vector_score if vector_score is not None else -1.0,
+            result['lexical_score'] or 0.0)
+
+def _search_hospital(query: str, hospital_id: int, limit: int, mode: str | None, filters: dict | None, reranker):
+    """One hospital's share of a network search."""
+    try:
+        results = semantic_search_patients(query, hospital_id, limit=limit, mode=mode, filters=filters, reranker=reranker)
+    except Exception as e:
+        # One unreachable or corrupt index must not fail the whole network search
+        logger.error(f"Network search skipped hospital {hospital_id}: {e}")
+        metrics.incr('search.network_hospital_failed')
+        return []
+    for rank, result in enumerate(results, start=1):
+        result['hospital_id'] = hospital_id
+        result['hospital_rank'] = rank
+    return results
+
+def _search_hospitals(pending: queue.SimpleQueue, query: str, limit: int, mode: str | None, filters: dict | None,
+                      reranker) -> list[dict]:
+    """Pool thread of a network search: takes hospitals off the queue until none are left."""
+    found = []
+    try:
+        while True:
+            try:
+                hospital_id = pending.get_nowait()
+            except queue.Empty:
+                return found
+            found.extend(_search_hospital(query, hospital_id, limit, mode, filters, reranker))
+    finally:
+        # Pool threads are discarded after the search; close the connections they opened
+        connections.close_all()
+
+def search_patients_network(query: str, hospital_ids: list[int], limit: int = 3, mode: str | None = None,
+                            filters: dict | None = None, reranker=None, workers: int | None = None):
+    """
+    Finds the patients most relevant to the query across several hospitals at once.
+
+    Every hospital is searched with semantic_search_patients on its own index, up to
+    `workers` (AI_NETWORK_SEARCH_WORKERS) hospitals at a time on a thread pool, because
+    threads share the in-process indexes where worker processes would each have to load
+    their own. Vector scoring is NumPy matrix work that releases the GIL, but BM25 scoring,
+    fusion and result assembly are pure Python and hold it, so hybrid searches overlap
+    mostly on database reads and cold index builds (each hospital builds under its own
+    lock; segments are scored outside the index locks). The per-hospital top
+    `limit` lists are merged by rank with a heap into the network-wide top `limit`.
+
+    The caller is responsible for passing only hospitals the user may access, see
+    users.access.accessible_hospital_ids. Each result carries its 'hospital_id' and its
+    'hospital_rank' within that hospital.
+    """
+    hospital_ids = list(dict.fromkeys(hospital_ids))
+    if not hospital_ids:
+        return []
+    mode = mode or getattr(settings, 'AI_SEARCH_MODE', 'hybrid')
+    workers = min(workers or getattr(settings, 'AI_NETWORK_SEARCH_WORKERS', 8), len(hospital_ids))
+    metrics.incr('search.network')
+
+    # Embed once up front so the hospitals' searches share the cached query vector instead of
+    # each missing the cache at the same moment and calling the embedding API
+    if mode != 'lexical':
+        _query_vector(query)
+
+    if workers <= 1:
+        found = [result for hospital_id in hospital_ids
+                 for result in _search_hospital(query, hospital_id, limit, mode, filters, reranker)]
+    else:
+        pending = queue.SimpleQueue()
+        for hospital_id in hospital_ids:
+            pending.put(hospital_id)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='network-search') as pool:
+            # Each thread runs in a copy of the caller's context so the request's API key follows it
+            futures = [
+                pool.submit(contextvars.copy_context().run, _search_hospitals,
+                            pending, query, limit, mode, filters, reranker)
+                for _ in range(workers)
+            ]
+            found = [result for future in futures for result in future.result()]
+
+    if len(hospital_ids) == 1:
+        # Nothing to merge; keep the hospital's own (reranked) order
+        return found[:limit]
+    return heapq.nlargest(limit, found, key=_network_rank)
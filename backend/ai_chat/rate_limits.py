@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Requests per minute, bucket size (requests allowed back to back) and how long a caller may
+# queue for a token before getting RateLimited instead. Override per kind with AI_RATE_LIMITS.
+DEFAULT_BUDGETS = {
+    'chat': {'per_minute': 15, 'burst': 5, 'max_wait': 10.0},
+    'embed': {'per_minute': 150, 'burst': 20, 'max_wait': 30.0},
+    'ocr': {'per_minute': 10, 'burst': 3, 'max_wait': 120.0},
+}
+
+
+class RateLimited(Exception):
+    """No request budget left for this API key and call type within the caller's wait limit."""
+
+    def __init__(self, kind: str, retry_after: float):
+        self.kind = kind
+        self.retry_after = retry_after
+        super().__init__(f"Gemini {kind} rate limit reached for this API key; retry in {retry_after:.0f}s.")
+
+
+def key_digest(api_key: str | None) -> str:
+    """Buckets are keyed by a digest so API keys never appear in cache keys or metrics."""
+    return hashlib.sha256((api_key or '').encode()).hexdigest()[:12]
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens per second up to `capacity`.
+    A caller that has to wait reserves its token up front by taking the balance negative,
+    so waiting callers are served in arrival order and each sleeps exactly once.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens: float, max_wait: float, now: float) -> float:
+        """Takes the tokens and returns how long to wait before using them, or -1 if that exceeds max_wait."""
+        self._refill(now)
+        wait = max(tokens - self.tokens, 0.0) / self.rate
+        if wait > max_wait:
+            return -1.0
+        self.tokens -= tokens
+        return wait
+
+    def wait_time(self, tokens: float, now: float) -> float:
+        self._refill(now)
+        return max(tokens - self.tokens, 0.0) / self.rate
+
+    def utilization(self, now: float) -> float:
+        self._refill(now)
+        return round(1.0 - max(self.tokens, 0.0) / self.capacity, 4)
+
+
+class RateLimiter:
+    """
+    Request budgets for Gemini calls, per API key and call type ('chat', 'embed', 'ocr'),
+    so a burst of uploads or searches from one hospital queues behind its own budget
+    instead of burning the key's quota and making every path fail at once.
+
+    Buckets live in this process by default. With AI_RATE_LIMIT_CACHE naming a shared cache
+    (e.g. Redis) all workers count against the same budget, using fixed windows of
+    `burst` requests every burst / rate seconds, since Django caches only offer atomic
+    increments, not compare-and-set.
+    """
+
+    def __init__(self, budgets: dict | None = None, cache_alias: str | None = None):
+        self._budgets = budgets
+        self._cache_alias = cache_alias
+        self._buckets: dict[tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def budget(self, kind: str) -> dict:
+        overrides = self._budgets if self._budgets is not None else getattr(settings, 'AI_RATE_LIMITS', {})
+        return {**DEFAULT_BUDGETS.get(kind, DEFAULT_BUDGETS['chat']), **overrides.get(kind, {})}
+
+    @property
+    def cache_alias(self) -> str:
+        return self._cache_alias if self._cache_alias is not None else getattr(settings, 'AI_RATE_LIMIT_CACHE', '')
+
+    def _bucket(self, digest: str, kind: str) -> TokenBucket:
+        bucket = self._buckets.get((digest, kind))
+        if bucket is None:
+            budget = self.budget(kind)
+            bucket = self._buckets[(digest, kind)] = TokenBucket(budget['per_minute'] / 60.0, budget['burst'])
+        return bucket
+
+    def acquire(self, api_key: str | None, kind: str, tokens: float = 1, timeout: float | None = None) -> float:
+        """
+        Takes `tokens` from the key's budget for `kind`, waiting up to `timeout` (the kind's
+        max_wait by default) for them. Returns the seconds waited; raises RateLimited at once
+        if the wait would be longer, so callers can fall back or report "try later".
+        """
+        if not getattr(settings, 'AI_RATE_LIMIT_ENABLED', False):
+            return 0.0
+        max_wait = self.budget(kind)['max_wait'] if timeout is None else timeout
+        if self.cache_alias:
+            wait = self._acquire_shared(key_digest(api_key), kind, tokens, max_wait)
+        else:
+            with self._lock:
+                bucket = self._bucket(key_digest(api_key), kind)
+                now = time.monotonic()
+                wait = bucket.reserve(tokens, max_wait, now)
+                if wait < 0:
+                    retry_after = bucket.wait_time(tokens, now)
+            if wait < 0:
+                metrics.incr(f"rate_limit.{kind}.rejected")
+                raise RateLimited(kind, retry_after)
+        if wait > 0:
+            metrics.incr(f"rate_limit.{kind}.waited")
+            time.sleep(wait)
+        metrics.incr(f"rate_limit.{kind}.granted")
+        return wait
+
+    def _acquire_shared(self, digest: str, kind: str, tokens: float, max_wait: float) -> float:
+        budget = self.budget(kind)
+        window = budget['burst'] / (budget['per_minute'] / 60.0)
+        cache = caches[self.cache_alias]
+        now = time.time()
+        try:
+            start = now
+            # Count in the first window that still has room, at most one window past the wait limit
+            while start - now <= max_wait + window:
+                slot = int(start // window)
+                key = f"ratelimit:{kind}:{digest}:{slot}"
+                cache.add(key, 0, timeout=math.ceil(window * 2))
+                used = cache.incr(key, int(tokens))
+                if used <= budget['burst']:
+                    wait = max(start - now, 0.0)
+                    if wait <= max_wait:
+                        return wait
+                    cache.decr(key, int(tokens))
+                    break
+                cache.decr(key, int(tokens))
+                start = (slot + 1) * window
+        except Exception as e:
+            # A cache outage must not block Gemini calls; the API's own limits still apply
+            logger.warning(f"Shared rate limit cache unavailable, not limiting: {e}")
+            return 0.0
+        metrics.incr(f"rate_limit.{kind}.rejected")
+        raise RateLimited(kind, max(start - now, 0.0))
+
+    def stats(self) -> dict:
+        """Current utilization (0 = full budget left, 1 = exhausted) per key digest and kind, for this process."""
+        now = time.monotonic()
+        with self._lock:
+            buckets = {
+                f"{digest}/{kind}": {
+                    'utilization': bucket.utilization(now),
+                    'tokens': round(max(bucket.tokens, 0.0), 2),
+                    # Time until a new caller would get a token, including callers already queued
+                    'next_token_in_s': round(bucket.wait_time(1, now), 2),
+                    'capacity': bucket.capacity,
+                }
+                for (digest, kind), bucket in self._buckets.items()
+            }
+        counters = {
+            kind: {
+                event: metrics.get(f"rate_limit.{kind}.{event}")
+                for event in ('granted', 'waited', 'rejected')
+            }
+            for kind in DEFAULT_BUDGETS
+        }
+        return {'shared': bool(self.cache_alias), 'buckets': buckets, 'counters': counters}
+
+
+rate_limiter = RateLimiter()
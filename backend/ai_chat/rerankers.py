@@ -0,0 +1,192 @@
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .lexical_index import BM25_B, BM25_K1, lexical_index, tokenize
+
+
+class Reranker:
+    """
+    Second search stage: reorders the best first-stage candidates with a model that is
+    too slow to run over a whole hospital but cheap for a few dozen patients.
+    """
+
+    def rerank(self, query: str, hospital_id: int, candidates: dict[int, float]) -> list[tuple[int, float]]:
+        """
+        Takes {patient_id: first-stage score} and returns [(patient_id, score)] best first.
+        Scores are comparable within one call only.
+        """
+        raise NotImplementedError
+
+
+class NoReranker(Reranker):
+    """Keeps the first-stage order."""
+
+    def rerank(self, query, hospital_id, candidates):
+        return sorted(candidates.items(), key=lambda item: item[1], reverse=True)
+
+
+class FieldWeightedReranker(Reranker):
+    """
+    Local reranker: BM25F over the candidates' record fields, so a term in the medical
+    history counts more than the same term in a passing note, blended with the first-stage
+    score and a boost for recent notes and reports that mention the query. Term rarity
+    comes from the hospital's lexical index. Needs three queries and no network call.
+    """
+
+    FIELD_WEIGHTS = {
+        'history': 3.0,      # medical history and allergies
+        'symptoms': 2.0,
+        'assessment': 2.0,   # SOAP assessment and plan
+        'notes': 1.0,        # SOAP subjective and objective
+        'reports': 1.0,      # lab report titles and text
+        'name': 1.0,
+    }
+
+    def __init__(self, field_weights: dict | None = None, prior_weight: float = 0.3,
+                 recency_weight: float = 0.1, recency_half_life_days: float = 180.0):
+        self.field_weights = {**self.FIELD_WEIGHTS, **(field_weights or {})}
+        self.prior_weight = prior_weight
+        self.recency_weight = recency_weight
+        self.recency_half_life_days = recency_half_life_days
+
+    def _load_fields(self, patient_ids):
+        """{patient_id: {field: tokens}} and {patient_id: [(tokens, written_at)]} for the candidates."""
+        from patients.models import LabReport, Patient, SOAPNote
+
+        fields = {patient_id: {field: [] for field in self.field_weights} for patient_id in patient_ids}
+        dated = {patient_id: [] for patient_id in patient_ids}
+        for row in Patient.objects.filter(pk__in=patient_ids).values(
+            'pk', 'first_name', 'last_name', 'symptoms', 'medical_history', 'allergies'
+        ):
+            record = fields[row['pk']]
+            record['name'] = tokenize(f"{row['first_name']} {row['last_name']}")
+            record['history'] = tokenize(f"{row['medical_history'] or ''} {row['allergies'] or ''}")
+            record['symptoms'] = tokenize(row['symptoms'])
+        for row in SOAPNote.objects.filter(patient_id__in=patient_ids).values(
+            'patient_id', 'subjective', 'objective', 'assessment', 'plan', 'created_at'
+        ):
+            notes = tokenize(f"{row['subjective']} {row['objective']}")
+            assessment = tokenize(f"{row['assessment']} {row['plan']}")
+            fields[row['patient_id']]['notes'] += notes
+            fields[row['patient_id']]['assessment'] += assessment
+            dated[row['patient_id']].append((notes + assessment, row['created_at']))
+        for row in LabReport.objects.filter(patient_id__in=patient_ids).values(
+            'patient_id', 'title', 'extracted_text', 'uploaded_at'
+        ):
+            tokens = tokenize(f"{row['title']} {row['extracted_text'] or ''}")
+            fields[row['patient_id']]['reports'] += tokens
+            dated[row['patient_id']].append((tokens, row['uploaded_at']))
+        return fields, dated
+
+    def _recency(self, documents, terms: set, now) -> float:
+        """exp decay of the age of the newest note or report that mentions a query term."""
+        best = 0.0
+        for tokens, written_at in documents:
+            if written_at is None or terms.isdisjoint(tokens):
+                continue
+            age_days = max((now - written_at).total_seconds() / 86400, 0.0)
+            best = max(best, 0.5 ** (age_days / self.recency_half_life_days))
+        return best
+
+    def rerank(self, query, hospital_id, candidates):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or len(candidates) < 2:
+            return NoReranker().rerank(query, hospital_id, candidates)
+
+        patient_ids = list(candidates)
+        fields, dated = self._load_fields(patient_ids)
+        n_docs, frequencies = lexical_index.document_frequencies(hospital_id, terms)
+        idf = {
+            term: math.log(1 + (n_docs - frequencies.get(term, 0) + 0.5) / (frequencies.get(term, 0) + 0.5))
+            for term in terms
+        }
+
+        average = {
+            field: (sum(len(fields[pid][field]) for pid in patient_ids) / len(patient_ids)) or 1.0
+            for field in self.field_weights
+        }
+        lexical = {}
+        for patient_id in patient_ids:
+            counts = {field: Counter(tokens) for field, tokens in fields[patient_id].items()}
+            score = 0.0
+            for term in terms:
+                # BM25F: length-normalized term frequencies are weighted per field, then saturated once
+                weighted_tf = sum(
+                    weight * counts[field][term] / (1 - BM25_B + BM25_B * len(fields[patient_id][field]) / average[field])
+                    for field, weight in self.field_weights.items() if counts[field][term]
+                )
+                score += idf[term] * weighted_tf / (BM25_K1 + weighted_tf)
+            lexical[patient_id] = score
+
+        top_lexical = max(lexical.values()) or 1.0
+        top_prior = max(candidates.values()) or 1.0
+        lexical_weight = 1.0 - self.prior_weight - self.recency_weight
+        now = timezone.now()
+        query_terms = set(terms)
+        scores = {
+            patient_id: (
+                lexical_weight * lexical[patient_id] / top_lexical
+                + self.prior_weight * candidates[patient_id] / top_prior
+                + self.recency_weight * self._recency(dated[patient_id], query_terms, now)
+            )
+            for patient_id in patient_ids
+        }
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Scores (query, patient summary) pairs with a small cross-encoder from the optional
+    sentence-transformers package. Slower than the local reranker but reads meaning, not
+    just shared words. The model is downloaded on first use.
+    """
+
+    def __init__(self, model: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', max_length: int = 512):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImproperlyConfigured(
+                "The cross-encoder reranker needs sentence-transformers: pip install sentence-transformers"
+            )
+        self._model = CrossEncoder(model, max_length=max_length)
+
+    def rerank(self, query, hospital_id, candidates):
+        from .rag_utils import build_patient_texts
+
+        texts = build_patient_texts(list(candidates))
+        patient_ids = [patient_id for patient_id in candidates if patient_id in texts]
+        if not patient_ids:
+            return []
+        scores = self._model.predict([(query, texts[patient_id]) for patient_id in patient_ids])
+        return sorted(zip(patient_ids, (float(score) for score in scores)), key=lambda item: item[1], reverse=True)
+
+
+RERANKERS = {
+    'none': NoReranker,
+    'local': FieldWeightedReranker,
+    'cross-encoder': CrossEncoderReranker,
+}
+
+
+def build_reranker(name: str, options: dict | None = None) -> Reranker:
+    """Builds a reranker from a registered name or the dotted path of a Reranker subclass."""
+    reranker_class = RERANKERS[name] if name in RERANKERS else import_string(name)
+    return reranker_class(**(options or {}))
+
+
+_configured = None
+
+
+def configured_reranker() -> Reranker:
+    """The reranker named by AI_RERANKER with AI_RERANKER_OPTIONS, built on first use."""
+    global _configured
+    if _configured is None:
+        _configured = build_reranker(
+            getattr(settings, 'AI_RERANKER', 'local'), getattr(settings, 'AI_RERANKER_OPTIONS', {})
+        )
+    return _configured
@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .ann_index import POINTER_FILE, write_generation
+
+logger = logging.getLogger(__name__)
+
+# Names the generation published last; workers read it on each search to notice new generations
+VERSION_FILE = 'VERSION'
+SEGMENT_ARRAYS = ('ids', 'groups', 'matrix', 'scales')
+
+
+def shared_root() -> Path:
+    return Path(getattr(settings, 'AI_SHARED_INDEX_DIR', Path(settings.BASE_DIR) / 'var' / 'index'))
+
+
+class SharedGeneration:
+    """
+    One published hospital segment, memory-mapped read-only. The OS page cache backs the
+    arrays, so every worker mapping the same files shares a single copy of the matrix.
+    """
+
+    __slots__ = ('version', 'meta', 'arrays')
+
+    def __init__(self, path: Path):
+        self.meta = json.loads((path / 'meta.json').read_text())
+        self.version = self.meta['version']
+        self.arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode='r')
+            for name in SEGMENT_ARRAYS if (path / f"{name}.npy").exists()
+        }
+
+
+class SharedIndexStore:
+    """
+    Per-hospital embedding segments published by one loader process (`manage.py
+    publish_embedding_index`) and attached read-only by every server worker.
+
+    Publishing writes a new numbered generation next to the old one and atomically swaps
+    the hospital's current.json pointer, so readers see either the old or the new build,
+    never a partial one. The per-kind VERSION file is then replaced with the name of that
+    generation; readers compare it on every search and re-read pointers only when it moved.
+    Generation names never repeat, so concurrent publishers need no read-modify-write: a
+    reader always sees a name it has not seen before once anything was published after its
+    last check, whichever publisher wrote last.
+    """
+
+    def __init__(self, kind: str, root: Path | None = None):
+        self.kind = kind
+        self._root = root
+
+    @property
+    def directory(self) -> Path:
+        return (self._root or shared_root()) / self.kind
+
+    def version(self) -> str:
+        """Name of the generation of this kind published last (e.g. '12/v3'); '' if none was."""
+        try:
+            return (self.directory / VERSION_FILE).read_text()
+        except FileNotFoundError:
+            return ''
+
+    def _publish_version(self, hospital_id: int, version: int) -> None:
+        staging = self.directory / f".{VERSION_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        staging.write_text(f"{hospital_id}/v{version}")
+        os.replace(staging, self.directory / VERSION_FILE)
+
+    def publish(self, hospital_id: int, segment, meta: dict, keep: int = 2) -> int:
+        """Writes the segment as the hospital's next generation and returns its version."""
+        arrays = {
+            'ids': segment.ids,
+            'groups': segment.groups,
+            'matrix': segment.matrix,
+            'scales': segment.scales,
+        }
+        version = write_generation(self.kind, hospital_id, arrays, {
+            **meta, 'rows': len(segment), 'dimension': segment.dimension,
+        }, keep=keep, root=self._root or shared_root())
+        self._publish_version(hospital_id, version)
+        return version
+
+    def open(self, hospital_id: int, current: SharedGeneration | None = None) -> SharedGeneration | None:
+        """The hospital's current generation (`current` itself if unchanged), or None if none is published."""
+        directory = self.directory / str(hospital_id)
+        try:
+            version = json.loads((directory / POINTER_FILE).read_text())['version']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        if current is not None and current.version == version:
+            return current
+        try:
+            return SharedGeneration(directory / f"v{version}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Could not open shared index {self.kind}/{hospital_id} v{version}: {e}")
+            return None
@@ -0,0 +1,94 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from patients.models import Patient, PatientChunk, PatientEmbedding, SOAPNote, LabReport
+from .embedding_index import chunk_index, patient_index, vector_from_bytes
+from .embedding_providers import active_model_name
+from .embedding_refresh import embedding_refresher
+from .lexical_index import lexical_index
+
+# Patient fields that feed get_patient_text and the profile chunks; saves touching only other fields keep the vectors
+EMBEDDED_PATIENT_FIELDS = {'first_name', 'last_name', 'date_of_birth', 'gender', 'address', 'symptoms', 'medical_history', 'allergies'}
+
+
+def schedule_refresh(patient_id, delay=None):
+    """Queues a debounced re-embed and marks the patient for a lexical re-index once the surrounding transaction has committed."""
+    # The re-embed job commits or rolls back with the change that caused it
+    embedding_refresher.schedule(patient_id, delay=delay)
+    transaction.on_commit(lambda: lexical_index.mark_dirty(patient_id))
+
+
+def hospital_of(patient_id):
+    """The patient's hospital, from the index when it holds the patient, else with one query."""
+    hospital_id = patient_index.owner_of(patient_id)
+    if hospital_id is None:
+        hospital_id = Patient.objects.filter(pk=patient_id).values_list('hospital_id', flat=True).first()
+    return hospital_id
+
+
+@receiver(post_save, sender=PatientEmbedding)
+def sync_patient_index(sender, instance, **kwargs):
+    """Keeps the in-process embedding index in step with the stored patient vector."""
+    if instance.model_name != active_model_name():
+        return
+    if PatientEmbedding.patient.is_cached(instance):
+        hospital_id = instance.patient.hospital_id
+    else:
+        hospital_id = hospital_of(instance.patient_id)
+    patient_index.upsert(hospital_id, instance.patient_id, vector_from_bytes(instance.vector))
+
+
+@receiver(post_delete, sender=PatientEmbedding)
+def drop_patient_embedding(sender, instance, **kwargs):
+    if instance.model_name == active_model_name():
+        patient_index.remove(instance.patient_id)
+
+
+@receiver(post_delete, sender=PatientChunk)
+def drop_patient_chunk(sender, instance, **kwargs):
+    if instance.model_name == active_model_name():
+        chunk_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Patient)
+def move_patient_between_hospitals(sender, instance, created=False, update_fields=None, **kwargs):
+    """Re-files an indexed patient under their new hospital after a transfer."""
+    if created or (update_fields is not None and 'hospital' not in update_fields):
+        return
+    # Only a patient this process has indexed can be filed under the wrong hospital, and a
+    # search loads a hospital's patient and chunk segments together, so the patient index
+    # tells whether anything moved without querying on every save
+    owner = patient_index.owner_of(instance.pk)
+    if owner is None or owner == instance.hospital_id:
+        return
+    # Chunks move as a block; rebuilding both segments is simpler than re-filing each one
+    chunk_index.invalidate(owner)
+    chunk_index.invalidate(instance.hospital_id)
+
+    record = instance.embeddings.filter(model_name=active_model_name()).first()
+    if record is None:
+        patient_index.remove(instance.pk)
+    else:
+        patient_index.upsert(instance.hospital_id, instance.pk, vector_from_bytes(record.vector))
+
+
+@receiver(post_delete, sender=Patient)
+def drop_deleted_patient(sender, instance, **kwargs):
+    lexical_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Patient)
+def refresh_on_patient_change(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and not EMBEDDED_PATIENT_FIELDS.intersection(update_fields):
+        return
+    # A new patient has no vector at all and cannot be found by vector search until embedded,
+    # so it is not debounced; notes added right after still push the job back as usual
+    schedule_refresh(instance.pk, delay=0 if created else None)
+
+
+@receiver(post_save, sender=SOAPNote)
+@receiver(post_delete, sender=SOAPNote)
+@receiver(post_save, sender=LabReport)
+@receiver(post_delete, sender=LabReport)
+def refresh_on_document_change(sender, instance, **kwargs):
+    schedule_refresh(instance.patient_id)
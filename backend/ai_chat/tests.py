@@ -1,3 +1,755 @@
-from django.test import TestCase
+import datetime
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache, caches
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from employees.models import Employee
+from hospitals.models import Hospital, Room
+from patients.models import LabReport, Patient, SOAPNote
+from . import metrics
+from .ann_index import AnnIndex, build_ivf, fingerprint_token, write_generation
+from .embedding_index import EmbeddingIndex, LayeredSegment, normalize_rows
+from .embedding_providers import ActiveModel, HashingEmbeddingProvider, active_model_name, configured_provider_spec
+from .models import EmbeddingModelVersion
+from .lexical_index import LexicalIndex, lexical_index, reciprocal_rank_fusion, tokenize
+from .model_health import AUTH, ERROR, NOT_FOUND, RATE_LIMITED, UNAVAILABLE, ModelHealthTracker, classify_error
+from .patient_filters import allowed_patient_ids, years_before
+from .query_cache import get_query_embedding
+from .rag_utils import (
+    SUMMARY_LAB_REPORTS, SUMMARY_SOAP_NOTES, build_patient_texts, get_patient_text, search_patients_network,
+    semantic_search_patients,
+)
+from .rerankers import NoReranker
+from .rate_limits import RateLimited, RateLimiter, TokenBucket
+from .shared_index import SharedIndexStore
+
+
+class BuildPatientTextsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hospital = Hospital.objects.create(name="City Hospital", address="Main Road", contact_number="100")
+        doctor = Employee.objects.create(
+            hospital=hospital, first_name="Asha", last_name="Rao", role='DOCTOR',
+            email="asha@example.com", contact_number="101", joined_date=datetime.date(2020, 1, 1),
+        )
+        for i in range(20):
+            patient = Patient.objects.create(
+                hospital=hospital, first_name="Patient", last_name=str(i), date_of_birth=datetime.date(1980, 1, 1),
+                gender='F', contact_number="102", address="Somewhere", medical_history="Hypertension",
+            )
+            for n in range(SUMMARY_SOAP_NOTES + 2):
+                SOAPNote.objects.create(
+                    patient=patient, doctor=doctor, subjective="s", objective="o",
+                    assessment=f"assessment {n}", plan="rest",
+                )
+            for n in range(SUMMARY_LAB_REPORTS + 2):
+                LabReport.objects.create(patient=patient, title=f"CBC {n}", extracted_text="Hb 12.1")
+
+    def test_constant_query_count(self):
+        # Patients, SOAP notes with their doctors, lab reports
+        with self.assertNumQueries(3):
+            texts = build_patient_texts(Patient.objects.all())
+        self.assertEqual(len(texts), 20)
+
+    def test_accepts_patient_ids(self):
+        patient_ids = list(Patient.objects.values_list('pk', flat=True)[:5])
+        with self.assertNumQueries(3):
+            texts = build_patient_texts(patient_ids)
+        self.assertEqual(set(texts), set(patient_ids))
+
+    def test_matches_single_patient_text(self):
+        texts = build_patient_texts(Patient.objects.all())
+        for patient in Patient.objects.all():
+            self.assertEqual(texts[patient.pk], get_patient_text(patient))
+
+    def test_limits_recent_notes_and_reports_per_patient(self):
+        text = next(iter(build_patient_texts(Patient.objects.all()).values()))
+        self.assertEqual(text.count("by Dr. Rao"), SUMMARY_SOAP_NOTES)
+        self.assertEqual(text.count("- Document: CBC"), SUMMARY_LAB_REPORTS)
+
+
+CONDITIONS = ["diabetes", "asthma", "hypertension", "migraine", "anaemia", "arthritis", "epilepsy", "psoriasis"]
+DRUGS = ["metformin", "salbutamol", "amlodipine", "sumatriptan", "ferrous", "methotrexate", "levetiracetam"]
+
+
+def synthetic_records(count: int) -> list[str]:
+    return [
+        f"{CONDITIONS[i % len(CONDITIONS)]} treated with {DRUGS[i % len(DRUGS)]}, follow up in {i % 5 + 1} weeks"
+        for i in range(count)
+    ]
+
+
+class AnnIndexTests(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        overridden = override_settings(AI_ANN_DIR=self.root)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        metrics.reset()
+
+        self.provider = HashingEmbeddingProvider(dimension=64)
+        self.ids = list(range(1, 201))
+        self.matrix = normalize_rows(np.asarray(self.provider.embed_documents(synthetic_records(200)), dtype=np.float32))
+        self.fingerprint = (200, datetime.datetime(2024, 1, 1))
+        self.arrays = build_ivf(self.ids, self.ids, self.matrix, n_lists=8)
+        self.write(model=active_model_name())
+        self.ann = AnnIndex('patients', lambda hospital_id: self.fingerprint, refresh_interval=0, nprobe=2)
+
+    def write(self, model):
+        write_generation('patients', 1, self.arrays, {
+            'model': model, 'fingerprint': fingerprint_token(self.fingerprint),
+        }, root=self.root)
+
+    def query(self, text):
+        return np.asarray(self.provider.embed_query(text), dtype=np.float32)
+
+    def test_lists_partition_the_rows(self):
+        offsets = self.arrays['offsets']
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], 200)
+        self.assertTrue(np.all(np.diff(offsets) >= 0))
+        self.assertEqual(sorted(self.arrays['ids'].tolist()), self.ids)
+
+    def test_probes_only_the_nearest_lists(self):
+        query = self.query("asthma salbutamol")
+        ids, groups, scores = self.ann.candidates(1, query)
+        self.assertLess(len(ids), 200)
+        np.testing.assert_array_equal(ids, groups)
+        np.testing.assert_allclose(scores, self.matrix[ids - 1] @ (query / np.linalg.norm(query)), rtol=1e-5)
+        self.assertEqual(metrics.get('ann.patients.searches'), 1)
+        # A stored row is filed under its nearest centroid, which is the first list probed for it
+        ids, _, scores = self.ann.candidates(1, self.matrix[41])
+        self.assertEqual(int(ids[np.argmax(scores)]), 42)
+
+    def test_probing_every_list_is_exact_search(self):
+        ids, _, _ = self.ann.candidates(1, self.query("migraine"), nprobe=8)
+        self.assertEqual(sorted(ids.tolist()), self.ids)
+
+    def test_small_allowed_sets_are_scored_exactly(self):
+        ids, _, _ = self.ann.candidates(1, self.query("migraine"), allowed=np.array([3, 5, 7]))
+        self.assertEqual(sorted(ids.tolist()), [3, 5, 7])
+        self.assertEqual(metrics.get('ann.patients.filtered_exact'), 1)
+
+    def test_stale_fingerprint_falls_back_to_exact_search(self):
+        self.assertIsNotNone(self.ann.candidates(1, self.query("migraine")))
+        self.fingerprint = (201, datetime.datetime(2024, 1, 2))
+        self.assertIsNone(self.ann.candidates(1, self.query("migraine")))
+        self.assertEqual(metrics.get('ann.patients.fallbacks'), 1)
+
+        # The embedding index then answers from its in-memory segment
+        index = EmbeddingIndex(loader=lambda hospital_id: (self.ids, list(self.matrix), None), ann=self.ann)
+        results = index.search(1, self.query("epilepsy levetiracetam"), limit=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(metrics.get('ann.patients.fallbacks'), 2)
+        self.assertIn(1, index._segments)
+
+    def test_build_for_another_model_is_not_used(self):
+        self.write(model='another-model')
+        self.assertIsNone(self.ann.candidates(1, self.query("migraine")))
+        self.assertIsNone(AnnIndex('patients', lambda hospital_id: self.fingerprint).candidates(2, self.query("x")))
+
+
+class SharedIndexTests(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        rng = np.random.default_rng(0)
+        self.ids = list(range(1, 51))
+        self.vectors = list(rng.normal(size=(50, 16)).astype(np.float32))
+        self.fingerprint = self.written(1)
+        self.store = SharedIndexStore('patients', root=self.root)
+        self.publisher = self.index()
+        self.worker = self.index()
+
+    @staticmethod
+    def written(minute):
+        # (row count, latest write) as returned by the database fingerprint
+        return 50, datetime.datetime(2024, 1, 1, 0, minute)
+
+    def index(self):
+        return EmbeddingIndex(
+            loader=lambda hospital_id: (self.ids, self.vectors, None),
+            fingerprint=lambda hospital_id: self.fingerprint, shared=self.store,
+        )
+
+    def test_worker_attaches_published_generation(self):
+        self.assertIsNone(self.store.open(1))
+        self.assertEqual(self.publisher.publish(1), 1)
+        # Unchanged fingerprint: nothing to publish
+        self.assertIsNone(self.publisher.publish(1))
+
+        results = self.worker.search(1, self.vectors[4], limit=1)
+        self.assertEqual(results[0][0], 5)
+        segment = self.worker._segment_for(1)
+        self.assertTrue(segment.shared)
+        self.assertEqual(self.worker.nbytes(1), 0)
+
+    def test_open_returns_current_generation_until_pointer_moves(self):
+        self.publisher.publish(1)
+        first = self.store.open(1)
+        self.assertIs(self.store.open(1, first), first)
+
+        self.vectors[0] = -self.vectors[0]
+        self.fingerprint = self.written(2)
+        self.assertEqual(self.publisher.publish(1), 2)
+        second = self.store.open(1, first)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.version, 2)
+
+    def test_worker_swaps_to_new_generation(self):
+        self.publisher.publish(1)
+        self.assertEqual(self.worker.search(1, self.vectors[0], limit=1)[0][0], 1)
+        attached = self.worker._generations[1][0]
+
+        self.vectors[0] = -self.vectors[0]
+        self.fingerprint = self.written(2)
+        self.publisher.publish(1)
+        self.assertNotEqual(self.worker.search(1, -self.vectors[0], limit=1)[0][0], 1)
+        self.assertEqual(self.worker._generations[1][0].version, 2)
+        self.assertIsNot(self.worker._generations[1][0], attached)
+
+    def test_publish_keeps_only_recent_generations(self):
+        for version in range(1, 5):
+            self.fingerprint = self.written(version)
+            self.publisher.publish(1, keep=2)
+        directory = self.root / 'patients' / '1'
+        generations = sorted(path.name for path in directory.iterdir() if path.is_dir())
+        self.assertEqual(generations, ['v3', 'v4'])
+        self.assertEqual(self.store.open(1).version, 4)
+
+    def test_version_names_the_last_published_generation(self):
+        self.assertEqual(self.store.version(), '')
+        self.publisher.publish(1)
+        self.publisher.publish(2)
+        self.assertEqual(self.store.version(), '2/v1')
+        self.assertEqual(self.worker.search(2, self.vectors[0], limit=1)[0][0], 1)
+
+        # A publisher that finishes late overwrites a newer name; workers still see it moved
+        self.fingerprint = self.written(2)
+        self.vectors[0] = -self.vectors[0]
+        self.publisher.publish(2)
+        self.store._publish_version(1, 1)
+        self.assertNotEqual(self.worker.search(2, -self.vectors[0], limit=1)[0][0], 1)
+        self.assertEqual(self.worker._generations[2][0].version, 2)
+
+    def test_local_changes_are_layered_over_shared_base(self):
+        self.publisher.publish(1)
+        self.worker.search(1, self.vectors[0], limit=1)
+        query = self.vectors[5]
+        self.worker.upsert(1, 6, -query)
+        self.worker.upsert(1, 500, query)
+        self.worker.remove(7)
+
+        results = dict(self.worker.search(1, query, limit=50))
+        segment = self.worker._segment_for(1)
+        self.assertIsInstance(segment, LayeredSegment)
+        self.assertTrue(segment.base.shared)
+        self.assertEqual(self.worker.size(1), 50)
+        self.assertAlmostEqual(results[500], 1.0, places=5)
+        # Replaced rows are scored with their new vector only, removed rows not at all
+        self.assertAlmostEqual(results[6], -1.0, places=5)
+        self.assertNotIn(7, results)
+        self.assertEqual(self.worker.search(1, -query, limit=1)[0][0], 6)
+        # Only the overlay is private; the shared base is not copied
+        self.assertLess(self.worker.nbytes(1), segment.base.matrix.nbytes)
+
+
+class NetworkSearchMergeTests(SimpleTestCase):
+    @staticmethod
+    def result(patient, vector_score, lexical_score=None):
+        return {'patient': patient, 'score': 1.0, 'vector_score': vector_score, 'lexical_score': lexical_score}
+
+    def search(self, lists):
+        def fake_search(query, hospital_id, limit, mode, filters, reranker):
+            return [dict(result) for result in lists[hospital_id]]
+
+        with mock.patch('ai_chat.rag_utils.semantic_search_patients', side_effect=fake_search):
+            return search_patients_network("metformin", list(lists), limit=4, mode='lexical', workers=1)
+
+    def test_keeps_each_hospitals_order(self):
+        found = self.search({
+            # The hospital's reranker put a keyword-only match first
+            1: [self.result('a1', None, 9.0), self.result('a2', 0.9)],
+            2: [self.result('b1', 0.5), self.result('b2', 0.4), self.result('b3', 0.3)],
+        })
+        self.assertEqual([result['patient'] for result in found], ['b1', 'a1', 'a2', 'b2'])
+        self.assertEqual([result['hospital_rank'] for result in found], [1, 1, 2, 2])
+        self.assertEqual(found[1]['hospital_id'], 1)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_is_granted_without_waiting(self):
+        bucket = TokenBucket(rate=1.0, capacity=3)
+        self.assertEqual([bucket.reserve(1, 10, now=bucket.updated) for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_waiters_are_served_in_arrival_order(self):
+        bucket = TokenBucket(rate=2.0, capacity=1)
+        now = bucket.updated
+        self.assertEqual([bucket.reserve(1, 10, now) for _ in range(4)], [0.0, 0.5, 1.0, 1.5])
+
+    def test_refuses_waits_beyond_max_wait_without_taking_tokens(self):
+        bucket = TokenBucket(rate=1.0, capacity=1)
+        now = bucket.updated
+        self.assertEqual(bucket.reserve(1, 0.5, now), 0.0)
+        self.assertEqual(bucket.reserve(1, 0.5, now), -1.0)
+        self.assertEqual(bucket.reserve(1, 0.5, now + 1), 0.0)
+
+
+@override_settings(AI_RATE_LIMIT_ENABLED=True)
+class RateLimiterTests(SimpleTestCase):
+    budgets = {'chat': {'per_minute': 60, 'burst': 2, 'max_wait': 1.5}}
+
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+        self.now = 1000.0
+        for name in ('monotonic', 'time'):
+            patcher = mock.patch(f'ai_chat.rate_limits.time.{name}', side_effect=lambda: self.now)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('ai_chat.rate_limits.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_waits_then_rejects(self):
+        limiter = RateLimiter(self.budgets, cache_alias='')
+        self.assertEqual(limiter.acquire('key', 'chat'), 0.0)
+        self.assertEqual(limiter.acquire('key', 'chat'), 0.0)
+        self.assertEqual(limiter.acquire('key', 'chat'), 1.0)
+        self.sleep.assert_called_once_with(1.0)
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire('key', 'chat')
+        self.assertEqual(raised.exception.retry_after, 2.0)
+        self.assertEqual(metrics.get('rate_limit.chat.granted'), 3)
+        self.assertEqual(metrics.get('rate_limit.chat.rejected'), 1)
+
+    def test_budgets_are_per_key(self):
+        limiter = RateLimiter(self.budgets, cache_alias='')
+        for _ in range(2):
+            limiter.acquire('key', 'chat')
+        self.assertEqual(limiter.acquire('other key', 'chat'), 0.0)
+
+    def test_shared_fixed_window(self):
+        limiter = RateLimiter(self.budgets, cache_alias='default')
+        self.assertEqual(limiter.acquire('key', 'chat'), 0.0)
+        self.assertEqual(limiter.acquire('key', 'chat'), 0.0)
+        # The window of `burst` requests every 2s is used up; the next one starts at 1002
+        with self.assertRaises(RateLimited) as raised:
+            limiter.acquire('key', 'chat')
+        self.assertEqual(raised.exception.retry_after, 2.0)
+        self.assertEqual(limiter.acquire('key', 'chat', timeout=3), 2.0)
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_shared_fails_open_when_the_cache_is_down(self):
+        limiter = RateLimiter(self.budgets, cache_alias='default')
+        broken = mock.Mock()
+        broken.add.side_effect = ConnectionError("cache unreachable")
+        with mock.patch('ai_chat.rate_limits.caches', {'default': broken}), \
+                self.assertLogs('ai_chat.rate_limits', 'WARNING'):
+            waits = [limiter.acquire('key', 'chat') for _ in range(5)]
+        self.assertEqual(waits, [0.0] * 5)
+        self.sleep.assert_not_called()
+
+
+class ClassifyErrorTests(SimpleTestCase):
+    @staticmethod
+    def api_error(code=None, message=""):
+        error = Exception(message)
+        error.code = code
+        return error
+
+    def test_uses_the_status_code(self):
+        for code, failure in [(404, NOT_FOUND), (429, RATE_LIMITED), (401, AUTH), (403, AUTH),
+                              (503, UNAVAILABLE), (500, UNAVAILABLE), (400, ERROR)]:
+            self.assertEqual(classify_error(self.api_error(code)), failure, code)
+
+    def test_falls_back_to_the_message(self):
+        self.assertEqual(classify_error(Exception("models/gemini-x is not found for API version v1")), NOT_FOUND)
+        self.assertEqual(classify_error(Exception("RESOURCE_EXHAUSTED: quota exceeded")), RATE_LIMITED)
+        self.assertEqual(classify_error(Exception("API key not valid. Please pass a valid API key.")), AUTH)
+        self.assertEqual(classify_error(Exception("The model is overloaded")), UNAVAILABLE)
+        self.assertEqual(classify_error(ValueError("bad image")), ERROR)
+
+
+class ModelHealthTrackerTests(SimpleTestCase):
+    models = ['primary', 'fallback']
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('ai_chat.model_health.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tracker = ModelHealthTracker('test', failure_threshold=3, cooldown=30.0)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.tracker.record_failure('primary', UNAVAILABLE)
+        self.assertEqual(self.tracker.order(self.models), ['fallback', 'primary'])
+        self.tracker.record_failure('primary', UNAVAILABLE)
+        self.assertEqual(self.tracker.order(self.models), ['fallback'])
+        self.assertEqual(self.tracker.stats()['primary']['state'], 'open')
+
+    def test_success_resets_the_failure_count(self):
+        for _ in range(2):
+            self.tracker.record_failure('primary', ERROR)
+        self.tracker.record_success('primary', 1.0)
+        for _ in range(2):
+            self.tracker.record_failure('primary', ERROR)
+        self.assertIn('primary', self.tracker.order(self.models))
+
+    def test_half_open_probe(self):
+        for _ in range(3):
+            self.tracker.record_failure('primary', UNAVAILABLE)
+        self.now += 31
+        # One caller probes the model, after the healthy ones; the others keep skipping it
+        self.assertEqual(self.tracker.order(self.models), ['fallback', 'primary'])
+        self.assertEqual(self.tracker.order(self.models), ['fallback'])
+        self.tracker.record_success('primary', 1.0)
+        self.assertEqual(self.tracker.stats()['primary']['state'], 'closed')
+        self.assertIn('primary', self.tracker.order(self.models))
+
+    def test_failed_probe_doubles_the_cooldown(self):
+        for _ in range(3):
+            self.tracker.record_failure('primary', UNAVAILABLE)
+        self.now += 31
+        self.tracker.order(self.models)
+        self.tracker.record_failure('primary', UNAVAILABLE)
+        self.assertEqual(self.tracker.stats()['primary']['reopens_in_s'], 60.0)
+        self.now += 59
+        self.assertEqual(self.tracker.order(self.models), ['fallback'])
+
+    def test_key_scoped_failures_only_open_the_circuit_for_that_key(self):
+        for failure in (RATE_LIMITED, NOT_FOUND, AUTH):
+            tracker = ModelHealthTracker('test', failure_threshold=3, cooldown=30.0)
+            tracker.record_failure('primary', failure, api_key='key-a')
+            self.assertEqual(tracker.order(self.models, api_key='key-a'), ['fallback'], failure)
+            self.assertEqual(tracker.order(self.models, api_key='key-b'), self.models, failure)
+            self.assertEqual(tracker.stats()['primary']['calls'], 0)
+
+    def test_orders_closed_circuits_by_success_rate(self):
+        self.tracker.record_success('primary', 1.0)
+        self.tracker.record_failure('primary', ERROR)
+        self.tracker.record_failure('primary', ERROR)
+        self.tracker.record_success('fallback', 1.0)
+        self.assertEqual(self.tracker.order(self.models), ['fallback', 'primary'])
+
+    def test_all_open_returns_the_one_reopening_first(self):
+        self.tracker.record_failure('primary', NOT_FOUND)
+        for _ in range(3):
+            self.tracker.record_failure('fallback', UNAVAILABLE)
+        self.assertEqual(self.tracker.order(self.models), ['fallback'])
+
+
+class LexicalIndexTests(SimpleTestCase):
+    def setUp(self):
+        # patient_id -> (hospital_id, document)
+        self.documents = {
+            1: (1, "Type 2 diabetes, HbA1c 8.2, on metformin 500mg"),
+            2: (1, "Asthma, salbutamol inhaler"),
+            3: (1, "Hypertension and diabetes, amlodipine"),
+            4: (2, "Metformin for diabetes"),
+        }
+        self.index = LexicalIndex(loader=self.load, fingerprint=None)
+
+    def load(self, hospital_id=None, patient_ids=None):
+        for patient_id, (patient_hospital, document) in self.documents.items():
+            if hospital_id is not None and patient_hospital != hospital_id:
+                continue
+            if patient_ids is not None and patient_id not in patient_ids:
+                continue
+            yield patient_id, patient_hospital, document
+
+    def ids(self, hospital_id, query, **kwargs):
+        return [patient_id for patient_id, _ in self.index.search(hospital_id, query, **kwargs)]
+
+    def test_tokenize_keeps_codes_and_drops_stop_words(self):
+        self.assertEqual(tokenize("Patients with HbA1c above 7, E11.9 and COVID-19"),
+                         ['hba1c', 'above', '7', 'e11.9', 'covid-19'])
+
+    def test_rare_terms_weigh_more(self):
+        # Both mention diabetes; only patient 1 mentions metformin, which is rarer in the hospital
+        self.assertEqual(self.ids(1, "metformin diabetes", limit=5), [1, 3])
+        self.assertEqual(self.ids(1, "hba1c"), [1])
+        self.assertEqual(self.ids(1, "unrelated words"), [])
+
+    def test_segments_are_per_hospital(self):
+        self.assertEqual(self.ids(2, "metformin"), [4])
+        self.assertEqual(self.index.size(1), 3)
+
+    def test_allowed_restricts_the_candidates(self):
+        self.assertEqual(self.ids(1, "diabetes", allowed=[3]), [3])
+
+    def test_dirty_patients_are_reread_before_the_next_search(self):
+        self.assertEqual(self.ids(1, "salbutamol"), [2])
+        self.documents[2] = (2, "Asthma, montelukast")
+        self.index.mark_dirty(2)
+        self.assertEqual(self.ids(1, "salbutamol"), [])
+        self.assertEqual(self.ids(2, "montelukast"), [2])
+        del self.documents[3]
+        self.index.mark_dirty(3)
+        self.assertEqual(self.ids(1, "amlodipine"), [])
+
+    def test_changes_leave_earlier_snapshots_untouched(self):
+        snapshot = self.index._segment_for(1)
+        self.index.upsert(1, 2, "Asthma, metformin trial")
+        self.index.remove(1)
+        self.assertEqual(self.ids(1, "metformin"), [2])
+        self.assertEqual(list(snapshot.score(['metformin'])), [1])
+        self.assertEqual(len(snapshot), 3)
+
+
+class LexicalSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(name="City Hospital", address="Main Road", contact_number="100")
+        cls.patient = Patient.objects.create(
+            hospital=cls.hospital, first_name="Meera", last_name="Iyer", date_of_birth=datetime.date(1970, 1, 1),
+            gender='F', contact_number="102", address="Somewhere", medical_history="Hypertension",
+        )
+        Patient.objects.create(
+            hospital=cls.hospital, first_name="Ravi", last_name="Kumar", date_of_birth=datetime.date(1985, 1, 1),
+            gender='M', contact_number="103", address="Elsewhere", medical_history="Asthma",
+        )
+        LabReport.objects.create(patient=cls.patient, title="Thyroid panel", extracted_text="TSH 6.8 mIU/L, raised")
+
+    def setUp(self):
+        lexical_index.invalidate()
+        self.addCleanup(lexical_index.invalidate)
+
+    def test_finds_text_deep_in_lab_reports(self):
+        results = semantic_search_patients("TSH", self.hospital.id, mode='lexical', reranker=NoReranker())
+        self.assertEqual([result['patient'] for result in results], [self.patient])
+        self.assertIsNone(results[0]['vector_score'])
+        self.assertGreater(results[0]['lexical_score'], 0)
+        # Ranked first by the only list, so the fused score is 1.0
+        self.assertAlmostEqual(results[0]['score'], 1.0)
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_sums_reciprocal_ranks(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+        self.assertAlmostEqual(fused[1], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(fused[2], 1 / 62)
+        self.assertAlmostEqual(fused[3], 1 / 63 + 1 / 61)
+        self.assertEqual(sorted(fused, key=fused.get, reverse=True), [1, 3, 2])
+
+    def test_agreement_beats_a_single_first_place(self):
+        fused = reciprocal_rank_fusion([[1, 2], [3, 2]], k=60)
+        self.assertGreater(fused[2], fused[1])
+
+
+class PatientFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hospital = Hospital.objects.create(name="City Hospital", address="Main Road", contact_number="100")
+        other = Hospital.objects.create(name="Hill Clinic", address="Hill Road", contact_number="200")
+        today = datetime.date.today()
+
+        def patient(first_name, gender, age, hospital=cls.hospital, **fields):
+            return Patient.objects.create(
+                hospital=hospital, first_name=first_name, last_name="Test", gender=gender,
+                # Turns `age` today
+                date_of_birth=years_before(today, age), contact_number="102", address="Somewhere",
+                medical_history="Type 2 diabetes on metformin", **fields,
+            )
+
+        cls.elderly_woman = patient("Lata", 'F', 70, blood_group='O+')
+        cls.young_woman = patient("Nisha", 'F', 30, blood_group='A+')
+        cls.elderly_man = patient("Arun", 'M', 65, blood_group='O+')
+        patient("Gita", 'F', 75, hospital=other)
+        Room.objects.create(hospital=cls.hospital, room_number="101", current_patient=cls.elderly_man)
+
+    def allowed(self, **filters):
+        return allowed_patient_ids(self.hospital.id, filters).tolist()
+
+    def test_no_filters_means_no_mask(self):
+        self.assertIsNone(allowed_patient_ids(self.hospital.id, None))
+        self.assertIsNone(allowed_patient_ids(self.hospital.id, {'gender': '', 'min_age': None}))
+
+    def test_unknown_filters_are_rejected(self):
+        with self.assertRaises(ValueError):
+            allowed_patient_ids(self.hospital.id, {'ward': 'ICU'})
+
+    def test_filters_stay_within_the_hospital(self):
+        self.assertEqual(self.allowed(gender='F'), [self.elderly_woman.pk, self.young_woman.pk])
+        self.assertEqual(self.allowed(blood_group='O+', gender='M'), [self.elderly_man.pk])
+
+    def test_age_bounds_are_inclusive(self):
+        self.assertEqual(self.allowed(min_age=65), [self.elderly_woman.pk, self.elderly_man.pk])
+        self.assertEqual(self.allowed(max_age=30), [self.young_woman.pk])
+        self.assertEqual(self.allowed(min_age=66, max_age=70), [self.elderly_woman.pk])
+
+    def test_has_room(self):
+        self.assertEqual(self.allowed(has_room=True), [self.elderly_man.pk])
+        self.assertEqual(self.allowed(has_room=False), [self.elderly_woman.pk, self.young_woman.pk])
+
+    def test_years_before_leap_day(self):
+        self.assertEqual(years_before(datetime.date(2024, 2, 29), 1), datetime.date(2023, 2, 28))
+
+    def test_index_masks_rows_before_ranking(self):
+        vectors = {self.elderly_woman.pk: [1.0, 0.0], self.young_woman.pk: [0.0, 1.0], self.elderly_man.pk: [0.9, 0.1]}
+        index = EmbeddingIndex(loader=lambda hospital_id: (list(vectors), list(vectors.values()), None))
+        allowed = allowed_patient_ids(self.hospital.id, {'gender': 'M'})
+        # The best match overall is filtered out, yet the filtered search still fills its limit
+        results = index.search(1, [1.0, 0.0], limit=1, allowed=allowed)
+        self.assertEqual([row for row, _ in results], [self.elderly_man.pk])
+
+    def search(self, filters):
+        results = semantic_search_patients(
+            "metformin", self.hospital.id, limit=5, mode='lexical', filters=filters, reranker=NoReranker()
+        )
+        return [result['patient'] for result in results]
+
+    def test_search_applies_filters(self):
+        lexical_index.invalidate()
+        self.addCleanup(lexical_index.invalidate)
+        self.assertEqual(self.search({'gender': 'F', 'min_age': 60}), [self.elderly_woman])
+        self.assertEqual(self.search({'gender': 'F', 'min_age': 90}), [])
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'embeddings': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'query-embedding-tests',
+        'TIMEOUT': 60,
+        # Culls the least recently used third of the entries once full
+        'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 3},
+    },
+})
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        metrics.reset()
+        caches['embeddings'].clear()
+        self.provider = HashingEmbeddingProvider(dimension=32)
+        self.embedded = []
+        self.now = 1000.0
+        patcher = mock.patch('time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def embed(self, query):
+        self.embedded.append(query)
+        return self.provider.embed_query(query)
+
+    def get(self, query, model='local-hashing-32'):
+        return get_query_embedding(query, model, self.embed)
+
+    def test_repeated_queries_hit_the_cache(self):
+        first = self.get("Patients with diabetes?")
+        second = self.get("  patients WITH diabetes ")
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(self.embedded, ["Patients with diabetes?"])
+        self.assertEqual(metrics.get('query_embedding_cache.hits'), 1)
+        self.assertEqual(metrics.get('query_embedding_cache.misses'), 1)
+
+    def test_entries_are_per_model(self):
+        self.get("asthma")
+        self.get("asthma", model='text-embedding-004')
+        self.assertEqual(len(self.embedded), 2)
+
+    def test_entries_expire_after_the_ttl(self):
+        self.get("asthma")
+        self.now += 59
+        self.get("asthma")
+        self.now += 2
+        self.get("asthma")
+        self.assertEqual(self.embedded, ["asthma", "asthma"])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for query in ("asthma", "diabetes", "migraine"):
+            self.get(query)
+        self.get("asthma")
+        self.get("anaemia")
+        self.embedded.clear()
+        self.get("asthma")
+        self.get("diabetes")
+        self.assertEqual(self.embedded, ["diabetes"])
+
+    def test_failed_embeddings_are_not_cached(self):
+        self.assertIsNone(get_query_embedding("asthma", 'local-hashing-32', lambda query: None))
+        self.get("asthma")
+        self.assertEqual(self.embedded, ["asthma"])
+
+    def test_cache_outage_falls_back_to_embedding(self):
+        broken = mock.Mock()
+        broken.get.side_effect = ConnectionError("cache unreachable")
+        broken.set.side_effect = ConnectionError("cache unreachable")
+        with mock.patch('ai_chat.query_cache.caches', {'embeddings': broken}), \
+                self.assertLogs('ai_chat.query_cache', 'WARNING'):
+            vector = self.get("asthma")
+        self.assertEqual(vector.shape, (32,))
+
+
+class EmbeddingJsonMigrationTests(TransactionTestCase):
+    """patients.0011 moves Patient.embedding_json into PatientEmbedding rows, and back when reversed."""
+
+    before = [('patients', '0010_prescription_ocr_error_prescription_ocr_status')]
+    after = [('patients', '0011_patientembedding')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def setUp(self):
+        self.addCleanup(lambda: self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes()))
+        apps = self.migrate(self.before)
+        Patient = apps.get_model('patients', 'Patient')
+
+        def patient(first_name, embedding_json):
+            return Patient.objects.create(
+                first_name=first_name, last_name="Test", date_of_birth=datetime.date(1980, 1, 1), gender='F',
+                contact_number="102", address="Somewhere", embedding_json=embedding_json,
+            ).pk
+
+        self.embedded = patient("Lata", "[0.5, -1.25, 2.0]")
+        self.corrupt = patient("Nisha", "not json")
+        self.empty = patient("Gita", "[]")
+        self.missing = patient("Asha", None)
+
+    def test_forwards_then_backwards(self):
+        apps = self.migrate(self.after)
+        PatientEmbedding = apps.get_model('patients', 'PatientEmbedding')
+        rows = list(PatientEmbedding.objects.values_list('patient_id', 'model_name', 'dimension', 'vector'))
+        self.assertEqual(len(rows), 1)
+        patient_id, model_name, dimension, vector = rows[0]
+        self.assertEqual((patient_id, model_name, dimension), (self.embedded, 'text-embedding-004', 3))
+        np.testing.assert_array_equal(np.frombuffer(bytes(vector), dtype='<f4'), [0.5, -1.25, 2.0])
+
+        apps = self.migrate(self.before)
+        Patient = apps.get_model('patients', 'Patient')
+        restored = dict(Patient.objects.values_list('pk', 'embedding_json'))
+        self.assertEqual(json.loads(restored[self.embedded]), [0.5, -1.25, 2.0])
+        # Vectors that could not be converted are re-embedded rather than restored
+        self.assertIsNone(restored[self.corrupt])
+        self.assertIsNone(restored[self.empty])
+        self.assertIsNone(restored[self.missing])
+
+
+class ActiveModelTests(TestCase):
+    def failing_read(self):
+        return mock.patch.object(EmbeddingModelVersion.objects, 'filter', side_effect=DatabaseError("no such table"))
+
+    def test_missing_table_falls_back_to_settings(self):
+        model = ActiveModel()
+        with self.failing_read(), mock.patch.object(connection.introspection, 'table_names', return_value=[]):
+            with transaction.atomic():
+                provider = model._resolve()
+                # The caller's transaction is still usable
+                self.assertEqual(EmbeddingModelVersion.objects.count(), 0)
+        self.assertIs(provider, model.get(*configured_provider_spec()))
+
+    def test_other_database_errors_propagate(self):
+        with self.failing_read(), self.assertRaises(DatabaseError):
+            ActiveModel()._resolve()
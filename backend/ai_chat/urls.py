@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ChatView, ChatSessionViewSet
+from .views import ChatView, ChatSessionViewSet, AIMetricsView
 
 router = DefaultRouter()
 router.register(r'sessions', ChatSessionViewSet, basename='chat-sessions')
 
 urlpatterns = [
     path('chat/', ChatView.as_view(), name='chat'),
+    path('metrics/', AIMetricsView.as_view(), name='ai-metrics'),
     path('', include(router.urls)),
 ]
@@ -1,3 +1,4 @@
+import math
 import os
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -6,6 +7,7 @@ from .models import ChatSession, ChatMessage
 from .serializers import ChatMessageSerializer, ChatSessionSerializer, ChatSessionListSerializer
 from langchain_core.messages import HumanMessage, AIMessage
 from .agent import agent_graph
+from .rate_limits import RateLimited
 import json
 
 class ChatSessionViewSet(viewsets.ModelViewSet):
@@ -67,7 +69,13 @@ class ChatView(APIView):
                     "hospital_id": int(hospital_id) if hospital_id else 0
                 }
                 
-                result = agent_graph.invoke(inputs)
+                # Tools check the user's hospital access (e.g. for network-wide search)
+                from users.context import current_user_var
+                user_token = current_user_var.set(request.user)
+                try:
+                    result = agent_graph.invoke(inputs)
+                finally:
+                    current_user_var.reset(user_token)
                 
                 # Retrieve the terminal agent message content
                 ai_response_text = result["messages"][-1].content
@@ -76,6 +84,11 @@ class ChatView(APIView):
                 if not ai_response_text.strip():
                     ai_response_text = "I'm sorry, I received an empty response from the AI model. This usually happens when the API key rate limits are exceeded or the service is temporarily overloaded. Please wait a moment and try again."
                 
+            except RateLimited as e:
+                ai_response_text = (
+                    "The AI assistant is receiving too many requests for this API key right now. "
+                    f"Please try again in about {math.ceil(e.retry_after)} seconds."
+                )
             except Exception as e:
                 error_msg = f"AI Graph Error: {str(e)}"
                 print(error_msg)
@@ -107,3 +120,28 @@ class ChatView(APIView):
         messages = ChatMessage.objects.filter(session=session)
         serializer = ChatMessageSerializer(messages, many=True)
         return Response(serializer.data)
+
+class AIMetricsView(APIView):
+    """Per-process counters for the AI pipeline, for operators to watch cache and API usage."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        from patients.ocr import hedge_stats
+        from jobs.queue import stats as job_stats
+        from . import metrics
+        from .genai_clients import client_stats
+        from .model_health import ocr_model_health
+        from .rate_limits import rate_limiter
+        from .query_cache import cache_stats
+        from .rag_utils import embedding_savings
+
+        return Response({
+            'query_embedding_cache': cache_stats(),
+            'document_embeddings': embedding_savings(),
+            'api_clients': client_stats(),
+            'rate_limits': rate_limiter.stats(),
+            'ocr_models': ocr_model_health.stats(),
+            'ocr_hedging': hedge_stats(),
+            'jobs': job_stats(),
+            'counters': metrics.snapshot(),
+        })
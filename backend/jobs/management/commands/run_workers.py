@@ -0,0 +1,54 @@
+import json
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs import queue
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the background job workers: prescription OCR, lab report text extraction and "
+        "patient re-embedding. Any number of these processes can run side by side. On SIGTERM "
+        "or Ctrl+C running jobs get JOB_DRAIN_TIMEOUT seconds to finish before they are handed "
+        "back to the queue. Set JOB_WORKERS_IN_PROCESS=False so web processes leave the jobs to them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', nargs='+', help="Job types to run (default: all)")
+        parser.add_argument(
+            '--concurrency', nargs='+', default=[], metavar='TYPE=N',
+            help="Threads per job type, overriding its default, e.g. prescription_ocr=4",
+        )
+        parser.add_argument('--poll', type=float, help="Seconds between checks for due jobs when idle")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due instead of waiting for more")
+        parser.add_argument('--stats', action='store_true', help="Print queue depth per job type and exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue.stats(), indent=2))
+            return
+
+        types = options['types'] or list(queue.job_types)
+        unknown = set(types) - set(queue.job_types)
+        if unknown:
+            raise CommandError(f"Unknown job types: {', '.join(sorted(unknown))}. Known: {', '.join(queue.job_types)}")
+        concurrency = {}
+        for item in options['concurrency']:
+            name, _, count = item.partition('=')
+            if name not in queue.job_types or not count.isdigit():
+                raise CommandError(f"Invalid --concurrency {item!r}; expected TYPE=N")
+            concurrency[name] = int(count)
+
+        worker = Worker(types=types, concurrency=concurrency, poll_interval=options['poll'])
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: worker.request_stop())
+
+        recovered = queue.recover_expired()
+        if recovered:
+            self.stdout.write(f"Recovered {recovered} jobs whose worker stopped without finishing them.")
+        threads = {name: concurrency.get(name, queue.job_types[name].concurrency) for name in types}
+        self.stdout.write(f"Worker {worker.name} running {json.dumps(threads)}")
+        worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker.name} stopped."))
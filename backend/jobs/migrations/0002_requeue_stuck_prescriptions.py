@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def requeue_stuck_prescriptions(apps, schema_editor):
+    """
+    Prescriptions left 'pending' or 'processing' by the in-memory OCR threads that preceded
+    the job queue would never finish; queue them so a worker picks them up (with the server key).
+    """
+    Prescription = apps.get_model('patients', 'Prescription')
+    Job = apps.get_model('jobs', 'Job')
+    stuck = Prescription.objects.filter(ocr_status__in=['pending', 'processing']).exclude(image='').values_list('pk', flat=True)
+    Job.objects.bulk_create([
+        Job(job_type='prescription_ocr', payload={'prescription_id': pk}, key=f"prescription:{pk}", priority=10, max_attempts=3)
+        for pk in stuck
+    ], ignore_conflicts=True)
+    Prescription.objects.filter(pk__in=list(stuck), ocr_status='processing').update(ocr_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+        ('patients', '0013_patientchunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(requeue_stuck_prescriptions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,268 @@
+import logging
+import random
+import threading
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Min
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from ai_chat import metrics
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, FAILED = 'queued', 'running', 'failed'
+
+
+class QueueFull(Exception):
+    """The job type already has max_queued jobs waiting or running."""
+
+    def __init__(self, job_type: str):
+        self.job_type = job_type
+        super().__init__(f"The {job_type} queue is full; try again later.")
+
+
+class JobType:
+    """
+    How jobs of one type are run. `handler(job)` gets one Job, or a list of up to
+    `batch_size` Jobs sharing an API key when batch_size is set. A handler that raises is
+    retried after retry_delay * 2^(attempt - 1) seconds (or the exception's retry_after,
+    if longer) until max_attempts; on_failure(job, error) is then called once.
+    """
+
+    def __init__(self, name, handler, concurrency=1, batch_size=None, max_attempts=5, timeout=600.0,
+                 retry_delay=30.0, max_retry_delay=3600.0, priority=0, max_queued=None, on_failure=None):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Lease length: a job still running after this is presumed lost and handed out again
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.priority = priority
+        self.max_queued = max_queued
+        self.on_failure = on_failure
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.retry_delay * 2 ** max(attempts - 1, 0), self.max_retry_delay)
+        # Jitter, so jobs that failed together do not all retry in the same second
+        return delay * random.uniform(0.8, 1.2)
+
+
+job_types: dict[str, JobType] = {}
+
+# Wakes idle in-process workers when a job is enqueued, instead of waiting for their next poll
+job_enqueued = threading.Event()
+
+
+def register(name: str, handler, **options) -> JobType:
+    job_types[name] = JobType(name, handler, **options)
+    return job_types[name]
+
+
+def _api_key_owner(api_key_owner):
+    if api_key_owner is not None:
+        return api_key_owner
+    from users.context import gemini_api_key_owner_var
+    return gemini_api_key_owner_var.get()
+
+
+def _debounced_run_at(run_at, max_delay):
+    if max_delay is None:
+        return run_at
+    latest = ExpressionWrapper(F('created_at') + timedelta(seconds=max_delay), output_field=DateTimeField())
+    return Least(run_at, latest)
+
+
+def _check_capacity(job_type: JobType, adding: int = 1) -> None:
+    if job_type.max_queued is None:
+        return
+    waiting = Job.objects.filter(job_type=job_type.name, status__in=[QUEUED, RUNNING]).count()
+    if waiting + adding > job_type.max_queued:
+        metrics.incr(f"jobs.{job_type.name}.rejected", adding)
+        raise QueueFull(job_type.name)
+
+
+def enqueue(name: str, payload: dict | None = None, key: str | None = None, delay: float = 0.0,
+            max_delay: float | None = None, priority: int | None = None, api_key_owner=None,
+            restart: bool = False) -> None:
+    """
+    Queues a job, to run `delay` seconds from now. With a `key`, a job of the same type and
+    key that is still waiting is reused instead: it is pushed back to run `delay` seconds
+    from now, but never later than `max_delay` after it was first queued (debouncing).
+    A job waiting to be retried keeps its backoff unless `restart` asks to run it afresh.
+    The job runs with the Gemini API key of the request that queued it, looked up again
+    when it runs. Raises QueueFull when the type's max_queued jobs are already waiting.
+    """
+    job_type = job_types[name]
+    owner = _api_key_owner(api_key_owner)
+    run_at = timezone.now() + timedelta(seconds=delay)
+    if key is not None and _postpone(name, [key], run_at, max_delay, restart):
+        return
+    _check_capacity(job_type)
+    try:
+        with transaction.atomic():
+            Job.objects.create(
+                job_type=name, payload=payload or {}, key=key, run_at=run_at, api_key_owner_id=owner,
+                priority=job_type.priority if priority is None else priority, max_attempts=job_type.max_attempts,
+            )
+    except IntegrityError:
+        # Queued by someone else since the lookup above, or waiting on a retry
+        _postpone(name, [key], run_at, max_delay, restart)
+        return
+    metrics.incr(f"jobs.{name}.enqueued")
+    transaction.on_commit(job_enqueued.set)
+
+
+def enqueue_many(name: str, items: dict, delay: float = 0.0, max_delay: float | None = None,
+                 api_key_owner=None) -> None:
+    """enqueue() for many keyed jobs at once: `items` maps each key to its payload."""
+    job_type = job_types[name]
+    owner = _api_key_owner(api_key_owner)
+    run_at = timezone.now() + timedelta(seconds=delay)
+    keys = list(items)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        _postpone(name, chunk, run_at, max_delay)
+        waiting = set(Job.objects.filter(job_type=name, key__in=chunk, status=QUEUED).values_list('key', flat=True))
+        new = [key for key in chunk if key not in waiting]
+        if not new:
+            continue
+        _check_capacity(job_type, len(new))
+        Job.objects.bulk_create([
+            Job(job_type=name, payload=items[key], key=key, run_at=run_at, api_key_owner_id=owner,
+                priority=job_type.priority, max_attempts=job_type.max_attempts)
+            for key in new
+        ], ignore_conflicts=True)
+        metrics.incr(f"jobs.{name}.enqueued", len(new))
+    transaction.on_commit(job_enqueued.set)
+
+
+def _postpone(name: str, keys: list[str], run_at, max_delay, restart: bool = False) -> int:
+    waiting = Job.objects.filter(job_type=name, key__in=keys, status=QUEUED)
+    if restart:
+        return waiting.update(run_at=run_at, attempts=0, last_error=None, updated_at=timezone.now())
+    # Jobs waiting on a retry keep their backoff
+    return waiting.filter(attempts=0).update(run_at=_debounced_run_at(run_at, max_delay), updated_at=timezone.now())
+
+
+def claim(name: str, worker: str, limit: int = 1) -> list[Job]:
+    """
+    Leases up to `limit` due jobs of a type to `worker`, highest priority first. Uses
+    SELECT ... FOR UPDATE SKIP LOCKED where the database supports it, so concurrent workers
+    never wait on each other's rows. Elsewhere (SQLite) each row is taken with a
+    conditional UPDATE, and a row another worker took first is simply skipped.
+    """
+    job_type = job_types[name]
+    now = timezone.now()
+    due = Job.objects.filter(job_type=name, status=QUEUED, run_at__lte=now).order_by('-priority', 'run_at', 'pk')
+    lease = {
+        'status': RUNNING, 'locked_by': worker, 'locked_until': now + timedelta(seconds=job_type.timeout),
+        'attempts': F('attempts') + 1, 'updated_at': now,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            claimed = [job.pk for job in due.select_for_update(skip_locked=True).only('pk')[:limit]]
+            if claimed:
+                Job.objects.filter(pk__in=claimed).update(**lease)
+    else:
+        candidates = list(due.values_list('pk', flat=True)[:limit])
+        claimed = [pk for pk in candidates if Job.objects.filter(pk=pk, status=QUEUED).update(**lease)]
+    if not claimed:
+        return []
+    metrics.incr(f"jobs.{name}.claimed", len(claimed))
+    return list(Job.objects.filter(pk__in=claimed).order_by('-priority', 'run_at', 'pk'))
+
+
+def _leased(job: Job):
+    # Worker and attempt count identify this lease: a job whose lease expired and was
+    # claimed again is no longer this worker's to finish
+    return Job.objects.filter(pk=job.pk, status=RUNNING, attempts=job.attempts, locked_by=job.locked_by)
+
+
+def complete(jobs: list[Job]) -> None:
+    for job in jobs:
+        if not _leased(job).delete()[0]:
+            logger.warning(f"Job {job} finished after its lease expired; it was handed out again.")
+        metrics.incr(f"jobs.{job.job_type}.succeeded")
+
+
+def fail(job: Job, error: Exception) -> None:
+    """Schedules a retry with backoff, or marks the job failed once it is out of attempts."""
+    job_type = job_types.get(job.job_type)
+    now = timezone.now()
+    message = str(error)[:2000] or error.__class__.__name__
+    if job_type is not None and job.attempts < job.max_attempts:
+        delay = max(job_type.backoff(job.attempts), getattr(error, 'retry_after', None) or 0.0)
+        try:
+            with transaction.atomic():
+                retried = _leased(job).update(
+                    status=QUEUED, run_at=now + timedelta(seconds=delay), locked_by='', locked_until=None,
+                    last_error=message, updated_at=now,
+                )
+        except IntegrityError:
+            # A newer job with the same key is already waiting and covers this one
+            retried = _leased(job).delete()[0]
+        if retried:
+            logger.warning(f"Job {job} failed (attempt {job.attempts}/{job.max_attempts}), retrying in {delay:.0f}s: {message}")
+            metrics.incr(f"jobs.{job.job_type}.retried")
+        return
+    if not _leased(job).update(status=FAILED, locked_by='', locked_until=None, last_error=message, updated_at=now):
+        return
+    logger.error(f"Job {job} failed after {job.attempts} attempts: {message}")
+    metrics.incr(f"jobs.{job.job_type}.failed")
+    if job_type is not None and job_type.on_failure:
+        try:
+            job_type.on_failure(job, error)
+        except Exception as e:
+            logger.error(f"on_failure hook of {job} failed: {e}")
+
+
+def release(jobs: list[Job]) -> None:
+    """Hands leased jobs back at once, without counting the attempt (e.g. on worker shutdown)."""
+    now = timezone.now()
+    for job in jobs:
+        try:
+            with transaction.atomic():
+                _leased(job).update(
+                    status=QUEUED, attempts=F('attempts') - 1, run_at=now, locked_by='', locked_until=None, updated_at=now,
+                )
+        except IntegrityError:
+            _leased(job).delete()
+
+
+def recover_expired() -> int:
+    """Treats running jobs whose lease has expired (their worker died or hung) as failed attempts."""
+    expired = list(Job.objects.filter(status=RUNNING, locked_until__lt=timezone.now()))
+    for job in expired:
+        metrics.incr(f"jobs.{job.job_type}.expired")
+        fail(job, TimeoutError(f"Lease held by {job.locked_by or 'a worker'} expired before the job finished"))
+    return len(expired)
+
+
+def stats() -> dict:
+    """Queue depth per type and status from the database, plus how overdue the oldest due job is."""
+    now = timezone.now()
+    by_type = {name: {QUEUED: 0, RUNNING: 0, FAILED: 0} for name in job_types}
+    for row in Job.objects.values('job_type', 'status').annotate(count=Count('pk')):
+        by_type.setdefault(row['job_type'], {QUEUED: 0, RUNNING: 0, FAILED: 0})[row['status']] = row['count']
+    oldest = dict(
+        Job.objects.filter(status=QUEUED, run_at__lte=now).values('job_type')
+        .annotate(oldest=Min('run_at')).values_list('job_type', 'oldest')
+    )
+    return {
+        name: {
+            **counts,
+            'oldest_due_s': round((now - oldest[name]).total_seconds(), 1) if name in oldest else None,
+            'counters': {
+                event: metrics.get(f"jobs.{name}.{event}")
+                for event in ('enqueued', 'rejected', 'claimed', 'succeeded', 'retried', 'expired', 'failed')
+            },
+        }
+        for name, counts in by_type.items()
+    }
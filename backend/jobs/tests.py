@@ -0,0 +1,154 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import queue
+from .models import Job
+
+
+class QueueTestMixin:
+    """Registers throwaway job types for a test and removes them again afterwards."""
+
+    def register(self, name, handler=None, **options):
+        self.addCleanup(queue.job_types.pop, name, None)
+        return queue.register(name, handler or (lambda job: None), **options)
+
+
+class QueueTests(QueueTestMixin, TestCase):
+    def setUp(self):
+        self.failures = []
+        self.job_type = self.register(
+            'test_job', max_attempts=2, retry_delay=10.0, timeout=60.0,
+            on_failure=lambda job, error: self.failures.append((job.pk, str(error))),
+        )
+
+    def test_claim_leases_due_jobs_once(self):
+        queue.enqueue('test_job', {'n': 1})
+        queue.enqueue('test_job', {'n': 2})
+        queue.enqueue('test_job', {'n': 3}, delay=60)
+
+        first = queue.claim('test_job', 'worker-a', limit=5)
+        self.assertEqual(sorted(job.payload['n'] for job in first), [1, 2])
+        self.assertTrue(all(job.status == queue.RUNNING and job.attempts == 1 for job in first))
+        self.assertTrue(all(job.locked_by == 'worker-a' and job.locked_until > timezone.now() for job in first))
+        # Already leased, and the third is not due yet
+        self.assertEqual(queue.claim('test_job', 'worker-b', limit=5), [])
+
+    def test_claim_orders_by_priority(self):
+        queue.enqueue('test_job', {'n': 1})
+        queue.enqueue('test_job', {'n': 2}, priority=5)
+        self.assertEqual(queue.claim('test_job', 'worker')[0].payload['n'], 2)
+
+    def test_complete_deletes_job(self):
+        queue.enqueue('test_job')
+        queue.complete(queue.claim('test_job', 'worker'))
+        self.assertFalse(Job.objects.exists())
+
+    def test_expired_lease_is_recovered_as_failed_attempt(self):
+        queue.enqueue('test_job')
+        job = queue.claim('test_job', 'worker')[0]
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            self.assertEqual(queue.recover_expired(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, queue.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('expired', job.last_error)
+        # The original worker finishing late does not delete the retried job
+        stale = Job(pk=job.pk, job_type='test_job', attempts=1, locked_by='worker')
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.complete([stale])
+        self.assertTrue(Job.objects.filter(pk=job.pk).exists())
+
+    def test_fail_backs_off_then_fails_with_on_failure(self):
+        queue.enqueue('test_job')
+        job = queue.claim('test_job', 'worker')[0]
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.fail(job, RuntimeError("boom"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, queue.QUEUED)
+        self.assertGreaterEqual(job.run_at, timezone.now() + timedelta(seconds=7))
+        self.assertEqual(job.last_error, "boom")
+        self.assertEqual(self.failures, [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        job = queue.claim('test_job', 'worker')[0]
+        self.assertEqual(job.attempts, 2)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            queue.fail(job, RuntimeError("boom again"))
+        job.refresh_from_db()
+        self.assertEqual(job.status, queue.FAILED)
+        self.assertEqual(self.failures, [(job.pk, "boom again")])
+
+    def test_backoff_doubles_per_attempt(self):
+        self.assertTrue(8.0 <= self.job_type.backoff(1) <= 12.0)
+        self.assertTrue(32.0 <= self.job_type.backoff(3) <= 48.0)
+
+    def test_keyed_jobs_are_debounced_up_to_max_delay(self):
+        queue.enqueue('test_job', {'n': 1}, key='patient:1', delay=30, max_delay=120)
+        job = Job.objects.get()
+        queue.enqueue('test_job', {'n': 2}, key='patient:1', delay=60, max_delay=120)
+        pushed = Job.objects.get()
+        self.assertEqual(pushed.pk, job.pk)
+        self.assertGreater(pushed.run_at, job.run_at + timedelta(seconds=25))
+
+        queue.enqueue('test_job', key='patient:1', delay=600, max_delay=120)
+        capped = Job.objects.get()
+        self.assertLessEqual(capped.run_at, capped.created_at + timedelta(seconds=120))
+
+    def test_retry_keeps_backoff_unless_restarted(self):
+        queue.enqueue('test_job', key='patient:1')
+        with self.assertLogs('jobs.queue', 'WARNING'):
+            queue.fail(queue.claim('test_job', 'worker')[0], RuntimeError("boom"))
+        retrying = Job.objects.get()
+
+        queue.enqueue('test_job', key='patient:1')
+        self.assertEqual(Job.objects.get().run_at, retrying.run_at)
+
+        queue.enqueue('test_job', key='patient:1', restart=True)
+        restarted = Job.objects.get()
+        self.assertEqual(restarted.attempts, 0)
+        self.assertIsNone(restarted.last_error)
+        self.assertLessEqual(restarted.run_at, timezone.now())
+
+    def test_enqueue_many_reuses_waiting_jobs(self):
+        queue.enqueue('test_job', key='patient:1', delay=30)
+        queue.enqueue_many('test_job', {'patient:1': {}, 'patient:2': {}}, delay=30)
+        self.assertEqual(sorted(Job.objects.values_list('key', flat=True)), ['patient:1', 'patient:2'])
+
+    def test_queue_full(self):
+        self.register('bounded_job', max_queued=2)
+        queue.enqueue('bounded_job')
+        queue.enqueue('bounded_job')
+        with self.assertRaises(queue.QueueFull):
+            queue.enqueue('bounded_job')
+        # Running jobs still count against the limit
+        queue.claim('bounded_job', 'worker')
+        with self.assertRaises(queue.QueueFull):
+            queue.enqueue_many('bounded_job', {'a': {}})
+
+    def test_release_hands_jobs_back_without_counting_the_attempt(self):
+        queue.enqueue('test_job')
+        queue.release(queue.claim('test_job', 'worker'))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts, job.locked_by), (queue.QUEUED, 0, ''))
+
+
+class RunWorkersCommandTests(QueueTestMixin, TransactionTestCase):
+    def test_once_runs_due_jobs_and_exits(self):
+        handled = []
+        self.register('test_job', lambda job: handled.append(job.payload['n']))
+        self.register('test_batch', lambda jobs: handled.append(sorted(job.payload['n'] for job in jobs)), batch_size=10)
+        queue.enqueue('test_job', {'n': 1})
+        queue.enqueue_many('test_batch', {'a': {'n': 2}, 'b': {'n': 3}})
+        queue.enqueue('test_job', {'n': 4}, delay=3600)
+
+        out = StringIO()
+        call_command('run_workers', '--types', 'test_job', 'test_batch', '--once', '--poll', '0.1', stdout=out)
+        self.assertIn('stopped', out.getvalue())
+        self.assertCountEqual(handled, [1, [2, 3]])
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), [{'n': 4}])
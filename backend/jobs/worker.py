@@ -0,0 +1,192 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connection
+
+from . import queue
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Runs queued jobs: `concurrency` threads per job type (from its JobType unless
+    overridden), each claiming a job (or a batch) at a time and polling every
+    poll_interval seconds when idle. One housekeeping loop hands out jobs whose lease
+    expired again. stop() lets running jobs finish for up to drain_timeout seconds and
+    hands the rest back to the queue, so nothing is lost on a deploy.
+    """
+
+    def __init__(self, types=None, concurrency: dict | None = None, poll_interval: float | None = None,
+                 drain_timeout: float | None = None, name: str | None = None):
+        self.types = list(types or queue.job_types)
+        self.concurrency = concurrency or {}
+        self.poll_interval = poll_interval if poll_interval is not None else getattr(settings, 'JOB_POLL_INTERVAL', 2.0)
+        self.drain_timeout = drain_timeout if drain_timeout is not None else getattr(settings, 'JOB_DRAIN_TIMEOUT', 30.0)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        # thread name -> jobs it is running
+        self._running: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        for name in self.types:
+            job_type = queue.job_types[name]
+            for slot in range(self.concurrency.get(name, job_type.concurrency)):
+                thread = threading.Thread(target=self._run, args=(job_type,), name=f"job-{name}-{slot + 1}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        housekeeping = threading.Thread(target=self._housekeep, name='job-housekeeping', daemon=True)
+        housekeeping.start()
+        self._threads.append(housekeeping)
+
+    def run(self, once: bool = False) -> None:
+        """Runs until stop() is called, or with once=True until no job is due."""
+        self.start()
+        try:
+            while not self._stopping.wait(timeout=1.0):
+                if once and not self.in_flight() and not self._due():
+                    break
+        finally:
+            self.stop()
+
+    def _due(self) -> bool:
+        from django.utils import timezone
+        from .models import Job
+
+        try:
+            return Job.objects.filter(job_type__in=self.types, status=queue.QUEUED, run_at__lte=timezone.now()).exists()
+        finally:
+            connection.close()
+
+    def request_stop(self) -> None:
+        """Asks run() to return; safe to call from a signal handler."""
+        self._stopping.set()
+        queue.job_enqueued.set()
+
+    def stop(self, timeout: float | None = None) -> None:
+        timeout = self.drain_timeout if timeout is None else timeout
+        self.request_stop()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(deadline - time.monotonic(), 0.0))
+        with self._lock:
+            unfinished = [job for jobs in self._running.values() for job in jobs]
+        if unfinished:
+            logger.warning(f"Worker {self.name} stopped with {len(unfinished)} jobs still running; handing them back.")
+            queue.release(unfinished)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(jobs) for jobs in self._running.values())
+
+    def _housekeep(self):
+        while True:
+            try:
+                queue.recover_expired()
+            except Exception as e:
+                logger.error(f"Job housekeeping error: {e}")
+            finally:
+                connection.close()
+            if self._stopping.wait(timeout=max(self.poll_interval * 10, 10.0)):
+                return
+
+    def _run(self, job_type: queue.JobType):
+        thread = threading.current_thread().name
+        while not self._stopping.is_set():
+            try:
+                jobs = queue.claim(job_type.name, self.name, job_type.batch_size or 1)
+            except Exception as e:
+                # e.g. SQLite reporting "database is locked" under concurrent writers
+                logger.warning(f"Could not claim {job_type.name} jobs: {e}")
+                jobs = []
+            if not jobs:
+                queue.job_enqueued.wait(timeout=self.poll_interval)
+                queue.job_enqueued.clear()
+                continue
+            with self._lock:
+                self._running[thread] = jobs
+            try:
+                self._process(job_type, jobs)
+            except Exception as e:
+                logger.error(f"Job worker error while running {job_type.name} jobs: {e}")
+            finally:
+                with self._lock:
+                    self._running.pop(thread, None)
+                connection.close()
+
+    def _process(self, job_type: queue.JobType, jobs: list) -> None:
+        from users.context import gemini_api_key_for, gemini_api_key_owner_var, gemini_api_key_var
+
+        # Each job runs with the API key of whoever queued it, so batches are split by key owner
+        by_owner = groupby(sorted(jobs, key=lambda job: job.api_key_owner_id or 0), key=lambda job: job.api_key_owner_id)
+        for owner, group in by_owner:
+            group = list(group)
+            key_token = gemini_api_key_var.set(gemini_api_key_for(owner))
+            owner_token = gemini_api_key_owner_var.set(owner)
+            try:
+                if job_type.batch_size:
+                    self._call(job_type, group, group)
+                else:
+                    for job in group:
+                        self._call(job_type, job, [job])
+            finally:
+                gemini_api_key_owner_var.reset(owner_token)
+                gemini_api_key_var.reset(key_token)
+
+    @staticmethod
+    def _call(job_type: queue.JobType, argument, jobs: list) -> None:
+        try:
+            job_type.handler(argument)
+        except Exception as e:
+            for job in jobs:
+                queue.fail(job, e)
+        else:
+            queue.complete(jobs)
+
+
+_in_process_worker = None
+# Process that started _in_process_worker; a forked child inherits the object but not its threads
+_in_process_pid = None
+_in_process_lock = threading.Lock()
+
+
+def start_in_process_workers(**kwargs) -> Worker | None:
+    """
+    Runs the job workers inside this server process (JOB_WORKERS_IN_PROCESS), for
+    development and single-process deployments without a separate `run_workers` process.
+
+    Connected to request_started by the WSGI/ASGI entry points rather than called at
+    import, so each process forked from a preloaded app (e.g. gunicorn --preload) starts
+    its own threads on its first request instead of inheriting the parent's dead ones.
+    """
+    global _in_process_worker, _in_process_pid
+    if not getattr(settings, 'JOB_WORKERS_IN_PROCESS', True):
+        return None
+    pid = os.getpid()
+    if _in_process_pid == pid:
+        return _in_process_worker
+    with _in_process_lock:
+        if _in_process_pid != pid:
+            worker = Worker(name=f"{socket.gethostname()}:{pid}:web")
+            worker.start()
+            atexit.register(_stop_in_process_worker, worker, pid)
+            _in_process_worker, _in_process_pid = worker, pid
+    return _in_process_worker
+
+
+def _stop_in_process_worker(worker: Worker, pid: int) -> None:
+    # atexit handlers survive fork; only the process that started the worker may release its jobs
+    if os.getpid() == pid:
+        worker.stop()
+
+
+def in_process_worker() -> Worker | None:
+    return _in_process_worker if _in_process_pid == os.getpid() else None
@@ -0,0 +1,39 @@
+from django.conf import settings
+
+from jobs.queue import register
+
+from .models import OCR_ALL_MODELS_FAILED, Prescription, extract_lab_report_text, run_prescription_ocr
+
+QUEUE_FULL_ERROR = "The OCR queue is full. Please retry OCR in a minute."
+
+
+def prescription_ocr(job):
+    success, error = run_prescription_ocr(job.payload['prescription_id'])
+    if success or not error.startswith(OCR_ALL_MODELS_FAILED):
+        # Done, or failed in a way a retry would not fix (no key, unreadable answer)
+        return
+    if job.attempts < job.max_attempts:
+        # Keeps the upload out of the failed state while its retry is pending
+        Prescription.objects.filter(pk=job.payload['prescription_id']).update(
+            ocr_status='pending', ocr_error=f"{error[:400]} Retrying automatically."
+        )
+    raise RuntimeError(error)
+
+
+def prescription_ocr_failed(job, error):
+    # Only reached without run_prescription_ocr recording the outcome, e.g. its worker died every time
+    Prescription.objects.filter(
+        pk=job.payload['prescription_id'], ocr_status__in=['pending', 'processing']
+    ).update(ocr_status='failed', ocr_error=f"OCR did not complete: {error}"[:500])
+
+
+def lab_report_text(job):
+    extract_lab_report_text(job.payload['lab_report_id'])
+
+
+register(
+    'prescription_ocr', prescription_ocr, on_failure=prescription_ocr_failed,
+    concurrency=getattr(settings, 'AI_OCR_WORKERS', 2), max_queued=getattr(settings, 'AI_OCR_QUEUE_SIZE', 100),
+    priority=10, max_attempts=3, retry_delay=60.0, timeout=600.0,
+)
+register('lab_report_text', lab_report_text, priority=5, max_attempts=3, timeout=300.0)
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.10 on 2026-10-18 06:57
+
+import json
+
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+# Model that produced every vector stored in Patient.embedding_json
+LEGACY_EMBEDDING_MODEL = 'text-embedding-004'
+
+
+def convert_embedding_json(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientEmbedding = apps.get_model('patients', 'PatientEmbedding')
+
+    batch = []
+    rows = Patient.objects.exclude(embedding_json__isnull=True).exclude(embedding_json='').values_list('id', 'embedding_json')
+    for patient_id, raw in rows.iterator(chunk_size=500):
+        try:
+            vector = np.asarray(json.loads(raw), dtype='<f4')
+        except (TypeError, ValueError):
+            continue  # Corrupt rows are simply re-embedded on the next search
+        if vector.ndim != 1 or not vector.size:
+            continue
+        batch.append(PatientEmbedding(
+            patient_id=patient_id,
+            model_name=LEGACY_EMBEDDING_MODEL,
+            dimension=vector.size,
+            vector=vector.tobytes(),
+        ))
+        if len(batch) >= 500:
+            PatientEmbedding.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PatientEmbedding.objects.bulk_create(batch)
+
+
+def restore_embedding_json(apps, schema_editor):
+    Patient = apps.get_model('patients', 'Patient')
+    PatientEmbedding = apps.get_model('patients', 'PatientEmbedding')
+
+    rows = PatientEmbedding.objects.filter(model_name=LEGACY_EMBEDDING_MODEL).values_list('patient_id', 'vector')
+    for patient_id, raw in rows.iterator(chunk_size=500):
+        vector = np.frombuffer(raw, dtype='<f4')
+        Patient.objects.filter(pk=patient_id).update(embedding_json=json.dumps(vector.tolist()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0010_prescription_ocr_error_prescription_ocr_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=100)),
+                ('dimension', models.PositiveIntegerField()),
+                ('vector', models.BinaryField(help_text='Little-endian float32 bytes of the patient vector embedding')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embeddings', to='patients.patient')),
+            ],
+            options={
+                'unique_together': {('patient', 'model_name')},
+            },
+        ),
+        migrations.RunPython(convert_embedding_json, restore_embedding_json),
+        migrations.RemoveField(
+            model_name='patient',
+            name='embedding_json',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0011_patientembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientembedding',
+            name='checked_at',
+            field=models.DateTimeField(blank=True, help_text='Last time the patient text was compared against text_hash', null=True),
+        ),
+        migrations.AddField(
+            model_name='patientembedding',
+            name='text_hash',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the exact text that was embedded', max_length=64),
+        ),
+    ]
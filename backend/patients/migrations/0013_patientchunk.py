@@ -0,0 +1,33 @@
+# Generated by Django 5.2.10 on 2026-10-18 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0012_patientembedding_text_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(choices=[('profile', 'Profile'), ('soap_note', 'SOAP Note'), ('lab_report', 'Lab Report')], max_length=20)),
+                ('source_id', models.PositiveBigIntegerField(default=0, help_text='SOAPNote/LabReport ID, 0 for profile fields')),
+                ('position', models.PositiveIntegerField(help_text='Order of the chunk within its source')),
+                ('text', models.TextField()),
+                ('model_name', models.CharField(max_length=100)),
+                ('dimension', models.PositiveIntegerField()),
+                ('vector', models.BinaryField(help_text='Little-endian float32 bytes of the chunk embedding')),
+                ('text_hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='patients.patient')),
+            ],
+            options={
+                'unique_together': {('patient', 'model_name', 'source_type', 'source_id', 'position')},
+            },
+        ),
+    ]
@@ -36,7 +36,6 @@ class Patient(models.Model):
     address = models.TextField()
     symptoms = models.TextField(blank=True, null=True)
     medical_history = models.TextField(blank=True, null=True)
-    embedding_json = models.TextField(blank=True, null=True, help_text="Stores the JSON representation of the patient vector embedding")
     breakfast_time = models.CharField(max_length=20, default='08:30 AM')
     lunch_time = models.CharField(max_length=20, default='01:30 PM')
     dinner_time = models.CharField(max_length=20, default='08:30 PM')
@@ -46,6 +45,45 @@ class Patient(models.Model):
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+class PatientEmbedding(models.Model):
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='embeddings')
+    model_name = models.CharField(max_length=100)
+    dimension = models.PositiveIntegerField()
+    vector = models.BinaryField(help_text="Little-endian float32 bytes of the patient vector embedding")
+    text_hash = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of the exact text that was embedded")
+    checked_at = models.DateTimeField(blank=True, null=True, help_text="Last time the patient text was compared against text_hash")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('patient', 'model_name')
+
+    def __str__(self):
+        return f"{self.model_name} embedding for {self.patient}"
+
+class PatientChunk(models.Model):
+    SOURCE_CHOICES = [
+        ('profile', 'Profile'),
+        ('soap_note', 'SOAP Note'),
+        ('lab_report', 'Lab Report'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='chunks')
+    source_type = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    source_id = models.PositiveBigIntegerField(default=0, help_text="SOAPNote/LabReport ID, 0 for profile fields")
+    position = models.PositiveIntegerField(help_text="Order of the chunk within its source")
+    text = models.TextField()
+    model_name = models.CharField(max_length=100)
+    dimension = models.PositiveIntegerField()
+    vector = models.BinaryField(help_text="Little-endian float32 bytes of the chunk embedding")
+    text_hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('patient', 'model_name', 'source_type', 'source_id', 'position')
+
+    def __str__(self):
+        return f"{self.get_source_type_display()} chunk {self.position} for {self.patient}"
+
 class LabReport(models.Model):
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='lab_reports')
     title = models.CharField(max_length=200)
@@ -57,31 +95,9 @@ class LabReport(models.Model):
         super().save(*args, **kwargs)
         
         if self.file and self.file.name:
-            import os
-            try:
-                with self.file.open('rb') as f:
-                    ext = os.path.splitext(self.file.name)[1].lower()
-                    text = None
-                    if ext == '.pdf':
-                        try:
-                            from pypdf import PdfReader
-                            reader = PdfReader(f)
-                            text = "\n".join([page.extract_text() or "" for page in reader.pages])
-                        except ImportError:
-                            pass
-                    elif ext in ['.txt', '.csv']:
-                        text = f.read().decode('utf-8', errors='ignore')
-
-                    if text is not None and text != self.extracted_text:
-                        self.extracted_text = text[:15000]  # Limit to 15k chars for embedding
-                        LabReport.objects.filter(pk=self.pk).update(extracted_text=self.extracted_text)
-                        
-                        # Invalidate Patient embedding so it regenerates with this new document
-                        self.patient.embedding_json = None
-                        self.patient.save(update_fields=['embedding_json'])
-            except Exception as e:
-                import logging
-                logging.getLogger(__name__).error(f"Error extracting text from LabReport: {e}")
+            from jobs.queue import enqueue
+            # Extracted by a background job, which re-embeds the patient once the text is in
+            enqueue('lab_report_text', {'lab_report_id': self.pk}, key=f"lab_report:{self.pk}")
 
     def __str__(self):
         return f"{self.title} for {self.patient}"
@@ -146,10 +162,50 @@ import time
 
 logger = logging.getLogger(__name__)
 
+# Prescription OCR models, in order of preference when all are healthy
+OCR_MODEL_CHAIN = ['gemini-2.5-flash', 'gemini-2.5-flash-lite', 'gemini-2.0-flash', 'gemini-1.5-flash']
+# Start of the error of an upload every model failed on (quota, outage), which is worth retrying
+OCR_ALL_MODELS_FAILED = "All AI models failed"
+
+def extract_lab_report_text(lab_report_id):
+    """
+    Extracts the text of an uploaded PDF or text lab report into extracted_text and queues a
+    re-embed of the patient when it changed. Returns True if the text changed.
+    """
+    from .models import LabReport
+
+    report = LabReport.objects.filter(pk=lab_report_id).first()
+    if report is None or not report.file or not report.file.name:
+        return False
+
+    with report.file.open('rb') as f:
+        ext = os.path.splitext(report.file.name)[1].lower()
+        text = None
+        if ext == '.pdf':
+            try:
+                from pypdf import PdfReader
+                reader = PdfReader(f)
+                text = "\n".join([page.extract_text() or "" for page in reader.pages])
+            except ImportError:
+                pass
+        elif ext in ['.txt', '.csv']:
+            text = f.read().decode('utf-8', errors='ignore')
+
+    if text is None:
+        return False
+    text = text[:15000]  # Limit to 15k chars for embedding
+    if text == report.extracted_text:
+        return False
+    LabReport.objects.filter(pk=report.pk).update(extracted_text=text)
+    # update() sends no post_save, so the patient's re-embed is queued here
+    from ai_chat.signals import schedule_refresh
+    schedule_refresh(report.patient_id)
+    return True
+
 def run_prescription_ocr(prescription_id, api_key=None):
     """
     Core OCR extraction logic using the new google.genai SDK.
-    Includes retry with exponential backoff for rate-limit (429) errors.
+    Tries the models of OCR_MODEL_CHAIN in order of recent health, skipping open circuits.
     Returns (success: bool, error_message: str | None).
     """
     from .models import Prescription, Medicine
@@ -174,12 +230,16 @@ def run_prescription_ocr(prescription_id, api_key=None):
     Prescription.objects.filter(pk=prescription_id).update(ocr_status='processing', ocr_error=None)
 
     try:
-        from google import genai
         from google.genai import types
         from PIL import Image
         import io
+        from ai_chat.genai_clients import genai_client
+        from ai_chat.model_health import classify_error, ocr_model_health
+        from ai_chat.rate_limits import RateLimited, rate_limiter
+        from django.conf import settings
+        from .ocr import OCRTimeout, hedged_generate, parse_medicines_json
 
-        client = genai.Client(api_key=api_key)
+        client = genai_client(api_key)
 
         # Read the image bytes from the FileField
         with instance.image.open('rb') as f:
@@ -217,47 +277,64 @@ def run_prescription_ocr(prescription_id, api_key=None):
 
         image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
 
-        # Model fallback chain with retry for rate-limit/server errors
-        model_chain = ['gemini-2.5-flash', 'gemini-2.5-flash-lite', 'gemini-2.0-flash', 'gemini-1.5-flash']
-        response = None
+        config = types.GenerateContentConfig(
+            thinking_config=types.ThinkingConfig(
+                thinking_budget=0
+            )
+        )
+
+        # Fallback chain, healthiest model first. A model that keeps failing, or that the API
+        # reports as missing or out of quota for this key, is skipped until its circuit closes again,
+        # so during an incident an upload makes one attempt per working model instead of sleeping on retries.
+        models_to_try = ocr_model_health.order(OCR_MODEL_CHAIN, api_key=api_key)
+        response_text = None
         last_error = None
 
-        for model_name in model_chain:
-            max_retries = 3
-            for attempt in range(max_retries):
+        if getattr(settings, 'AI_OCR_HEDGE', False) and len(models_to_try) > 1:
+            # Hedged: a slow primary is raced against the next model, first valid answer wins
+            try:
+                _, response_text, medicines_data = hedged_generate(
+                    client, api_key, models_to_try, [prompt, image_part], config
+                )
+            except (json.JSONDecodeError, OCRTimeout):
+                # A timed-out upload is marked failed below rather than retried; retry-ocr can resend it
+                raise
+            except Exception as e:
+                last_error = e
+        else:
+            for model_name in models_to_try:
+                try:
+                    # Queues behind other uploads using this key; raises RateLimited if the wait is too long
+                    rate_limiter.acquire(api_key, 'ocr')
+                except RateLimited as e:
+                    last_error = e
+                    break
+                started = time.monotonic()
                 try:
-                    logger.info(f"Attempting OCR with model={model_name}, attempt={attempt+1}")
+                    logger.info(f"Attempting OCR with model={model_name}")
                     response = client.models.generate_content(
                         model=model_name,
                         contents=[prompt, image_part],
-                        config=types.GenerateContentConfig(
-                            thinking_config=types.ThinkingConfig(
-                                thinking_budget=0
-                            )
-                        )
+                        config=config
                     )
-                    last_error = None
-                    break  # Success
+                    # Clean markdown JSON block formatting if present, and parse the JSON; an answer
+                    # that is not a medicine list counts as a failure of the model
+                    response_text, medicines_data = parse_medicines_json(response.text)
                 except Exception as e:
                     last_error = e
-                    err_str = str(e).lower()
-                    if "429" in err_str or "quota" in err_str or "rate" in err_str or "resource" in err_str or "503" in err_str or "unavailable" in err_str or "overloaded" in err_str:
-                        wait_time = (2 ** attempt) * 2  # 2s, 4s, 8s
-                        logger.warning(f"Temporary error on {model_name} (attempt {attempt+1}): {e}, retrying in {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-                    elif "404" in err_str or "not found" in err_str or "not supported" in err_str:
-                        logger.warning(f"Model {model_name} not available, trying next fallback...")
-                        break  # Try next model
-                    else:
-                        logger.error(f"Unexpected error with {model_name}: {e}")
-                        break  # Try next model
-
-            if response is not None:
+                    failure = classify_error(e)
+                    ocr_model_health.record_failure(model_name, failure, time.monotonic() - started, api_key=api_key)
+                    logger.warning(f"OCR with {model_name} failed ({failure}): {e}, trying next fallback...")
+                    continue
+                ocr_model_health.record_success(model_name, time.monotonic() - started, api_key=api_key)
+                last_error = None
                 break
 
-        if response is None:
-            error_msg = f"All AI models failed. Last error: {last_error}"
+        if isinstance(last_error, json.JSONDecodeError):
+            # The last model answered, but not with a medicine list
+            raise last_error
+        if response_text is None:
+            error_msg = f"{OCR_ALL_MODELS_FAILED}. Last error: {last_error}"
             logger.error(error_msg)
             Prescription.objects.filter(pk=prescription_id).update(
                 ocr_status='failed',
@@ -265,20 +342,6 @@ def run_prescription_ocr(prescription_id, api_key=None):
             )
             return False, error_msg
 
-        response_text = response.text.strip()
-
-        # Clean markdown JSON block formatting if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        elif response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-
-        # Parse the JSON
-        medicines_data = json.loads(response_text)
-
         # Save the extracted text and mark as completed
         Prescription.objects.filter(pk=prescription_id).update(
             extracted_text=response_text,
@@ -338,10 +401,10 @@ def run_prescription_ocr(prescription_id, api_key=None):
 def extract_prescription_medicines(sender, instance, created, **kwargs):
     """Trigger OCR extraction when a new prescription is created."""
     if created and instance.image:
-        import threading
-        from users.context import gemini_api_key_var
-        api_key = gemini_api_key_var.get()
-        # Run in a background thread so the HTTP response isn't blocked
-        thread = threading.Thread(target=run_prescription_ocr, args=(instance.pk, api_key))
-        thread.daemon = True
-        thread.start()
+        from jobs.queue import QueueFull, enqueue
+        from .job_handlers import QUEUE_FULL_ERROR
+        # Queued as a durable background job so the HTTP response isn't blocked
+        try:
+            enqueue('prescription_ocr', {'prescription_id': instance.pk}, key=f"prescription:{instance.pk}")
+        except QueueFull:
+            Prescription.objects.filter(pk=instance.pk).update(ocr_status='failed', ocr_error=QUEUE_FULL_ERROR)
@@ -0,0 +1,213 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Below this many timed successes of the primary model, AI_OCR_HEDGE_DELAY is used instead of its percentile
+HEDGE_MIN_SAMPLES = 5
+
+
+class OCRTimeout(TimeoutError):
+    """A hedged OCR request did not finish within AI_OCR_TIMEOUT; every model call was cancelled."""
+
+
+def parse_medicines_json(response_text: str) -> tuple[str, list]:
+    """
+    Strips markdown code fences from a model answer and parses the medicine list.
+    Returns (cleaned text, medicines); raises json.JSONDecodeError if it is not a JSON array.
+    """
+    response_text = (response_text or '').strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    elif response_text.startswith("```"):
+        response_text = response_text[3:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
+
+    medicines = json.loads(response_text)
+    if not isinstance(medicines, list):
+        raise json.JSONDecodeError("Expected a JSON array of medicines", response_text, 0)
+    return response_text, medicines
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """
+    One event loop for all hedged requests, running on its own thread. The shared genai
+    client's async HTTP pool is bound to the loop that first used it, so every hedge has to
+    run on the same one rather than on a fresh asyncio.run() loop per upload.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='ocr-hedging', daemon=True).start()
+    return _loop
+
+
+def hedge_delay(model_name: str) -> float:
+    """Seconds to wait for the primary model before hedging: its AI_OCR_HEDGE_PERCENTILE latency."""
+    from ai_chat.model_health import ocr_model_health
+
+    percentile = ocr_model_health.latency_percentile(
+        model_name, getattr(settings, 'AI_OCR_HEDGE_PERCENTILE', 95), min_samples=HEDGE_MIN_SAMPLES
+    )
+    return percentile if percentile is not None else getattr(settings, 'AI_OCR_HEDGE_DELAY', 10.0)
+
+
+async def _attempt(client, api_key: str, model_name: str, contents, config) -> tuple[str, str, list]:
+    from ai_chat.model_health import classify_error, ocr_model_health
+
+    started = time.monotonic()
+    try:
+        logger.info(f"Attempting hedged OCR with model={model_name}")
+        response = await client.aio.models.generate_content(model=model_name, contents=contents, config=config)
+        # A model that answered with something other than a medicine list fails and does not win the race
+        response_text, medicines = parse_medicines_json(response.text)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        failure = classify_error(e)
+        ocr_model_health.record_failure(model_name, failure, time.monotonic() - started, api_key=api_key)
+        logger.warning(f"Hedged OCR with {model_name} failed ({failure}): {e}")
+        raise
+    ocr_model_health.record_success(model_name, time.monotonic() - started, api_key=api_key)
+    return model_name, response_text, medicines
+
+
+async def _hedged(client, api_key: str, models: list[str], contents, config, delay: float):
+    from ai_chat import metrics
+    from ai_chat.model_health import ocr_model_health
+    from ai_chat.rate_limits import RateLimited, rate_limiter
+
+    remaining = list(models)
+    pending = {}  # task -> (model, launched at)
+    hedged = False
+    last_error = None
+
+    async def launch(wait: bool = True):
+        # Budget is taken before a request's clock starts, so queueing for it never counts
+        # towards the hedge delay. Waiting blocks, so it happens on a worker thread; with
+        # wait=False the request is only sent if the key has budget right now.
+        if wait:
+            await asyncio.to_thread(rate_limiter.acquire, api_key, 'ocr')
+        else:
+            rate_limiter.acquire(api_key, 'ocr', timeout=0)
+        model_name = remaining.pop(0)
+        task = asyncio.ensure_future(_attempt(client, api_key, model_name, contents, config))
+        pending[task] = (model_name, time.monotonic())
+
+    try:
+        # RateLimited from a waiting launch ends the request; it is not a model failure
+        await launch()
+        while pending:
+            timeout = None
+            if not hedged and remaining:
+                oldest = min(launched for _, launched in pending.values())
+                timeout = max(delay - (time.monotonic() - oldest), 0.0)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                # The primary is slower than its usual tail: race the next model against it,
+                # unless that would mean waiting for budget
+                hedged = True
+                try:
+                    await launch(wait=False)
+                except RateLimited:
+                    continue
+                metrics.incr('ocr.hedge.launched')
+                continue
+
+            for task in done:
+                model_name, launched = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+
+                for loser in pending:
+                    loser.cancel()
+                if pending:
+                    metrics.incr('ocr.hedge.cancelled', len(pending))
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    primary, primary_launched = min(pending.values(), key=lambda item: item[1])
+                    if primary_launched < launched:
+                        # The hedge beat a primary that was still running; estimate what waiting would
+                        # have cost from the primary's past latencies beyond the time it had already run
+                        metrics.incr('ocr.hedge.won')
+                        elapsed = time.monotonic() - primary_launched
+                        expected = ocr_model_health.mean_latency_above(primary, elapsed)
+                        if expected is not None:
+                            metrics.incr('ocr.hedge.saved_ms', int((expected - elapsed) * 1000))
+                return result
+
+            # Failures: keep one request in flight (two once hedged) while models remain. A request
+            # still running makes waiting for budget pointless, so a replacement then only goes
+            # out if budget is free
+            while remaining and len(pending) < (2 if hedged else 1):
+                if not pending:
+                    await launch()
+                    continue
+                try:
+                    await launch(wait=False)
+                except RateLimited:
+                    break
+
+        raise last_error
+    finally:
+        # Also reached when the caller's deadline cancels the race: no model call outlives it
+        for task in pending:
+            task.cancel()
+
+
+def hedged_generate(client, api_key: str, models: list[str], contents, config,
+                    timeout: float | None = None) -> tuple[str, str, list]:
+    """
+    Sends the OCR request to models[0]; if no answer has arrived after the primary's usual
+    tail latency (hedge_delay), sends the same request to the next model and keeps whichever
+    valid medicine list arrives first, cancelling the other request. A failed request is
+    replaced by the next model at once. Returns (model, cleaned response text, medicines) and
+    raises the last error if every model fails, or RateLimited if the key's OCR budget runs out.
+    Raises OCRTimeout once `timeout` seconds (AI_OCR_TIMEOUT by default) have passed.
+    """
+    from ai_chat import metrics
+
+    timeout = getattr(settings, 'AI_OCR_TIMEOUT', 300.0) if timeout is None else timeout
+    metrics.incr('ocr.hedge.requests')
+    delay = hedge_delay(models[0])
+    future = asyncio.run_coroutine_threadsafe(_hedged(client, api_key, models, contents, config, delay), _event_loop())
+    try:
+        return future.result(timeout=timeout)
+    except concurrent.futures.TimeoutError:
+        # Cancelling the race cancels every model call still in flight
+        future.cancel()
+        metrics.incr('ocr.hedge.timed_out')
+        raise OCRTimeout(f"OCR did not finish within {timeout:g}s") from None
+
+
+def hedge_stats() -> dict:
+    from ai_chat import metrics
+
+    requests = metrics.get('ocr.hedge.requests')
+    launched = metrics.get('ocr.hedge.launched')
+    won = metrics.get('ocr.hedge.won')
+    return {
+        'requests': requests,
+        'hedges': launched,
+        'hedge_rate': round(launched / requests, 4) if requests else 0.0,
+        # Hedges that beat the primary; the rest only cost an extra request
+        'hedges_won': won,
+        'estimated_saved_ms': metrics.get('ocr.hedge.saved_ms'),
+        'timed_out': metrics.get('ocr.hedge.timed_out'),
+    }
@@ -1,3 +1,68 @@
-from django.test import TestCase
+import asyncio
+import json
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from ai_chat import metrics
+from ai_chat.model_health import ocr_model_health
+from .ocr import hedged_generate
+
+
+class FakeAsyncModels:
+    """Stands in for client.aio.models: answers each model after its delay, recording cancellations."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.cancelled = []
+
+    async def generate_content(self, model, contents, config):
+        delay, text = self.answers[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        return SimpleNamespace(text=text)
+
+
+@override_settings(AI_OCR_HEDGE_DELAY=0.05, AI_RATE_LIMIT_ENABLED=False)
+class HedgedOCRTests(SimpleTestCase):
+    medicines = json.dumps([{"name": "Amoxicillin", "dosage": "500mg"}])
+
+    def setUp(self):
+        metrics.reset()
+        ocr_model_health.reset()
+        self.addCleanup(ocr_model_health.reset)
+
+    def generate(self, answers):
+        models = FakeAsyncModels(answers)
+        client = SimpleNamespace(aio=SimpleNamespace(models=models))
+        return hedged_generate(client, 'key', list(answers), ['prompt'], None, timeout=10), models
+
+    def test_hedge_beats_slow_primary(self):
+        # Past calls of the primary took 2s, below HEDGE_MIN_SAMPLES so the fixed delay applies
+        for _ in range(3):
+            ocr_model_health.record_success('primary', 2.0, api_key='key')
+
+        (model, _, medicines), models = self.generate({'primary': (5.0, self.medicines),
+                                                       'fallback': (0.0, self.medicines)})
+
+        self.assertEqual(model, 'fallback')
+        self.assertEqual(medicines[0]['name'], "Amoxicillin")
+        self.assertEqual(models.cancelled, ['primary'])
+        self.assertEqual(metrics.get('ocr.hedge.launched'), 1)
+        self.assertEqual(metrics.get('ocr.hedge.won'), 1)
+        self.assertEqual(metrics.get('ocr.hedge.cancelled'), 1)
+        self.assertGreater(metrics.get('ocr.hedge.saved_ms'), 1000)
+
+    def test_invalid_answer_is_a_failure_not_a_win(self):
+        with self.assertLogs('patients.ocr', 'WARNING'):
+            (model, _, _), _ = self.generate({'primary': (0.0, "Sorry, I cannot read this."),
+                                              'fallback': (0.0, self.medicines)})
+
+        self.assertEqual(model, 'fallback')
+        stats = ocr_model_health.stats()
+        self.assertEqual(stats['primary']['last_failure'], 'error')
+        self.assertEqual(stats['primary']['success_rate'], 0.5)
+        self.assertEqual(metrics.get('circuit.ocr.primary.success'), 0)
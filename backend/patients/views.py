@@ -79,23 +79,24 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_200_OK
             )
         
-        from .models import run_prescription_ocr
-        from users.context import gemini_api_key_var
-        import threading
+        from jobs.queue import QueueFull, enqueue
+        from .job_handlers import QUEUE_FULL_ERROR
         
-        # Reset status
-        Prescription.objects.filter(pk=prescription.pk).update(ocr_status='processing', ocr_error=None)
+        # Reset status; the OCR job marks it processing when a worker picks it up
+        Prescription.objects.filter(pk=prescription.pk).update(ocr_status='pending', ocr_error=None)
         
-        # Capture API key context
-        api_key = gemini_api_key_var.get()
-        
-        # Run in background thread
-        thread = threading.Thread(target=run_prescription_ocr, args=(prescription.pk, api_key))
-        thread.daemon = True
-        thread.start()
+        try:
+            enqueue('prescription_ocr', {'prescription_id': prescription.pk}, key=f"prescription:{prescription.pk}", restart=True)
+        except QueueFull:
+            Prescription.objects.filter(pk=prescription.pk).update(ocr_status='failed', ocr_error=QUEUE_FULL_ERROR)
+            return Response(
+                {"detail": QUEUE_FULL_ERROR, "ocr_status": "failed"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "60"}
+            )
         
         return Response(
-            {"detail": "OCR re-triggered. Poll the status endpoint to check progress.", "ocr_status": "processing"},
+            {"detail": "OCR re-triggered. Poll the status endpoint to check progress.", "ocr_status": "pending"},
             status=status.HTTP_202_ACCEPTED
         )
 
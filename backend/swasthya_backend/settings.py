@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 import dj_database_url
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
     'employees',
     'appointments',
     'ai_chat',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -154,3 +156,91 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': False,
     'BLACKLIST_AFTER_ROTATION': False,
 }
+
+# --- Background jobs ---
+# OCR, lab report text extraction and re-embedding run as durable jobs (jobs.Job). Run
+# `python manage.py run_workers` for them, or let each web process run its own workers
+# (started on its first request). With False, run_workers is required or jobs never run.
+JOB_WORKERS_IN_PROCESS = os.getenv('JOB_WORKERS_IN_PROCESS', 'True') == 'True'
+# How often idle workers look for due jobs, and how long a stopping worker lets running jobs finish
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '2'))
+JOB_DRAIN_TIMEOUT = float(os.getenv('JOB_DRAIN_TIMEOUT', '30'))
+
+# --- AI / RAG ---
+# Embedding backend: 'gemini', 'local' (offline deterministic hashing vectors for tests,
+# benchmarks and air-gapped machines) or the dotted path of an EmbeddingProvider subclass.
+# AI_EMBEDDING_OPTIONS is a JSON object of constructor options, e.g. {"dimension": 384} for local.
+AI_EMBEDDING_PROVIDER = os.getenv('AI_EMBEDDING_PROVIDER', 'gemini')
+AI_EMBEDDING_OPTIONS = json.loads(os.getenv('AI_EMBEDDING_OPTIONS', '{}'))
+# How often (seconds) each process re-checks the database for embeddings written by other processes
+AI_INDEX_REFRESH_SECONDS = float(os.getenv('AI_INDEX_REFRESH_SECONDS', '30'))
+# Debounce for background re-embedding after record changes: wait this long after the last
+# change to a patient, but never longer than the max delay after the first one
+AI_EMBEDDING_REFRESH_DELAY = float(os.getenv('AI_EMBEDDING_REFRESH_DELAY', '30'))
+AI_EMBEDDING_REFRESH_MAX_DELAY = float(os.getenv('AI_EMBEDDING_REFRESH_MAX_DELAY', '120'))
+# How chunk scores are combined into a patient score: 'max' (best passage) or 'sum' (rewards many matching passages)
+AI_CHUNK_POOLING = os.getenv('AI_CHUNK_POOLING', 'max')
+# Patient search: 'hybrid' (BM25 + vectors fused by reciprocal rank), 'semantic' or 'lexical' (no API calls)
+AI_SEARCH_MODE = os.getenv('AI_SEARCH_MODE', 'hybrid')
+AI_RRF_K = int(os.getenv('AI_RRF_K', '60'))
+# Second-stage reranking of the best fused candidates: 'local' (field-weighted BM25 + recency),
+# 'cross-encoder' (needs sentence-transformers), 'none', or the dotted path of a Reranker subclass
+AI_RERANKER = os.getenv('AI_RERANKER', 'local')
+AI_RERANKER_OPTIONS = json.loads(os.getenv('AI_RERANKER_OPTIONS', '{}'))
+AI_RERANK_CANDIDATES = int(os.getenv('AI_RERANK_CANDIDATES', '50'))
+# Hospitals searched concurrently by a network-wide search (superusers searching every hospital)
+AI_NETWORK_SEARCH_WORKERS = int(os.getenv('AI_NETWORK_SEARCH_WORKERS', '8'))
+# Gemini API clients (and chat models) kept per API key and model; each holds an HTTP connection pool
+AI_CLIENT_CACHE_SIZE = int(os.getenv('AI_CLIENT_CACHE_SIZE', '32'))
+# Per-API-key request budgets for Gemini chat, embedding and OCR calls. AI_RATE_LIMITS overrides
+# the defaults per kind, e.g. {"chat": {"per_minute": 60, "burst": 10, "max_wait": 5}}.
+# AI_RATE_LIMIT_CACHE names a CACHES alias (e.g. a Redis one) to share the budgets between processes.
+# Off by default: every model call of an agent turn takes a chat token, so size the budgets to the
+# key's real quota before enabling it.
+AI_RATE_LIMIT_ENABLED = os.getenv('AI_RATE_LIMIT_ENABLED', 'False') == 'True'
+AI_RATE_LIMITS = json.loads(os.getenv('AI_RATE_LIMITS', '{}'))
+AI_RATE_LIMIT_CACHE = os.getenv('AI_RATE_LIMIT_CACHE', '')
+# Circuit breaker of the OCR model fallback chain: a model is skipped for the cooldown after this many
+# consecutive failures (at once for missing models and exhausted quota), doubling while it keeps failing
+AI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('AI_CIRCUIT_FAILURE_THRESHOLD', '3'))
+AI_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv('AI_CIRCUIT_COOLDOWN_SECONDS', '30'))
+# Hedged OCR: if the primary model has not answered within its AI_OCR_HEDGE_PERCENTILE latency
+# (AI_OCR_HEDGE_DELAY seconds until it has a history), the next model is asked too and the first
+# valid answer wins. Costs an extra request for every hedge.
+AI_OCR_HEDGE = os.getenv('AI_OCR_HEDGE', 'False') == 'True'
+AI_OCR_HEDGE_PERCENTILE = float(os.getenv('AI_OCR_HEDGE_PERCENTILE', '95'))
+AI_OCR_HEDGE_DELAY = float(os.getenv('AI_OCR_HEDGE_DELAY', '10'))
+# Deadline in seconds for a hedged OCR request, including waits for rate limit budget
+AI_OCR_TIMEOUT = float(os.getenv('AI_OCR_TIMEOUT', '300'))
+# Prescription OCR jobs: concurrent OCR calls per worker process, and how many uploads may wait
+# before new ones are failed with a "retry later" message
+AI_OCR_WORKERS = int(os.getenv('AI_OCR_WORKERS', '2'))
+AI_OCR_QUEUE_SIZE = int(os.getenv('AI_OCR_QUEUE_SIZE', '100'))
+# On-disk IVF indexes written by `manage.py build_ann_index`, and how many lists each search probes.
+# Kept outside MEDIA_ROOT: everything there is downloadable through the public /media/ route.
+AI_ANN_DIR = Path(os.getenv('AI_ANN_DIR', BASE_DIR / 'var' / 'ann'))
+AI_ANN_NPROBE = int(os.getenv('AI_ANN_NPROBE', '8'))
+# In-memory index precision: 'none' (float32), 'float16' (half the memory) or 'int8' (a quarter,
+# per-row scales). Quantized matches are rescored from the stored float32 vectors of the top candidates.
+AI_INDEX_QUANTIZATION = os.getenv('AI_INDEX_QUANTIZATION', 'none')
+AI_INDEX_RESCORE_CANDIDATES = int(os.getenv('AI_INDEX_RESCORE_CANDIDATES', '200'))
+# Serve embedding indexes from generations published by `manage.py publish_embedding_index`,
+# memory-mapped and shared by every worker instead of one private copy per process (outside MEDIA_ROOT, like AI_ANN_DIR)
+AI_SHARED_INDEX = os.getenv('AI_SHARED_INDEX', 'False') == 'True'
+AI_SHARED_INDEX_DIR = Path(os.getenv('AI_SHARED_INDEX_DIR', BASE_DIR / 'var' / 'index'))
+
+# Query embedding cache. Defaults to a per-process LRU (locmem); point the backend at
+# e.g. django.core.cache.backends.redis.RedisCache to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'embeddings': {
+        'BACKEND': os.getenv('AI_EMBEDDING_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('AI_EMBEDDING_CACHE_LOCATION', 'query-embeddings'),
+        'TIMEOUT': int(os.getenv('AI_EMBEDDING_CACHE_TTL', '86400')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('AI_EMBEDDING_CACHE_MAX_ENTRIES', '5000')),
+        },
+    },
+}
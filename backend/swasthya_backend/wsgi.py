@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swasthya_backend.settings')
 
 application = get_wsgi_application()
+
+# Background jobs (OCR, lab report text, re-embedding) run in this process unless
+# JOB_WORKERS_IN_PROCESS is off, in which case `manage.py run_workers` must run them.
+# They start on the first request, so every forked server worker gets its own threads.
+from django.core.signals import request_started  # noqa: E402
+
+from jobs.worker import start_in_process_workers  # noqa: E402
+
+request_started.connect(start_in_process_workers, dispatch_uid='start_in_process_workers')
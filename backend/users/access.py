@@ -0,0 +1,19 @@
+from employees.models import Employee
+from hospitals.models import Hospital
+
+
+def accessible_hospital_ids(user) -> list[int]:
+    """
+    Hospitals whose patient records the user may search. Superusers administer the whole
+    network; other users are linked to a hospital through the active employee record
+    that shares their email address.
+    """
+    if user is None or not user.is_authenticated:
+        return []
+    if user.is_superuser:
+        return list(Hospital.objects.order_by('pk').values_list('pk', flat=True))
+    if not user.email:
+        return []
+    return sorted(set(
+        Employee.objects.filter(email__iexact=user.email, is_active=True).values_list('hospital_id', flat=True)
+    ))
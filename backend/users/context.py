@@ -15,3 +15,25 @@ def get_gemini_api_key():
     if not key:
         key = os.getenv('GEMINI_API_KEY')
     return key
+
+# The user whose profile supplied gemini_api_key_var, so background jobs can run with the same key
+# without storing it; None when the request uses the server key
+gemini_api_key_owner_var = contextvars.ContextVar('gemini_api_key_owner', default=None)
+
+def gemini_api_key_for(user_id):
+    """
+    Resolves the Gemini API key of a background job queued by `user_id`: that user's
+    current profile key, else the server environment's default GEMINI_API_KEY.
+    """
+    key = None
+    if user_id is not None:
+        from .models import UserProfile
+        key = UserProfile.objects.filter(user_id=user_id).values_list('gemini_api_key', flat=True).first()
+    return key or os.getenv('GEMINI_API_KEY')
+
+# The authenticated user of the current chat request, for tools that must enforce access rights
+current_user_var = contextvars.ContextVar('current_user', default=None)
+
+def get_current_user():
+    """Returns the user bound to the current request context, or None outside a request."""
+    return current_user_var.get()
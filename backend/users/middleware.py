@@ -1,6 +1,6 @@
 import os
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from .context import gemini_api_key_var
+from .context import gemini_api_key_owner_var, gemini_api_key_var
 from .models import UserProfile
 
 class GeminiApiKeyMiddleware:
@@ -13,6 +13,7 @@ class GeminiApiKeyMiddleware:
 
     def __call__(self, request):
         api_key = None
+        api_key_owner = None
         
         try:
             # Check for JWT authorization header
@@ -26,14 +27,17 @@ class GeminiApiKeyMiddleware:
                     profile = UserProfile.objects.filter(user=user).first()
                     if profile and profile.gemini_api_key:
                         api_key = profile.gemini_api_key
+                        api_key_owner = user.pk
         except Exception:
             # Fail silently and let other auth / permission classes handle verification
             pass
 
         # Bind the dynamic API key to the request context
         token = gemini_api_key_var.set(api_key)
+        owner_token = gemini_api_key_owner_var.set(api_key_owner)
         try:
             return self.get_response(request)
         finally:
             # Clean up context after response is processed
+            gemini_api_key_owner_var.reset(owner_token)
             gemini_api_key_var.reset(token)